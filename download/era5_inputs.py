@@ -0,0 +1,195 @@
+"""Lazy loading of ERA5 NetCDF downloads as GraphCast inputs.
+
+Shared by preprocess13 and preprocess37. The files are opened with dask, using
+the chunking of the NetCDF files, and every step up to the final load (variable
+and level selection, renaming, merging, reversing the latitudes...) is lazy, so
+only the selected data is read, and it is materialized once, as contiguous
+float32 arrays.
+
+The TOA incident solar radiation is looked up in the ERA5 download of
+`download_toa.py`, which is opened once per process.
+"""
+import functools
+import os
+
+from graphcast import solar_radiation
+import numpy as np
+import xarray
+
+TOA_PATH = 'download/toa.nc'
+
+PRESSURE_LEVEL_RENAME_MAP = {
+    'z': 'geopotential',
+    'q': 'specific_humidity',
+    't': 'temperature',
+    'u': 'u_component_of_wind',
+    'v': 'v_component_of_wind',
+    'w': 'vertical_velocity',
+}
+SINGLE_LEVEL_RENAME_MAP = {
+    'u10': '10m_u_component_of_wind',
+    'v10': '10m_v_component_of_wind',
+    't2m': '2m_temperature',
+    'z': 'geopotential_at_surface',
+    'lsm': 'land_sea_mask',
+    'msl': 'mean_sea_level_pressure',
+}
+ACCUMULATED_RENAME_MAP = {
+    'tp': 'total_precipitation_6hr',
+}
+STATIC_VARIABLES = ('geopotential_at_surface', 'land_sea_mask')
+
+_DIMS_RENAME_MAP = {
+    'valid_time': 'time',
+    'pressure_level': 'level',
+    'latitude': 'lat',
+    'longitude': 'lon',
+}
+
+
+def _open(path, variables):
+    # `chunks={}` uses the chunks of the file, nothing is read until loaded.
+    ds = xarray.open_dataset(path, chunks={})
+    ds = ds[[name for name in variables if name in ds]]
+    return ds.drop_vars(['expver', 'number'], errors='ignore')
+
+
+def _ascending(ds, dim):
+    values = ds[dim].values
+    if np.all(np.diff(values) >= 0):
+        return ds
+    if np.all(np.diff(values) < 0):
+        # A reversed view, unlike `sortby` which gathers every variable.
+        return ds.isel({dim: slice(None, None, -1)})
+    return ds.isel({dim: np.argsort(values, kind='stable')})
+
+
+def open_inputs(pressure_level_path, single_level_path, accumulated_path=None,
+                levels=None):
+    """Returns the inputs in the downloaded files, as a lazy dataset.
+
+    Args:
+        pressure_level_path: NetCDF file with the pressure level variables.
+        single_level_path: NetCDF file with the instantaneous single level
+            variables, including the static ones.
+        accumulated_path: Optional NetCDF file with hourly accumulated total
+            precipitation, which is summed over 6 hours.
+        levels: Optional pressure levels to select, all levels otherwise.
+
+    Returns:
+        Dataset with a "batch" dimension of size 1, ascending "lat" and "level"
+        coordinates and static variables without "batch" and "time", whose
+        variables are dask arrays.
+    """
+    pressure_level_ds = _open(pressure_level_path, PRESSURE_LEVEL_RENAME_MAP)
+    if levels is not None:
+        pressure_level_ds = pressure_level_ds.sel(pressure_level=list(levels))
+    single_level_ds = _open(single_level_path, SINGLE_LEVEL_RENAME_MAP)
+    rename_map = dict(SINGLE_LEVEL_RENAME_MAP)
+    if accumulated_path is not None:
+        accumulated_ds = _open(accumulated_path, ACCUMULATED_RENAME_MAP)
+        single_level_ds['tp'] = accumulated_ds['tp'].coarsen(
+            valid_time=6, boundary='trim').sum()
+        rename_map.update(ACCUMULATED_RENAME_MAP)
+
+    ds = xarray.merge(
+        [single_level_ds.rename_vars(rename_map),
+         pressure_level_ds.rename_vars(PRESSURE_LEVEL_RENAME_MAP)],
+        compat='no_conflicts', join='outer')
+    ds = ds.rename(_DIMS_RENAME_MAP)
+    ds = _ascending(_ascending(ds, 'lat'), 'level')
+
+    names = list(ds.data_vars)
+    static = {name: ds[name].isel(time=0, drop=True)
+              for name in STATIC_VARIABLES}
+    ds = ds.drop_vars(STATIC_VARIABLES).expand_dims('batch').assign(static)
+    ds = ds[names]
+    return ds.assign_coords({
+        'lat': ds.lat.astype('float32'),
+        'lon': ds.lon.astype('float32'),
+        'level': ds.level.astype('int32'),
+    })
+
+
+def load_inputs(pressure_level_path, single_level_path, accumulated_path=None,
+                levels=None):
+    """Like `open_inputs`, but loaded into contiguous float32 numpy arrays."""
+    ds = open_inputs(pressure_level_path, single_level_path,
+                     accumulated_path=accumulated_path, levels=levels)
+    ds = ds.astype('float32').load()
+    for name in ds.data_vars:
+        # Reversed latitudes are still a view when read as a single chunk.
+        ds[name].data = np.ascontiguousarray(ds[name].data)
+    return ds
+
+
+def toa_incident_solar_radiation(times, lat, lon, path=TOA_PATH):
+    """Returns the TOA incident solar radiation at `times` on a lat/lon grid.
+
+    Times are matched to the download at `path` by month, day and hour, so a
+    download for one year serves the others too. Times it does not cover (all
+    of them, if there is no download) are computed with
+    `solar_radiation.get_toa_incident_solar_radiation` instead.
+
+    Args:
+        times: Timestamps of the radiation.
+        lat: Ascending latitudes of the grid, matching the download.
+        lon: Longitudes of the grid, matching the download.
+        path: ERA5 "tisr" NetCDF file.
+
+    Returns:
+        DataArray with dimensions (time, lat, lon).
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    values = np.empty((len(times), len(lat), len(lon)), dtype=np.float32)
+    covered = np.zeros(len(times), dtype=bool)
+    if os.path.exists(path):
+        tisr, sorted_keys, order, descending = _open_toa(path)
+        keys = _month_day_hour_keys(times)
+        positions = np.minimum(
+            np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        covered = sorted_keys[positions] == keys
+        if covered.any() and tisr.shape[1:] != values.shape[1:]:
+            raise ValueError(
+                f'The grid of {path} {tisr.shape[1:]} does not match the '
+                f'requested grid {values.shape[1:]}.')
+        # Planes are read one by one, and latitudes flipped in memory, which
+        # is much faster than fancy or reversed indexing of the NetCDF file.
+        for i, index in zip(np.flatnonzero(covered),
+                            order[positions[covered]]):
+            plane = tisr.isel(valid_time=int(index)).values
+            values[i] = plane[::-1] if descending else plane
+    if not covered.all():
+        values[~covered] = solar_radiation.get_toa_incident_solar_radiation(
+            times[~covered], lat, lon, timestamps_per_chunk=1)
+    return xarray.DataArray(
+        values,
+        dims=['time', 'lat', 'lon'],
+        coords={'time': times, 'lat': lat, 'lon': lon},
+        name='toa_incident_solar_radiation',
+        attrs={'units': 'W/m^2',
+               'description': 'Top of atmosphere incident solar radiation'})
+
+
+@functools.lru_cache(maxsize=None)
+def _open_toa(path):
+    # Only the planes that are looked up are read from the file.
+    tisr = xarray.open_dataset(path)['tisr'].transpose(
+        'valid_time', 'latitude', 'longitude')
+    keys = _month_day_hour_keys(tisr['valid_time'].values)
+    order = np.argsort(keys, kind='stable')
+    descending = tisr['latitude'].values[0] > tisr['latitude'].values[-1]
+    return tisr, keys[order], order, descending
+
+
+def _month_day_hour_keys(times):
+    """Integer keys identifying the month, day and hour of `times`."""
+    times = np.asarray(times, dtype='datetime64[ns]')
+    months = times.astype('datetime64[M]')
+    days = times.astype('datetime64[D]')
+    month = (months - times.astype('datetime64[Y]')).astype(np.int64)
+    day = (days - months).astype(np.int64)
+    hour = (times.astype('datetime64[h]') - days).astype(np.int64)
+    return (month * 31 + day) * 24 + hour
@@ -0,0 +1,132 @@
+"""Zarr cache of the model-ready inputs and forcings of a forecast.
+
+Deriving the inputs and forcings from the raw ERA5 downloads (renaming,
+merging, casting coordinates, joining the solar radiation and computing the
+progress features) gives the same result every time for a given
+initialization, so it only needs to happen once. Each entry is a Zarr store
+holding the final (batch, time, level, lat, lon) layout, in a directory whose
+name contains a hash of the initialization datetime, the pressure levels and
+the grid, together with a `metadata.json` describing these key components.
+
+Arrays are chunked in whole (lat, lon) planes, one per batch, time and level,
+which is how `GraphCast._inputs_to_grid_node_features` stacks them into
+channels, and entries are opened lazily without dask, so only the variables
+that are used are read, when they are used.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from graphcast import graph_cache
+import numpy as np
+import pandas as pd
+import xarray
+
+# Bump when the layout of the entries, or the way they are derived, changes in
+# a way that should invalidate existing caches.
+_FORMAT_VERSION = 1
+
+_METADATA_FILENAME = 'metadata.json'
+_STORE_NAME = 'data.zarr'
+_PLANE_DIMS = ('lat', 'lon')
+
+
+def key_components(init_datetime, levels, lat, lon, **extra_key_components):
+    """Returns the json serializable key components of an entry."""
+    return {
+        'init_datetime': str(pd.Timestamp(init_datetime)),
+        'levels': [int(level) for level in levels],
+        'grid': graph_cache.grid_hash(np.asarray(lat), np.asarray(lon)),
+        **extra_key_components,
+    }
+
+
+def entry_path(cache_dir, name, components):
+    serialized = json.dumps(
+        {'format_version': _FORMAT_VERSION, **components}, sort_keys=True)
+    key = hashlib.sha256(serialized.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{name}_{key}')
+
+
+def load_or_build(cache_dir, name, components, build_fn):
+    """Opens a dataset from the cache, building and storing it on a cache miss.
+
+    Args:
+        cache_dir: Directory for the cache. If None, caching is disabled and
+            this simply returns `build_fn()`.
+        name: Name of the dataset (e.g. "inputs"), used as a prefix for the
+            directory of the cache entry.
+        components: Key components of the entry, see `key_components`.
+        build_fn: Builds the dataset on a cache miss.
+
+    Returns:
+        The dataset, lazily opened from the cache.
+    """
+    if cache_dir is None:
+        return build_fn()
+
+    path = entry_path(cache_dir, name, components)
+    if not _is_valid_entry(path, components):
+        save(path, build_fn(), components)
+    return load(path)
+
+
+def save(path, dataset, components=None):
+    """Stores `dataset` as a Zarr store chunked in (lat, lon) planes.
+
+    The entry is written to a temporary directory first and then moved into
+    place, so concurrent readers never observe a partially written entry.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix='.tmp_')
+    try:
+        dataset = dataset.drop_encoding()
+        # Uncompressed, reading a plane is then a plain file read.
+        encoding = {name: {'chunks': plane_chunks(variable),
+                           'compressors': None}
+                    for name, variable in dataset.variables.items()}
+        dataset.to_zarr(os.path.join(tmp_path, _STORE_NAME),
+                        encoding=encoding, consolidated=True)
+        # Written last, as its presence marks the entry as complete.
+        with open(os.path.join(tmp_path, _METADATA_FILENAME), 'w') as f:
+            json.dump({'format_version': _FORMAT_VERSION,
+                       'key_components': components or {}},
+                      f, sort_keys=True, indent=2)
+
+        # Replace any stale or incomplete entry.
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process stored the same entry concurrently, keep theirs.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def load(path):
+    """Opens an entry stored with `save`, without reading any variable."""
+    return xarray.open_zarr(
+        os.path.join(path, _STORE_NAME), chunks=None, consolidated=True)
+
+
+def plane_chunks(variable):
+    """Chunks of whole (lat, lon) planes, or the whole variable without them."""
+    if not set(_PLANE_DIMS) & set(variable.dims):
+        return variable.shape
+    return tuple(size if dim in _PLANE_DIMS else 1
+                 for dim, size in zip(variable.dims, variable.shape))
+
+
+def _is_valid_entry(path, components):
+    try:
+        with open(os.path.join(path, _METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return (metadata['format_version'] == _FORMAT_VERSION and
+            metadata['key_components'] == components)
@@ -11,43 +11,24 @@ from graphcast import normalization
 from graphcast import rollout
 from graphcast import xarray_jax
 from graphcast import xarray_tree
+from download import era5_inputs
+from download import input_cache
 import haiku as hk
 import jax
 import numpy as np
 import pvlib
 import xarray
 
-def calculate_toa_incident_solar_radiation(times, lat, lon):
-    if not isinstance(times, pd.DatetimeIndex):
-        times = pd.to_datetime(times)
-    toa_data = xarray.open_dataset('download/toa.nc')
-    time_coord = toa_data['valid_time'].values
-
-    time_coord_mdh = np.array([
-        f"{pd.Timestamp(d).month:02d}-{pd.Timestamp(d).day:02d}-{pd.Timestamp(d).hour:02d}"
-        for d in time_coord
-    ])
-
-    times_mdh = np.array([
-        f"{pd.Timestamp(d).month:02d}-{pd.Timestamp(d).day:02d}-{pd.Timestamp(d).hour:02d}"
-        for d in times
-    ])
+INPUT_CACHE_DIR = 'download/cache'
+LEVELS = [1,    2,    3,    5,    7,   10,   20,   30,   50,   70,  100,  125,
+          150,  175,  200,  225,  250,  300,  350,  400,  450,  500,  550,  600,
+          650,  700,  750,  775,  800,  825,  850,  875,  900,  925,  950,  975,
+          1000]
+GRID_LAT = np.linspace(-90, 90, 721, dtype=np.float32)
+GRID_LON = np.linspace(0, 359.75, 1440, dtype=np.float32)
 
-    # Compare by month-day-hour
-    mask = np.isin(time_coord_mdh, times_mdh)
-
-    # Select data where mask is True
-    toa_data = toa_data.isel(valid_time=mask)
-    toa_data = toa_data.sortby('latitude', ascending=True)
-    # Use pvlib to compute TOA irradiance
-    print(toa_data["tisr"])
-    return xarray.DataArray(
-        toa_data["tisr"],
-        dims=['time', 'lat', 'lon'],
-        coords={'time': times, 'lat': lat, 'lon': lon},
-        name='toa_incident_solar_radiation',
-        attrs={'units': 'W/m^2', 'description': 'Top of atmosphere incident solar radiation'}
-    )
+def calculate_toa_incident_solar_radiation(times, lat, lon):
+    return era5_inputs.toa_incident_solar_radiation(times, lat, lon)
 
 def compute_year_day_progress(time):
     # Convert to pandas DatetimeIndex (or Series)
@@ -73,67 +54,9 @@ def compute_year_day_progress(time):
     return year_progress_sin, year_progress_cos, day_progress_sin, day_progress_cos
 
 def get_input():
-    with open(r'download/pressure-level.nc', 'rb') as f:
-        pressure_level_ds = xarray.load_dataset(f).compute()
-    with open(r'download/single-instant.nc', 'rb') as f:
-        single_level_ds = xarray.load_dataset(f).compute()
-    with open(r'download/single-accum.nc', 'rb') as f:
-        single_level_accum_ds = xarray.load_dataset(f).compute()
-
-    single_level_ds['tp'] = single_level_accum_ds['tp'].drop_vars('expver').coarsen(valid_time=6, boundary='trim').sum()
-
-    pressure_level_rename_map = {
-        'z': 'geopotential',
-        'q': 'specific_humidity',
-        't': 'temperature',
-        'u': 'u_component_of_wind',
-        'v': 'v_component_of_wind',
-        'w': 'vertical_velocity'
-    }
-    single_level_rename_map = {
-        'u10': '10m_u_component_of_wind',
-        'v10': '10m_v_component_of_wind',
-        't2m': '2m_temperature',
-        'z':   'geopotential_at_surface',
-        'lsm': 'land_sea_mask',
-        'msl': 'mean_sea_level_pressure',
-        'tp': 'total_precipitation_6hr'
-    }
-    pressure_level_ds_renamed = pressure_level_ds.rename_vars(pressure_level_rename_map)
-    single_level_ds_renamed = single_level_ds.rename_vars(single_level_rename_map)
-    
-    single_level_ds_renamed = single_level_ds_renamed.rename({
-        'valid_time': 'time',
-        'latitude': 'lat',
-        'longitude': 'lon'
-    })
-
-    pressure_level_ds_renamed = pressure_level_ds_renamed.rename({
-        'valid_time': 'time',
-        'pressure_level': 'level',
-        'latitude': 'lat',
-        'longitude': 'lon'
-    })
-
-    # Add batch dimension (size 1) to both datasets
-    single_level_ds_renamed = single_level_ds_renamed.expand_dims('batch')
-    pressure_level_ds_renamed = pressure_level_ds_renamed.expand_dims('batch')
-
-    # Optionally convert coordinates to float32 and int32 to match target
-    single_level_ds_renamed = single_level_ds_renamed.assign_coords({
-        'lat': single_level_ds_renamed.lat.astype('float32'),
-        'lon': single_level_ds_renamed.lon.astype('float32'),
-    })
-
-    pressure_level_ds_renamed = pressure_level_ds_renamed.assign_coords({
-        'lat': pressure_level_ds_renamed.lat.astype('float32'),
-        'lon': pressure_level_ds_renamed.lon.astype('float32'),
-        'level': pressure_level_ds_renamed.level.astype('int32'),
-    })
-
-    # If you want to merge them into one dataset (variables coexist)
-    combined_ds = xarray.merge([single_level_ds_renamed, pressure_level_ds_renamed])
-    combined_ds = combined_ds.drop_vars(['expver', 'number'])
+    combined_ds = era5_inputs.load_inputs(
+        'download/pressure-level.nc', 'download/single-instant.nc',
+        accumulated_path='download/single-accum.nc')
     year_sin, year_cos, day_sin, day_cos = compute_year_day_progress(combined_ds.time.values)
     toa_irrad = calculate_toa_incident_solar_radiation(
         times=combined_ds.time.values.astype('datetime64[ns]'),
@@ -148,10 +71,6 @@ def get_input():
         'day_progress_sin': (('batch', 'time', 'lon'), np.tile(np.array(day_sin)[:, None], (1, combined_ds.sizes['lon']))[np.newaxis, :, :]),
         'day_progress_cos': (('batch', 'time', 'lon'), np.tile(np.array(day_sin)[:, None], (1, combined_ds.sizes['lon']))[np.newaxis, :, :]),
     })
-    combined_ds['geopotential_at_surface'] = combined_ds['geopotential_at_surface'].isel(batch=0, time=0)
-    combined_ds['land_sea_mask'] = combined_ds['land_sea_mask'].isel(batch=0, time=0)
-    combined_ds = combined_ds.sortby('lat', ascending=True)
-    combined_ds = combined_ds.sortby('level', ascending=True)
     return combined_ds
     
 # <xarray.Dataset> Size: 2GB
@@ -183,6 +102,30 @@ def get_input():
     # land_sea_mask                 (lat, lon) float32 4MB 1.0 1.0 1.0 ... 0.0 0.0
 
 
+def get_cached_input(init_datetime, cache_dir=INPUT_CACHE_DIR):
+    """Like `get_input`, but read from (or stored to) the Zarr input cache."""
+    def build():
+        inputs = get_input()
+        if inputs.time.values[-1] != np.datetime64(init_datetime, 'ns'):
+            raise ValueError(
+                f'The downloaded inputs end at {inputs.time.values[-1]}, '
+                f'not at the initialization time {init_datetime}.')
+        return inputs
+    components = input_cache.key_components(
+        init_datetime, LEVELS, GRID_LAT, GRID_LON)
+    return input_cache.load_or_build(cache_dir, 'inputs', components, build)
+
+
+def get_cached_forcings(year, month, day, timesteps = 48, cache_dir=INPUT_CACHE_DIR):
+    """Like `get_forcings`, but read from (or stored to) the Zarr input cache."""
+    components = input_cache.key_components(
+        datetime.datetime(year, month, day), LEVELS, GRID_LAT, GRID_LON,
+        timesteps=timesteps)
+    return input_cache.load_or_build(
+        cache_dir, 'forcings', components,
+        lambda: get_forcings(year, month, day, timesteps))
+
+
 def get_targets(timesteps = 48):
     lat = np.linspace(-90, 90, 721, dtype=np.float32)
     lon = np.linspace(0, 359.75, 1440, dtype=np.float32)
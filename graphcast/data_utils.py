@@ -13,9 +13,12 @@
 # limitations under the License.
 """Dataset utilities."""
 
-from typing import Any, Mapping, Sequence, Tuple, Union
+from typing import Any, Mapping, Optional, Sequence, Tuple, Union
 
 from graphcast import solar_radiation
+from graphcast import tisr_climatology as tisr_climatology_lib
+from graphcast import xarray_jax
+import jax.numpy as jnp
 import numpy as np
 import pandas as pd
 import xarray
@@ -181,11 +184,17 @@ def add_derived_vars(data: xarray.Dataset) -> None:
     )
 
 
-def add_tisr_var(data: xarray.Dataset) -> None:
+def add_tisr_var(
+    data: xarray.Dataset,
+    tisr_climatology: Optional[tisr_climatology_lib.TisrClimatology] = None,
+) -> None:
   """Adds TISR feature to `data` in place if missing.
 
   Args:
     data: Xarray dataset to which TISR feature will be added.
+    tisr_climatology: Optional precomputed climatology, see
+      `tisr_climatology.build`. TISR is looked up in it if it covers the grid
+      and datetimes of `data`, and computed otherwise.
 
   Raises:
     ValueError if `datetime`, 'lat', or `lon` are not in `data` coordinates.
@@ -202,9 +211,18 @@ def add_tisr_var(data: xarray.Dataset) -> None:
   # the `batch` dimension exists and has size greater than one.
   data_no_batch = data.squeeze("batch") if "batch" in data.dims else data
 
-  tisr = solar_radiation.get_toa_incident_solar_radiation_for_xarray(
-      data_no_batch, use_jit=True
-  )
+  if tisr_climatology is not None and tisr_climatology.covers(
+      np.ravel(data_no_batch.coords["datetime"].data),
+      data_no_batch.coords["lat"].data,
+      data_no_batch.coords["lon"].data,
+  ):
+    tisr = tisr_climatology.get_toa_incident_solar_radiation_for_xarray(
+        data_no_batch
+    )
+  else:
+    tisr = solar_radiation.get_toa_incident_solar_radiation_for_xarray(
+        data_no_batch, timestamps_per_chunk=1
+    )
 
   if "batch" in data.dims:
     tisr = tisr.expand_dims("batch", axis=0)
@@ -212,6 +230,75 @@ def add_tisr_var(data: xarray.Dataset) -> None:
   data.update({TISR: tisr})
 
 
+def compute_forcings(
+    datetime: xarray.DataArray,
+    *,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    forcing_variables: Sequence[str],
+    on_device: bool = False,
+    tisr_climatology: Optional[tisr_climatology_lib.TisrClimatology] = None,
+) -> xarray.Dataset:
+  """Computes the derived and TISR forcings for the given datetimes.
+
+  This can be used to compute forcings just-in-time for each chunk of a rollout
+  (see `rollout.chunked_prediction_generator`), rather than for all the target
+  times up front, e.g. by binding `lat`, `lon` and `forcing_variables` with
+  `functools.partial`.
+
+  Args:
+    datetime: Datetimes of the targets, with a "time" dimension and optionally
+      a leading "batch" dimension, e.g. the "datetime" coordinate of a targets
+      template. Its other coordinates (e.g. "time") are kept in the output.
+    lat: Latitudes of the grid, in degrees.
+    lon: Longitudes of the grid, in degrees.
+    forcing_variables: Names of the forcings to compute. These must be derived
+      variables (year and day progress) or TISR.
+    on_device: Whether to keep TISR as a device (xarray_jax) array, rather than
+      transferring it to host.
+    tisr_climatology: Optional precomputed climatology in which to look up
+      TISR, see `add_tisr_var`.
+
+  Returns:
+    Dataset with the requested forcings, without the "datetime" coordinate, as
+    returned by `extract_inputs_targets_forcings`.
+
+  Raises:
+    ValueError if any of the forcing variables cannot be computed.
+  """
+  unsupported_variables = set(forcing_variables) - _DERIVED_VARS - {TISR}
+  if unsupported_variables:
+    raise ValueError(
+        f"Cannot compute forcing variables {sorted(unsupported_variables)}.")
+
+  forcings = xarray.Dataset(
+      coords={"datetime": datetime, "lat": np.asarray(lat),
+              "lon": np.asarray(lon)})
+  if set(forcing_variables) & _DERIVED_VARS:
+    add_derived_vars(forcings)
+
+  if TISR in forcing_variables:
+    # Unlike `add_tisr_var`, this supports a "batch" dimension of any size.
+    timestamps = datetime.data.ravel()
+    if tisr_climatology is not None and tisr_climatology.covers(
+        timestamps, forcings.coords["lat"].data, forcings.coords["lon"].data):
+      tisr = tisr_climatology.get_toa_incident_solar_radiation(timestamps)
+    else:
+      tisr = solar_radiation.get_toa_incident_solar_radiation(
+          timestamps=timestamps,
+          latitude=forcings.coords["lat"].data,
+          longitude=forcings.coords["lon"].data,
+          timestamps_per_chunk=1)
+    tisr = tisr.reshape(datetime.shape + tisr.shape[1:])
+    dims = datetime.dims + ("lat", "lon")
+    if on_device:
+      forcings[TISR] = xarray_jax.Variable(dims, jnp.asarray(tisr))
+    else:
+      forcings[TISR] = xarray.Variable(dims, np.asarray(tisr))
+
+  return forcings[list(forcing_variables)].drop_vars("datetime")
+
+
 def extract_input_target_times(
     dataset: xarray.Dataset,
     input_duration: TimedeltaLike,
@@ -328,6 +415,7 @@ def extract_inputs_targets_forcings(
     pressure_levels: Tuple[int, ...],
     input_duration: TimedeltaLike,
     target_lead_times: TargetLeadTimes,
+    tisr_climatology: Optional[tisr_climatology_lib.TisrClimatology] = None,
     ) -> Tuple[xarray.Dataset, xarray.Dataset, xarray.Dataset]:
   """Extracts inputs, targets and forcings according to requirements."""
   dataset = dataset.sel(level=list(pressure_levels))
@@ -338,7 +426,7 @@ def extract_inputs_targets_forcings(
   if set(forcing_variables) & _DERIVED_VARS:
     add_derived_vars(dataset)
   if set(forcing_variables) & {TISR}:
-    add_tisr_var(dataset)
+    add_tisr_var(dataset, tisr_climatology)
 
   # `datetime` is needed by add_derived_vars but breaks autoregressive rollouts.
   dataset = dataset.drop_vars("datetime")
@@ -17,6 +17,8 @@ import datetime
 from absl.testing import absltest
 from absl.testing import parameterized
 from graphcast import data_utils
+from graphcast import solar_radiation
+from graphcast import tisr_climatology
 import numpy as np
 import xarray as xa
 
@@ -305,6 +307,85 @@ class DataUtilsTest(parameterized.TestCase):
     with self.assertRaisesRegex(ValueError, r"cannot select a dimension"):
       data_utils.add_tisr_var(data)
 
+  @parameterized.named_parameters(
+      dict(testcase_name="covered", lon=[0.0, 0.5], expect_lookup=True),
+      # Around noon at 00:00 UTC, where the computed TISR is large.
+      dict(testcase_name="other_grid", lon=[180.0, 180.5],
+           expect_lookup=False),
+  )
+  def test_add_tisr_var_with_climatology(self, lon, expect_lookup):
+    datetimes = np.array([10, 20], dtype="datetime64[D]")
+    data = xa.Dataset(
+        coords={
+            "lat": np.array([2.0, 1.0]),
+            "lon": np.array(lon),
+            "time": np.array([100, 200], dtype="timedelta64[s]"),
+            "datetime": xa.Variable("time", datetimes),
+        },
+    )
+    # A TISR of 2 J⋅m⁻² per W⋅m⁻² of TSI everywhere, at 00:00 and 12:00.
+    climatology = tisr_climatology.TisrClimatology(
+        values=np.full((367, 2, 2, 2), 2.0, dtype=np.float32),
+        lat=np.array([2.0, 1.0]),
+        lon=np.array([0.0, 0.5]),
+        reference_year=2020,
+        slots_per_day=2,
+    )
+
+    data_utils.add_tisr_var(data, climatology)
+
+    self.assertEqual(data[data_utils.TISR].dims, ("time", "lat", "lon"))
+    if expect_lookup:
+      tsi = solar_radiation.get_tsi(datetimes, solar_radiation.era5_tsi_data())
+      np.testing.assert_allclose(
+          data[data_utils.TISR].data,
+          np.broadcast_to(2 * tsi[:, None, None], (2, 2, 2)),
+          rtol=1e-6)
+    else:
+      self.assertGreater(data[data_utils.TISR].max(), 1e5)
+
+  @parameterized.parameters(False, True)
+  def test_compute_forcings_matches_add_vars(self, on_device):
+    lat = np.array([2.0, 1.0])
+    lon = np.array([0.0, 0.5])
+    datetime_values = np.array(
+        [[10, 20], [100, 200]], dtype="datetime64[D]").astype("datetime64[ns]")
+    datetimes = xa.DataArray(
+        datetime_values, dims=("batch", "time"),
+        coords={"time": np.array([100, 200], dtype="timedelta64[s]")})
+    forcing_variables = (data_utils.TISR, "year_progress_sin",
+                         "day_progress_cos")
+
+    forcings = data_utils.compute_forcings(
+        datetimes, lat=lat, lon=lon, forcing_variables=forcing_variables,
+        on_device=on_device)
+
+    self.assertNotIn("datetime", forcings.coords)
+    self.assertEqual(forcings[data_utils.TISR].dims,
+                     ("batch", "time", "lat", "lon"))
+    for batch_index in range(2):
+      data = xa.Dataset(coords={
+          "lat": lat,
+          "lon": lon,
+          "time": datetimes.coords["time"],
+          "datetime": ("time", datetime_values[batch_index]),
+      })
+      data_utils.add_derived_vars(data)
+      data_utils.add_tisr_var(data)
+      for name in forcing_variables:
+        np.testing.assert_allclose(
+            np.asarray(forcings[name].isel(batch=batch_index).data),
+            data[name].transpose(*forcings[name].dims[1:]).data,
+            rtol=1e-6)
+
+  def test_compute_forcings_unsupported_variable_raises_value_error(self):
+    datetimes = xa.DataArray(
+        np.array([10], dtype="datetime64[D]"), dims=("time",))
+    with self.assertRaisesRegex(ValueError, "2m_temperature"):
+      data_utils.compute_forcings(
+          datetimes, lat=np.zeros(1), lon=np.zeros(1),
+          forcing_variables=("2m_temperature",))
+
 
 if __name__ == "__main__":
   absltest.main()
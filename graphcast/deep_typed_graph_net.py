@@ -35,7 +35,8 @@ Generalization to TypedGraphs of the deep Graph Neural Network from:
 """
 
 import functools
-from typing import Callable, List, Mapping, Optional, Tuple
+import re
+from typing import Callable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
 
 import chex
 from graphcast import mlp as mlp_builder
@@ -50,6 +51,18 @@ import jraph
 GraphToGraphNetwork = Callable[[typed_graph.TypedGraph], typed_graph.TypedGraph]
 
 
+class StaticEmbeddings(NamedTuple):
+  """Precomputed embeddings for node/edge sets with static input features.
+
+  Produced by `DeepTypedGraphNet.embed_static_features`, and indexed by node/edge
+  set name. Each embedding has shape [num_nodes/num_edges, latent_size], and is
+  broadcast to any additional axes (e.g. batch) of the input features when
+  passed back to `DeepTypedGraphNet.__call__`.
+  """
+  nodes: Mapping[str, chex.Array]
+  edges: Mapping[str, chex.Array]
+
+
 class DeepTypedGraphNet(hk.Module):
   """Deep Graph Neural Network.
 
@@ -98,6 +111,10 @@ class DeepTypedGraphNet(hk.Module):
                f32_aggregation: bool = False,
                aggregate_edges_for_nodes_fn: str = "segment_sum",
                aggregate_normalization: Optional[float] = None,
+               gather_after_project: bool = False,
+               edge_chunk_size: Optional[int] = None,
+               edges_sorted_by_receiver: bool = False,
+               stack_processor_steps: bool = False,
                name: str = "DeepTypedGraphNet"):
     """Inits the model.
 
@@ -143,6 +160,29 @@ class DeepTypedGraphNet(hk.Module):
         increase the number of edges connected to a node. In particular, this is
         useful when using segment_sum, but should not be combined with
         segment_mean.
+      gather_after_project: If True, the first layer of the processor edge MLPs
+        is split into edge, sender and receiver blocks, and the sender and
+        receiver blocks are applied to the node latents before gathering them
+        to the edges (see `mlp.GatherAfterProjectMLP`). This avoids
+        materializing [num_edges, 3 * latent_size] inputs on every message
+        passing step. Parameters are the same either way.
+      edge_chunk_size: If set, the edges are embedded, updated and aggregated
+        to their receivers in chunks of this many edges, in a loop, so the
+        [num_edges, latent_size] edge latents are never materialized in full,
+        which bounds peak memory for graphs with many edges (e.g. grid2mesh and
+        mesh2grid). Only supported for a single message passing step with
+        "segment_sum" aggregation and no edge outputs, and the edge features
+        of the returned graph are the input ones. Parameters have the same
+        names and shapes either way.
+      edges_sorted_by_receiver: Whether the edges of the input graphs are
+        sorted by receiver (see `typed_graph.sort_edges_by_receiver`), in which
+        case messages are aggregated with sorted segment reductions. Results
+        are wrong if this is set and the edges are not sorted.
+      stack_processor_steps: If True, the parameters of the
+        `num_message_passing_steps` processor steps are stacked along a leading
+        axis, and the steps are run with `hk.layer_stack`, so a single step is
+        compiled instead of one per step. Parameters are stored under different
+        names, see `stack_processor_params` to convert between the two.
       name: Name of the model.
     """
 
@@ -172,35 +212,137 @@ class DeepTypedGraphNet(hk.Module):
     self._aggregate_edges_for_nodes_fn = _get_aggregate_edges_for_nodes_fn(
         aggregate_edges_for_nodes_fn)
     self._aggregate_normalization = aggregate_normalization
+    self._gather_after_project = gather_after_project
+    self._edge_chunk_size = edge_chunk_size
+    self._edges_sorted_by_receiver = edges_sorted_by_receiver
+    self._stack_processor_steps = stack_processor_steps
 
     if aggregate_normalization:
       # using aggregate_normalization only makes sense with segment_sum.
       assert aggregate_edges_for_nodes_fn == "segment_sum"
 
+    if edge_chunk_size is not None:
+      if num_message_passing_steps * num_processor_repetitions != 1:
+        raise ValueError(
+            "`edge_chunk_size` requires a single message passing step.")
+      if edge_output_size:
+        raise ValueError("`edge_chunk_size` does not support edge outputs.")
+      if aggregate_edges_for_nodes_fn != "segment_sum":
+        raise ValueError("`edge_chunk_size` requires segment_sum aggregation.")
+      if include_sent_messages_in_node_update or gather_after_project:
+        raise ValueError(
+            "`edge_chunk_size` is not supported with "
+            "`include_sent_messages_in_node_update` or `gather_after_project`.")
+      if stack_processor_steps:
+        raise ValueError(
+            "`edge_chunk_size` is not supported with `stack_processor_steps`.")
+
   def __call__(self,
                input_graph: typed_graph.TypedGraph,
-               global_norm_conditioning: Optional[chex.Array] = None
+               global_norm_conditioning: Optional[chex.Array] = None,
+               static_embeddings: Optional[StaticEmbeddings] = None,
                ) -> typed_graph.TypedGraph:
-    """Forward pass of the learnable dynamics model."""
-    embedder_network, processor_networks, decoder_network = (
-        self._networks_builder(input_graph, global_norm_conditioning)
+    """Forward pass of the learnable dynamics model.
+
+    Args:
+      input_graph: Graph with the input features.
+      global_norm_conditioning: Features to condition the normalization on,
+        required if and only if `use_norm_conditioning` is True.
+      static_embeddings: Optional output of `embed_static_features` (for the
+        same parameters). The node/edge sets in it skip the embedding MLPs, and
+        their input features are only used for their shape and dtype.
+
+    Returns:
+      The output graph.
+    """
+    if self._use_norm_conditioning:
+      if global_norm_conditioning is None:
+        raise ValueError(
+            "When using norm conditioning, `global_norm_conditioning` must"
+            "be passed to the call method.")
+    else:
+      if global_norm_conditioning is not None:
+        raise ValueError(
+            "`globa_norm_conditioning` was passed, but `norm_conditioning`"
+            " is not enabled.")
+
+    embedder_network, processor_networks, decoder_network, _ = (
+        self._networks_builder(
+            input_graph, global_norm_conditioning, static_embeddings)
     )
 
+    graph = input_graph
+    if self._edge_chunk_size is not None and static_embeddings is not None:
+      # Edges are embedded chunk by chunk in the processor, so the static edge
+      # embeddings are chunked along with the (unused) input features.
+      graph = _pair_edge_features_with_static_embeddings(
+          graph, static_embeddings.edges)
+
     # Embed input features (if applicable).
-    latent_graph_0 = self._embed(input_graph, embedder_network)
+    latent_graph_0 = self._embed(graph, embedder_network)
 
     # Do `m` message passing steps in the latent graphs.
     latent_graph_m = self._process(latent_graph_0, processor_networks)
 
+    if self._edge_chunk_size is not None:
+      latent_graph_m = latent_graph_m._replace(edges=input_graph.edges)
+
     # Compute outputs from the last latent graph (if applicable).
     return self._output(latent_graph_m, decoder_network)
 
+  def embed_static_features(
+      self,
+      static_graph: typed_graph.TypedGraph,
+      node_sets: Sequence[str] = (),
+      edge_sets: Sequence[str] = (),
+  ) -> StaticEmbeddings:
+    """Embeds node/edge sets whose input features do not change across calls.
+
+    The result only depends on the parameters and on the features of the given
+    sets, so it can be computed once and passed to every call as
+    `static_embeddings`, e.g. for the purely geometric edge features of a fixed
+    graph, which otherwise get re-embedded at every step of a rollout.
+
+    If `use_norm_conditioning` is True, only the unconditioned part of the
+    embedders is precomputed, and the norm conditioning is still applied on
+    each call.
+
+    Args:
+      static_graph: Graph with the static features of the given sets, without
+        any batch axis. Features of other sets are ignored.
+      node_sets: Names of the node sets to embed.
+      edge_sets: Names of the edge sets to embed.
+
+    Returns:
+      The embeddings of the given node and edge sets.
+    """
+    if node_sets and jax.tree_util.tree_leaves(static_graph.context.features):
+      raise ValueError(
+          "Node sets cannot be embedded statically when the graph has context "
+          "features, since these are concatenated to the node features.")
+    _, _, _, (static_node_embedders, static_edge_embedders) = (
+        self._networks_builder(static_graph))
+    missing_sets = ((set(node_sets) - set(static_node_embedders)) |
+                    (set(edge_sets) - set(static_edge_embedders)))
+    if missing_sets:
+      raise ValueError(
+          f"No embedder for {sorted(missing_sets)}, make sure `embed_nodes` "
+          "and `embed_edges` are set for them.")
+    return StaticEmbeddings(
+        nodes={name: static_node_embedders[name](
+            static_graph.nodes[name].features) for name in node_sets},
+        edges={name: static_edge_embedders[name](
+            static_graph.edge_by_name(name).features) for name in edge_sets})
+
   def _networks_builder(
       self,
       graph_template: typed_graph.TypedGraph,
       global_norm_conditioning: Optional[chex.Array] = None,
+      static_embeddings: Optional[StaticEmbeddings] = None,
   ) -> Tuple[
-      GraphToGraphNetwork, List[GraphToGraphNetwork], GraphToGraphNetwork
+      GraphToGraphNetwork, List[GraphToGraphNetwork], GraphToGraphNetwork,
+      Tuple[Mapping[str, Callable[[chex.Array], chex.Array]],
+            Mapping[str, Callable[[chex.Array], chex.Array]]],
   ]:
     # TODO(aelkadi): move to mlp_builder.
     def build_mlp(name, output_size):
@@ -209,61 +351,90 @@ class DeepTypedGraphNet(hk.Module):
               output_size], name=name + "_mlp", activation=self._activation)
       return jraph.concatenated_args(mlp)
 
-    def build_mlp_with_maybe_layer_norm(name, output_size):
-      network = build_mlp(name, output_size)
+    def build_gather_after_project_mlp(name, output_size):
+      return mlp_builder.GatherAfterProjectMLP(
+          output_sizes=[self._mlp_hidden_size] * self._mlp_num_hidden_layers + [
+              output_size], name=name + "_mlp", activation=self._activation)
+
+    def build_mlp_with_maybe_unconditioned_layer_norm(
+        name, output_size, mlp_fn=build_mlp):
+      network = mlp_fn(name, output_size)
       stages = [network]
-      if self._use_norm_conditioning:
-        if global_norm_conditioning is None:
-          raise ValueError(
-              "When using norm conditioning, `global_norm_conditioning` must"
-              "be passed to the call method.")
+      if self._use_layer_norm:
         # If using norm conditioning, it is no longer the responsibility of the
         # LayerNorm module itself to learn its scale and offset. These will be
         # learned for the module by the norm conditioning layer instead.
-        create_scale = create_offset = False
-      else:
-        if global_norm_conditioning is not None:
-          raise ValueError(
-              "`globa_norm_conditioning` was passed, but `norm_conditioning`"
-              " is not enabled.")
-        create_scale = create_offset = True
-
-      if self._use_layer_norm:
+        create_scale = create_offset = not self._use_norm_conditioning
         layer_norm = hk.LayerNorm(
             axis=-1, create_scale=create_scale, create_offset=create_offset,
             name=name + "_layer_norm")
         stages.append(layer_norm)
-
-      if self._use_norm_conditioning:
-        norm_conditioning_layer = mlp_builder.LinearNormConditioning(
-            name=name + "_norm_conditioning")
-        norm_conditioning_layer = functools.partial(
-            norm_conditioning_layer,
-            # Broadcast to the node/edge axis.
-            norm_conditioning=global_norm_conditioning[None],
-        )
+      return stages
+
+    def build_maybe_norm_conditioning(name):
+      if not self._use_norm_conditioning:
+        return None
+      norm_conditioning_layer = mlp_builder.LinearNormConditioning(
+          name=name + "_norm_conditioning")
+      # `global_norm_conditioning` is only needed when the layer is applied, so
+      # the embedders can be built in `embed_static_features` without it.
+      return lambda x: norm_conditioning_layer(
+          x,
+          # Broadcast to the node/edge axis.
+          norm_conditioning=global_norm_conditioning[None])
+
+    def build_mlp_with_maybe_layer_norm(name, output_size, mlp_fn=build_mlp):
+      stages = build_mlp_with_maybe_unconditioned_layer_norm(
+          name, output_size, mlp_fn)
+      norm_conditioning_layer = build_maybe_norm_conditioning(name)
+      if norm_conditioning_layer is not None:
         stages.append(norm_conditioning_layer)
+      # All arguments are passed to the MLP, which concatenates them if needed.
+      return hk.Sequential(stages)
 
-      network = hk.Sequential(stages)
-      return jraph.concatenated_args(network)
+    def build_embedder(name, output_size):
+      # Split in the part that only depends on the input features, which can be
+      # precomputed for static features, and the optional norm conditioning.
+      static_embedder = jraph.concatenated_args(hk.Sequential(
+          build_mlp_with_maybe_unconditioned_layer_norm(name, output_size)))
+      return static_embedder, build_maybe_norm_conditioning(name)
+
+    if static_embeddings is None:
+      static_embeddings = StaticEmbeddings(nodes={}, edges={})
 
     # The embedder graph network independently embeds edge and node features.
     if self._embed_edges:
-      embed_edge_fn = _build_update_fns_for_edge_types(
-          build_mlp_with_maybe_layer_norm,
+      edge_embedders = _build_update_fns_for_edge_types(
+          build_embedder,
           graph_template,
           "encoder_edges_",
           output_sizes=self._edge_latent_size)
     else:
-      embed_edge_fn = None
+      edge_embedders = {}
     if self._embed_nodes:
-      embed_node_fn = _build_update_fns_for_node_types(
-          build_mlp_with_maybe_layer_norm,
+      node_embedders = _build_update_fns_for_node_types(
+          build_embedder,
           graph_template,
           "encoder_nodes_",
           output_sizes=self._node_latent_size)
     else:
-      embed_node_fn = None
+      node_embedders = {}
+    embed_edge_fn = _build_embed_fns(
+        edge_embedders, static_embeddings.edges,
+        paired_static_embeddings=self._edge_chunk_size is not None)
+    embed_node_fn = _build_embed_fns(node_embedders, static_embeddings.nodes)
+    static_edge_embedders = {
+        name: static_embedder
+        for name, (static_embedder, _) in edge_embedders.items()}
+    static_node_embedders = {
+        name: static_embedder
+        for name, (static_embedder, _) in node_embedders.items()}
+    if self._edge_chunk_size is not None:
+      # Edges are embedded in the processor, chunk by chunk.
+      processor_embed_edge_fn = embed_edge_fn
+      embed_edge_fn = {}
+    else:
+      processor_embed_edge_fn = {}
     embedder_kwargs = dict(
         embed_edge_fn=embed_edge_fn,
         embed_node_fn=embed_node_fn,
@@ -292,24 +463,56 @@ class DeepTypedGraphNet(hk.Module):
     # that update the node and edge latent features.
     # Note that we can use `modules.InteractionNetwork` because
     # it also outputs the messages as updated edge latent features.
-    processor_networks = []
-    for step_i in range(self._num_message_passing_steps):
-      processor_networks.append(
-          typed_graph_net.InteractionNetwork(
-              update_edge_fn=_build_update_fns_for_edge_types(
-                  build_mlp_with_maybe_layer_norm,
-                  graph_template,
-                  f"processor_edges_{step_i}_",
-                  output_sizes=self._edge_latent_size),
-              update_node_fn=_build_update_fns_for_node_types(
-                  build_mlp_with_maybe_layer_norm,
-                  graph_template,
-                  f"processor_nodes_{step_i}_",
-                  output_sizes=self._node_latent_size),
-              aggregate_edges_for_nodes_fn=aggregate_fn,
-              include_sent_messages_in_node_update=(
-                  self._include_sent_messages_in_node_update),
-              ))
+    if self._gather_after_project:
+      build_processor_edge_fn = functools.partial(
+          build_mlp_with_maybe_layer_norm,
+          mlp_fn=build_gather_after_project_mlp)
+    else:
+      build_processor_edge_fn = build_mlp_with_maybe_layer_norm
+    def build_processor_network(step_name):
+      update_edge_fn = _build_update_fns_for_edge_types(
+          build_processor_edge_fn,
+          graph_template,
+          f"processor_edges_{step_name}",
+          output_sizes=self._edge_latent_size)
+      for edge_set_name, embed_fn in processor_embed_edge_fn.items():
+        update_edge_fn[edge_set_name] = _embed_then_update_edges(
+            embed_fn, update_edge_fn[edge_set_name])
+      return typed_graph_net.InteractionNetwork(
+          update_edge_fn=update_edge_fn,
+          update_node_fn=_build_update_fns_for_node_types(
+              build_mlp_with_maybe_layer_norm,
+              graph_template,
+              f"processor_nodes_{step_name}",
+              output_sizes=self._node_latent_size),
+          aggregate_edges_for_nodes_fn=aggregate_fn,
+          include_sent_messages_in_node_update=(
+              self._include_sent_messages_in_node_update),
+          gather_nodes_in_edge_fn=self._gather_after_project,
+          edge_chunk_size=self._edge_chunk_size,
+          scan_fn=hk.scan,
+          receivers_are_sorted=self._edges_sorted_by_receiver,
+          )
+
+    if self._stack_processor_steps:
+      def stacked_processor(latent_graph):
+        # Only the features are carried across steps, the graph structure is
+        # the same for all of them.
+        def step(features):
+          latent_graph_k = self._process_step(
+              build_processor_network(""),
+              _replace_features(latent_graph, features))
+          return _get_features(latent_graph_k)
+        features = hk.layer_stack(self._num_message_passing_steps)(step)(
+            _get_features(latent_graph))
+        return _replace_features(latent_graph, features)
+      # A module, so the parameters are shared across processor repetitions.
+      processor_networks = [
+          hk.to_module(stacked_processor)(name="stacked_processor")]
+    else:
+      processor_networks = [
+          build_processor_network(f"{step_i}_")
+          for step_i in range(self._num_message_passing_steps)]
 
     # The output MLPs converts edge/node latent features into the output sizes.
     output_kwargs = dict(
@@ -321,7 +524,8 @@ class DeepTypedGraphNet(hk.Module):
         if self._node_output_size else None,)
     output_network = typed_graph_net.GraphMapFeatures(
         **output_kwargs)
-    return embedder_network, processor_networks, output_network
+    return (embedder_network, processor_networks, output_network,
+            (static_node_embedders, static_edge_embedders))
 
   def _embed(
       self,
@@ -365,6 +569,10 @@ class DeepTypedGraphNet(hk.Module):
     # times.
     latent_graph = latent_graph_0
     for unused_repetition_i in range(self._num_processor_repetitions):
+      if self._stack_processor_steps:
+        # Runs all the steps, including residual connections.
+        latent_graph = processor_networks[0](latent_graph)
+        continue
       for processor_network in processor_networks:
         latent_graph = self._process_step(processor_network, latent_graph)
 
@@ -386,6 +594,10 @@ class DeepTypedGraphNet(hk.Module):
 
     edges_with_residuals = {}
     for k, prev_set in latent_graph_prev_k.edges.items():
+      if self._edge_chunk_size is not None:
+        # Updated edge latents are not materialized with edge chunking.
+        edges_with_residuals[k] = prev_set
+        continue
       edges_with_residuals[k] = prev_set._replace(
           features=prev_set.features + latent_graph_k.edges[k].features)
 
@@ -402,6 +614,91 @@ class DeepTypedGraphNet(hk.Module):
     return output_network(latent_graph)
 
 
+def _get_features(graph):
+  return ({k: v.features for k, v in graph.nodes.items()},
+          {k.name: v.features for k, v in graph.edges.items()})
+
+
+def _replace_features(graph, features):
+  node_features, edge_features = features
+  return graph._replace(
+      nodes={k: v._replace(features=node_features[k])
+             for k, v in graph.nodes.items()},
+      edges={k: v._replace(features=edge_features[k.name])
+             for k, v in graph.edges.items()})
+
+
+# Matches the parameters of unstacked and stacked processor steps (see
+# `stack_processor_params`).
+_UNSTACKED_PROCESSOR_PARAM_RE = re.compile(
+    r"^(?P<prefix>(?:.*/)?(?P<network>[^/]+)/~_networks_builder)/"
+    r"processor_(?P<kind>edges|nodes)_(?P<step>\d+)_(?P<suffix>.*)$")
+_STACKED_PROCESSOR_PARAM_RE = re.compile(
+    r"^(?P<prefix>.*/~_networks_builder)/stacked_processor/"
+    r"__layer_stack_no_per_layer/processor_(?P<kind>edges|nodes)_"
+    r"(?P<suffix>.*)$")
+
+
+def stack_processor_params(
+    params: hk.Params,
+    network_names: Optional[Sequence[str]] = None) -> hk.Params:
+  """Converts processor parameters to the `stack_processor_steps` layout.
+
+  The parameters of the `processor_{edges,nodes}_{i}_*` modules of each
+  `DeepTypedGraphNet` are stacked along a new leading axis, in step order.
+  Other parameters are returned unchanged, so this can be applied to the
+  parameters of a whole model (e.g. a released checkpoint).
+
+  Args:
+    params: Parameters with one set of modules per processor step.
+    network_names: Names of the `DeepTypedGraphNet`s to convert (e.g.
+      `["mesh_gnn"]` for `GraphCast(stack_processor_steps=True)`). All of them
+      if None.
+
+  Returns:
+    The parameters with stacked processor steps.
+  """
+  stacked = {}
+  steps = {}
+  for module_name, module_params in params.items():
+    match = _UNSTACKED_PROCESSOR_PARAM_RE.match(module_name)
+    if match is None or (network_names is not None and
+                         match["network"] not in network_names):
+      stacked[module_name] = module_params
+      continue
+    stacked_name = (
+        f"{match['prefix']}/stacked_processor/__layer_stack_no_per_layer/"
+        f"processor_{match['kind']}_{match['suffix']}")
+    steps.setdefault(stacked_name, {})[int(match["step"])] = module_params
+
+  for stacked_name, params_by_step in steps.items():
+    if sorted(params_by_step) != list(range(len(params_by_step))):
+      raise ValueError(
+          f"Missing processor steps for {stacked_name}: got steps "
+          f"{sorted(params_by_step)}.")
+    stacked[stacked_name] = jax.tree_util.tree_map(
+        lambda *x: jnp.stack(x),
+        *[params_by_step[i] for i in range(len(params_by_step))])
+  return stacked
+
+
+def unstack_processor_params(params: hk.Params) -> hk.Params:
+  """Inverse of `stack_processor_params`."""
+  unstacked = {}
+  for module_name, module_params in params.items():
+    match = _STACKED_PROCESSOR_PARAM_RE.match(module_name)
+    if match is None:
+      unstacked[module_name] = module_params
+      continue
+    num_steps = jax.tree_util.tree_leaves(module_params)[0].shape[0]
+    for step_i in range(num_steps):
+      unstacked[
+          f"{match['prefix']}/processor_{match['kind']}_{step_i}_"
+          f"{match['suffix']}"] = jax.tree_util.tree_map(
+              lambda x: x[step_i], module_params)  # pylint: disable=cell-var-from-loop
+  return unstacked
+
+
 def _build_update_fns_for_node_types(
     builder_fn, graph_template, prefix, output_sizes=None):
   """Builds an update function for all node types or a subset of them."""
@@ -442,6 +739,85 @@ def _build_update_fns_for_edge_types(
   return output_fns
 
 
+def _build_embed_fns(embedders, static_embeddings,
+                     paired_static_embeddings=False):
+  """Builds embedding functions, using static embeddings where available.
+
+  Args:
+    embedders: Mapping from set name to (static_embedder, norm_conditioning).
+    static_embeddings: Mapping from set name to precomputed embeddings.
+    paired_static_embeddings: If True, the embedding functions of the sets in
+      `static_embeddings` take (features, static_embedding) pairs instead (see
+      `_pair_edge_features_with_static_embeddings`).
+
+  Returns:
+    Mapping from set name to embedding function.
+  """
+  unknown_sets = set(static_embeddings) - set(embedders)
+  if unknown_sets:
+    raise ValueError(
+        f"Got static embeddings for {sorted(unknown_sets)}, which are not "
+        "embedded by this network.")
+
+  embed_fns = {}
+  for set_name, (static_embedder, norm_conditioning) in embedders.items():
+    if paired_static_embeddings and set_name in static_embeddings:
+      embed_fns[set_name] = functools.partial(
+          _embed_paired_static,
+          static_embedder=static_embedder,
+          norm_conditioning=norm_conditioning)
+      continue
+    embed_fns[set_name] = functools.partial(
+        _embed_maybe_static,
+        static_embedder=static_embedder,
+        norm_conditioning=norm_conditioning,
+        static_embedding=static_embeddings.get(set_name))
+  return embed_fns
+
+
+def _pair_edge_features_with_static_embeddings(graph, static_embeddings):
+  """Replaces edge features by (features, static_embedding) pairs."""
+  edges = {}
+  for edge_set_key, edge_set in graph.edges.items():
+    if edge_set_key.name in static_embeddings:
+      edge_set = edge_set._replace(features=(
+          edge_set.features, static_embeddings[edge_set_key.name]))
+    edges[edge_set_key] = edge_set
+  return graph._replace(edges=edges)
+
+
+def _embed_paired_static(features_and_static_embedding, **kwargs):
+  features, static_embedding = features_and_static_embedding
+  return _embed_maybe_static(
+      features, static_embedding=static_embedding, **kwargs)
+
+
+def _embed_then_update_edges(embed_fn, update_fn):
+  """Composes an edge embedder with a processor edge function."""
+  def edge_fn(edge_features, *args):
+    return update_fn(embed_fn(edge_features), *args)
+  return edge_fn
+
+
+def _embed_maybe_static(
+    features, *, static_embedder, norm_conditioning, static_embedding):
+  """Embeds `features`, or broadcasts `static_embedding` to their shape."""
+  if static_embedding is None:
+    latent = static_embedder(features)
+  else:
+    # [num_elements, latent_size] -> [num_elements, ..., latent_size]
+    leading_shape = features.shape[:-1]
+    static_embedding = static_embedding.reshape(
+        static_embedding.shape[:1] + (1,) * (len(leading_shape) - 1) +
+        static_embedding.shape[1:])
+    latent = jnp.broadcast_to(
+        static_embedding, leading_shape + static_embedding.shape[-1:]
+        ).astype(features.dtype)
+  if norm_conditioning is not None:
+    latent = norm_conditioning(latent)
+  return latent
+
+
 def _get_activation_fn(name):
   """Return activation function corresponding to function_name."""
   if name == "identity":
@@ -0,0 +1,246 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for deep_typed_graph_net."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import chex
+from graphcast import deep_typed_graph_net
+from graphcast import typed_graph
+import haiku as hk
+import jax
+import numpy as np
+
+
+_BATCH_SIZE = 2
+
+
+def _make_graph(batch_size=None, seed=0):
+  rng = np.random.default_rng(seed)
+
+  def features(num, size):
+    values = rng.normal(size=(num, size)).astype(np.float32)
+    if batch_size is None:
+      return values
+    return np.repeat(values[:, None], batch_size, axis=1)
+
+  return typed_graph.TypedGraph(
+      context=typed_graph.Context(n_graph=np.array([1]), features=()),
+      nodes={
+          "grid_nodes": typed_graph.NodeSet(
+              n_node=np.array([6]), features=features(6, 3)),
+          "mesh_nodes": typed_graph.NodeSet(
+              n_node=np.array([4]), features=features(4, 3)),
+      },
+      edges={
+          typed_graph.EdgeSetKey("grid2mesh", ("grid_nodes", "mesh_nodes")):
+              typed_graph.EdgeSet(
+                  n_edge=np.array([9]),
+                  indices=typed_graph.EdgesIndices(
+                      senders=rng.integers(6, size=9),
+                      receivers=rng.integers(4, size=9)),
+                  features=features(9, 4)),
+      })
+
+
+class DeepTypedGraphNetTest(parameterized.TestCase):
+
+  @parameterized.parameters(False, True)
+  def test_static_embeddings_give_identical_outputs(
+      self, use_norm_conditioning):
+
+    def get_net():
+      return deep_typed_graph_net.DeepTypedGraphNet(
+          node_latent_size=dict(grid_nodes=8, mesh_nodes=8),
+          edge_latent_size=dict(grid2mesh=8),
+          mlp_hidden_size=8,
+          mlp_num_hidden_layers=1,
+          num_message_passing_steps=2,
+          node_output_size=dict(mesh_nodes=5),
+          use_norm_conditioning=use_norm_conditioning,
+          activation="swish",
+          name="grid2mesh_gnn")
+
+    graph = _make_graph(batch_size=_BATCH_SIZE)
+    static_graph = _make_graph()
+    global_norm_conditioning = (
+        np.ones((_BATCH_SIZE, 3), np.float32)
+        if use_norm_conditioning else None)
+
+    @hk.transform
+    def forward(static_embeddings=None):
+      return get_net()(graph, global_norm_conditioning, static_embeddings)
+
+    @hk.transform
+    def embed_static_features():
+      return get_net().embed_static_features(
+          static_graph, node_sets=["mesh_nodes"], edge_sets=["grid2mesh"])
+
+    params = forward.init(jax.random.PRNGKey(0))
+    static_embeddings = embed_static_features.apply(params, None)
+    self.assertEqual(static_embeddings.nodes["mesh_nodes"].shape, (4, 8))
+    self.assertEqual(static_embeddings.edges["grid2mesh"].shape, (9, 8))
+
+    expected = forward.apply(params, None)
+    actual = forward.apply(params, None, static_embeddings)
+    for name in ["grid_nodes", "mesh_nodes"]:
+      np.testing.assert_allclose(
+          actual.nodes[name].features, expected.nodes[name].features,
+          rtol=1e-5, atol=1e-6)
+
+  @parameterized.parameters(False, True)
+  def test_gather_after_project_gives_identical_outputs(
+      self, use_norm_conditioning):
+
+    def get_net(gather_after_project):
+      return deep_typed_graph_net.DeepTypedGraphNet(
+          node_latent_size=dict(grid_nodes=8, mesh_nodes=8),
+          edge_latent_size=dict(grid2mesh=8),
+          mlp_hidden_size=8,
+          mlp_num_hidden_layers=2,
+          num_message_passing_steps=2,
+          node_output_size=dict(mesh_nodes=5),
+          use_norm_conditioning=use_norm_conditioning,
+          gather_after_project=gather_after_project)
+
+    graph = _make_graph(batch_size=_BATCH_SIZE)
+    global_norm_conditioning = (
+        np.ones((_BATCH_SIZE, 3), np.float32)
+        if use_norm_conditioning else None)
+    forward = hk.transform(
+        lambda gather_after_project: get_net(gather_after_project)(
+            graph, global_norm_conditioning))
+
+    params = forward.init(jax.random.PRNGKey(0), False)
+    gather_after_project_params = forward.init(jax.random.PRNGKey(0), True)
+    chex.assert_trees_all_equal(gather_after_project_params, params)
+
+    expected = forward.apply(params, None, False)
+    actual = forward.apply(params, None, True)
+    for name in ["grid_nodes", "mesh_nodes"]:
+      np.testing.assert_allclose(
+          actual.nodes[name].features, expected.nodes[name].features,
+          rtol=1e-5, atol=1e-5)
+
+  @parameterized.parameters(
+      (2, False, False), (4, True, False), (16, False, True), (4, True, True))
+  def test_edge_chunking_gives_identical_outputs(
+      self, edge_chunk_size, use_norm_conditioning, use_static_embeddings):
+
+    def get_net(edge_chunk_size):
+      return deep_typed_graph_net.DeepTypedGraphNet(
+          node_latent_size=dict(grid_nodes=8, mesh_nodes=8),
+          edge_latent_size=dict(grid2mesh=8),
+          mlp_hidden_size=8,
+          mlp_num_hidden_layers=1,
+          num_message_passing_steps=1,
+          node_output_size=dict(mesh_nodes=5),
+          use_norm_conditioning=use_norm_conditioning,
+          f32_aggregation=True,
+          aggregate_normalization=2.,
+          edge_chunk_size=edge_chunk_size,
+          name="grid2mesh_gnn")
+
+    graph = _make_graph(batch_size=_BATCH_SIZE)
+    global_norm_conditioning = (
+        np.ones((_BATCH_SIZE, 3), np.float32)
+        if use_norm_conditioning else None)
+
+    @hk.transform
+    def forward(edge_chunk_size, static_embeddings=None):
+      return get_net(edge_chunk_size)(
+          graph, global_norm_conditioning, static_embeddings)
+
+    @hk.transform
+    def embed_static_features():
+      return get_net(None).embed_static_features(
+          _make_graph(), edge_sets=["grid2mesh"])
+
+    params = forward.init(jax.random.PRNGKey(0), None)
+    # Parameters are created in a different order, so only their layout is
+    # the same.
+    chunked_params = forward.init(jax.random.PRNGKey(0), edge_chunk_size)
+    chex.assert_trees_all_equal_shapes_and_dtypes(chunked_params, params)
+
+    static_embeddings = (
+        embed_static_features.apply(params, None)
+        if use_static_embeddings else None)
+    expected = forward.apply(params, None, None)
+    actual = forward.apply(params, None, edge_chunk_size, static_embeddings)
+    for name in ["grid_nodes", "mesh_nodes"]:
+      np.testing.assert_allclose(
+          actual.nodes[name].features, expected.nodes[name].features,
+          rtol=1e-5, atol=1e-5)
+
+  @parameterized.parameters(False, True)
+  def test_stacked_processor_gives_identical_outputs(
+      self, use_norm_conditioning):
+
+    def get_net(stack_processor_steps):
+      return deep_typed_graph_net.DeepTypedGraphNet(
+          node_latent_size=dict(grid_nodes=8, mesh_nodes=8),
+          edge_latent_size=dict(grid2mesh=8),
+          mlp_hidden_size=8,
+          mlp_num_hidden_layers=1,
+          num_message_passing_steps=3,
+          num_processor_repetitions=2,
+          node_output_size=dict(mesh_nodes=5),
+          use_norm_conditioning=use_norm_conditioning,
+          stack_processor_steps=stack_processor_steps,
+          name="mesh_gnn")
+
+    graph = _make_graph(batch_size=_BATCH_SIZE)
+    global_norm_conditioning = (
+        np.ones((_BATCH_SIZE, 3), np.float32)
+        if use_norm_conditioning else None)
+    forward = hk.transform(
+        lambda stack_processor_steps: get_net(stack_processor_steps)(
+            graph, global_norm_conditioning))
+
+    params = forward.init(jax.random.PRNGKey(0), False)
+    stacked_params = deep_typed_graph_net.stack_processor_params(params)
+    chex.assert_trees_all_equal_shapes_and_dtypes(
+        stacked_params, forward.init(jax.random.PRNGKey(0), True))
+    chex.assert_trees_all_equal(
+        deep_typed_graph_net.unstack_processor_params(stacked_params), params)
+
+    expected = forward.apply(params, None, False)
+    actual = forward.apply(stacked_params, None, True)
+    for name in ["grid_nodes", "mesh_nodes"]:
+      np.testing.assert_allclose(
+          actual.nodes[name].features, expected.nodes[name].features,
+          rtol=1e-5, atol=1e-5)
+
+  def test_static_embeddings_for_unknown_set_raises(self):
+    graph = _make_graph(batch_size=_BATCH_SIZE)
+
+    @hk.transform
+    def forward():
+      net = deep_typed_graph_net.DeepTypedGraphNet(
+          node_latent_size=dict(grid_nodes=8, mesh_nodes=8),
+          edge_latent_size=dict(grid2mesh=8),
+          mlp_hidden_size=8,
+          mlp_num_hidden_layers=1,
+          num_message_passing_steps=1,
+          embed_nodes=False)
+      static_embeddings = deep_typed_graph_net.StaticEmbeddings(
+          nodes=dict(mesh_nodes=np.zeros((4, 8), np.float32)), edges={})
+      return net(graph, static_embeddings=static_embeddings)
+
+    with self.assertRaisesRegex(ValueError, "mesh_nodes"):
+      forward.init(jax.random.PRNGKey(0))
+
+
+if __name__ == "__main__":
+  absltest.main()
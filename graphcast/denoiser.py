@@ -19,6 +19,7 @@ from typing import Any, Callable, Mapping, Optional, Sequence, Tuple
 import chex
 from graphcast import deep_typed_graph_net
 from graphcast import denoisers_base as base
+from graphcast import graph_cache
 from graphcast import grid_mesh_connectivity
 from graphcast import icosahedral_mesh
 from graphcast import model_utils
@@ -36,6 +37,8 @@ import xarray
 
 Kwargs = Mapping[str, Any]
 NoiseLevelEncoder = Callable[[jnp.ndarray], jnp.ndarray]
+# Static embeddings of each of the GNNs, indexed by graph name.
+StaticEmbeddings = Mapping[str, deep_typed_graph_net.StaticEmbeddings]
 
 
 class FourierFeaturesMLP(hk.Module):
@@ -209,9 +212,19 @@ class Denoiser(base.Denoiser):
       self,
       noise_encoder_config: Optional[NoiseEncoderConfig],
       denoiser_architecture_config: DenoiserArchitectureConfig,
+      graph_cache_dir: Optional[str] = None,
+      static_embeddings: Optional[StaticEmbeddings] = None,
+      gather_after_project: bool = False,
+      edge_chunk_size: Optional[int] = None,
+      sort_edges_by_receiver: bool = False,
   ):
     self._predictor = _DenoiserArchitecture(
         denoiser_architecture_config=denoiser_architecture_config,
+        graph_cache_dir=graph_cache_dir,
+        static_embeddings=static_embeddings,
+        gather_after_project=gather_after_project,
+        edge_chunk_size=edge_chunk_size,
+        sort_edges_by_receiver=sort_edges_by_receiver,
     )
     # Use default values if not specified.
     if noise_encoder_config is None:
@@ -244,6 +257,17 @@ class Denoiser(base.Denoiser):
         forcings=forcings,
         **kwargs)
 
+  def embed_static_features(
+      self,
+      inputs: xarray.Dataset,
+      noisy_targets: xarray.Dataset,
+      forcings: Optional[xarray.Dataset] = None,
+      ) -> StaticEmbeddings:
+    """See `_DenoiserArchitecture.embed_static_features`."""
+    if forcings is None: forcings = xarray.Dataset()
+    forcings = forcings.assign(noisy_targets)
+    return self._predictor.embed_static_features(inputs, forcings)
+
 
 class _DenoiserArchitecture:
   """GenCast Predictor.
@@ -277,8 +301,36 @@ class _DenoiserArchitecture:
   def __init__(
       self,
       denoiser_architecture_config: DenoiserArchitectureConfig,
+      graph_cache_dir: Optional[str] = None,
+      static_embeddings: Optional[StaticEmbeddings] = None,
+      gather_after_project: bool = False,
+      edge_chunk_size: Optional[int] = None,
+      sort_edges_by_receiver: bool = False,
   ):
-    """Initializes the predictor."""
+    """Initializes the predictor.
+
+    Args:
+      denoiser_architecture_config: Architecture configuration.
+      graph_cache_dir: Optional directory used to cache the grid2mesh, mesh
+        and mesh2grid graph structures across processes (see `graph_cache`).
+      static_embeddings: Optional output of `embed_static_features`, computed
+        with the same parameters this model is applied with. If given, the
+        embeddings of the static edge features, and of the mesh nodes in the
+        grid2mesh GNN, are taken from it instead of being recomputed on every
+        call (i.e. on every denoising step when sampling).
+      gather_after_project: Whether the GNN edge updates project the node
+        latents before gathering them to the edges, instead of concatenating
+        gathered node latents (see `DeepTypedGraphNet`). Saves memory, and
+        uses the same parameters.
+      edge_chunk_size: If set, the grid2mesh and mesh2grid GNNs process their
+        edges in chunks of this size (see `DeepTypedGraphNet`), which bounds
+        their peak memory. Uses the same parameters. Takes precedence over
+        `gather_after_project` for those GNNs.
+      sort_edges_by_receiver: If True, the edges of the grid2mesh and mesh2grid
+        graphs are sorted by receiver when the graphs are built (see
+        `typed_graph.sort_edges_by_receiver`), and the GNNs aggregate messages
+        with sorted segment reductions. Uses the same parameters.
+    """
     self._spatial_features_kwargs = dict(
         add_node_positions=False,
         add_node_latitude=True,
@@ -322,6 +374,10 @@ class _DenoiserArchitecture:
             num_message_passing_steps=1,
             use_layer_norm=True,
             use_norm_conditioning=True,
+            gather_after_project=(
+                gather_after_project and edge_chunk_size is None),
+            edge_chunk_size=edge_chunk_size,
+            edges_sorted_by_receiver=sort_edges_by_receiver,
         )
     )
 
@@ -358,6 +414,10 @@ class _DenoiserArchitecture:
             num_message_passing_steps=1,
             use_layer_norm=True,
             use_norm_conditioning=True,
+            gather_after_project=(
+                gather_after_project and edge_chunk_size is None),
+            edge_chunk_size=edge_chunk_size,
+            edges_sorted_by_receiver=sort_edges_by_receiver,
         )
     )
 
@@ -371,6 +431,21 @@ class _DenoiserArchitecture:
         * denoiser_architecture_config.radius_query_fraction_edge_length
     )
 
+    self._static_embeddings = static_embeddings or {}
+
+    self._sort_edges_by_receiver = sort_edges_by_receiver
+    self._graph_cache_dir = graph_cache_dir
+    self._graph_cache_key_components = dict(
+        # The mesh nodes are permuted to a banded structure, so graphs are not
+        # interchangeable with those from `graphcast.GraphCast`.
+        model="gencast",
+        mesh_size=denoiser_architecture_config.mesh_size,
+        radius_query_fraction_edge_length=(
+            denoiser_architecture_config.radius_query_fraction_edge_length),
+        mesh2grid_edge_normalization_factor=None,
+        spatial_features=self._spatial_features_kwargs,
+    )
+
     # Other initialization is delayed until the first call (`_maybe_init`)
     # when we get some sample data so we know the lat/lon values.
     self._initialized = False
@@ -433,18 +508,94 @@ class _DenoiserArchitecture:
         output_grid_nodes, targets_template
     )
 
+  def embed_static_features(
+      self,
+      inputs: xarray.Dataset,
+      forcings: xarray.Dataset,
+      ) -> StaticEmbeddings:
+    """Computes the embeddings of the static features of the graphs.
+
+    These are the embeddings of the grid2mesh and mesh2grid edge features, and
+    of the mesh nodes in the grid2mesh GNN, which only depend on the parameters
+    (see `graphcast.GraphCast.embed_static_features`). Only the unconditioned
+    part of the embedders is precomputed, the norm conditioning on the noise
+    level is still applied on every call.
+
+    Args:
+      inputs: Sample inputs, as passed to `__call__`. Only the coordinates and
+        the number of channels are used, and norm conditioning features may be
+        omitted.
+      forcings: Sample forcings, as passed to `__call__`. Only the number of
+        channels is used.
+
+    Returns:
+      Static embeddings of the "grid2mesh" and "mesh2grid" GNNs.
+    """
+    self._maybe_init(inputs)
+    inputs = inputs.drop_vars(
+        list(self._norm_conditioning_features), errors="ignore")
+    num_input_channels = (
+        model_utils.dataset_to_stacked(inputs).sizes["channels"] +
+        model_utils.dataset_to_stacked(forcings).sizes["channels"])
+
+    # Mesh nodes in the grid2mesh GNN get dummy zero inputs (see
+    # `_run_grid2mesh_gnn`), so their input features are static too.
+    grid2mesh_graph = self._grid2mesh_graph_structure
+    assert grid2mesh_graph is not None
+    mesh_nodes = grid2mesh_graph.nodes["mesh_nodes"]
+    mesh_node_features = jnp.concatenate([
+        jnp.zeros((self._num_mesh_nodes, num_input_channels),
+                  dtype=jnp.float32),
+        mesh_nodes.features.astype(jnp.float32)], axis=-1)
+    grid2mesh_graph = grid2mesh_graph._replace(nodes=dict(
+        grid2mesh_graph.nodes,
+        mesh_nodes=mesh_nodes._replace(features=mesh_node_features)))
+
+    return {
+        "grid2mesh": self._grid2mesh_gnn.embed_static_features(
+            grid2mesh_graph, node_sets=["mesh_nodes"],
+            edge_sets=["grid2mesh"]),
+        "mesh2grid": self._mesh2grid_gnn.embed_static_features(
+            self._mesh2grid_graph_structure, edge_sets=["mesh2grid"]),
+    }
+
   def _maybe_init(self, sample_inputs: xarray.Dataset):
     """Inits everything that has a dependency on the input coordinates."""
     if not self._initialized:
       self._init_mesh_properties()
       self._init_grid_properties(
           grid_lat=sample_inputs.lat, grid_lon=sample_inputs.lon)
-      self._grid2mesh_graph_structure = self._init_grid2mesh_graph()
-      self._mesh_graph_structure = self._init_mesh_graph()
-      self._mesh2grid_graph_structure = self._init_mesh2grid_graph()
+      self._grid2mesh_graph_structure = self._load_or_init_graph(
+          "grid2mesh", self._init_grid2mesh_graph,
+          sort_edges_by_receiver=self._sort_edges_by_receiver)
+      # The mesh is processed by the transformer, not by a GNN.
+      self._mesh_graph_structure = self._load_or_init_graph(
+          "mesh", self._init_mesh_graph)
+      self._mesh2grid_graph_structure = self._load_or_init_graph(
+          "mesh2grid", self._init_mesh2grid_graph,
+          sort_edges_by_receiver=self._sort_edges_by_receiver)
 
       self._initialized = True
 
+  def _load_or_init_graph(
+      self, name: str, init_fn: Callable[[], typed_graph.TypedGraph],
+      sort_edges_by_receiver: bool = False,
+      ) -> typed_graph.TypedGraph:
+    """Builds a graph structure, or loads it from the graph cache."""
+    assert self._grid_lat is not None and self._grid_lon is not None
+    if sort_edges_by_receiver:
+      build_fn = lambda: typed_graph.sort_edges_by_receiver(init_fn())
+    else:
+      build_fn = init_fn
+    return graph_cache.load_or_build(
+        cache_dir=self._graph_cache_dir,
+        name=name,
+        key_components=dict(
+            self._graph_cache_key_components,
+            grid=graph_cache.grid_hash(self._grid_lat, self._grid_lon),
+            sort_edges_by_receiver=sort_edges_by_receiver),
+        build_fn=build_fn)
+
   def _init_mesh_properties(self):
     """Inits static properties that have to do with mesh nodes."""
     self._num_mesh_nodes = self._mesh.vertices.shape[0]
@@ -482,7 +633,9 @@ class _DenoiserArchitecture:
         grid_latitude=self._grid_lat,
         grid_longitude=self._grid_lon,
         mesh=self._mesh,
-        radius=self._query_radius)
+        radius=self._query_radius,
+        # Much cheaper than querying from the grid, for the same edges.
+        query_from="mesh")
 
     # Edges sending info from grid to mesh.
     senders = grid_indices
@@ -667,7 +820,9 @@ class _DenoiserArchitecture:
         })
 
     # Run the GNN.
-    grid2mesh_out = self._grid2mesh_gnn(input_graph, global_norm_conditioning)
+    grid2mesh_out = self._grid2mesh_gnn(
+        input_graph, global_norm_conditioning,
+        static_embeddings=self._static_embeddings.get("grid2mesh"))
     latent_mesh_nodes = grid2mesh_out.nodes["mesh_nodes"].features
     latent_grid_nodes = grid2mesh_out.nodes["grid_nodes"].features
     return latent_mesh_nodes, latent_grid_nodes
@@ -746,7 +901,9 @@ class _DenoiserArchitecture:
         })
 
     # Run the GNN.
-    output_graph = self._mesh2grid_gnn(input_graph, global_norm_conditioning)
+    output_graph = self._mesh2grid_gnn(
+        input_graph, global_norm_conditioning,
+        static_embeddings=self._static_embeddings.get("mesh2grid"))
     output_grid_nodes = output_graph.nodes["grid_nodes"].features
 
     return output_grid_nodes
@@ -149,8 +149,32 @@ class GenCast(predictor_base.Predictor):
       sampler_config: Optional[SamplerConfig] = None,
       noise_config: Optional[NoiseConfig] = None,
       noise_encoder_config: Optional[denoiser.NoiseEncoderConfig] = None,
+      graph_cache_dir: Optional[str] = None,
+      static_embeddings: Optional[denoiser.StaticEmbeddings] = None,
+      gather_after_project: bool = False,
+      edge_chunk_size: Optional[int] = None,
+      sort_edges_by_receiver: bool = False,
   ):
-    """Constructs GenCast."""
+    """Constructs GenCast.
+
+    Args:
+      task_config: Task configuration.
+      denoiser_architecture_config: Architecture of the underlying denoiser.
+      sampler_config: Sampler configuration, required for inference.
+      noise_config: Noise configuration, required for training.
+      noise_encoder_config: Configuration of the noise level encoder.
+      graph_cache_dir: Optional directory used to cache the graph structures
+        of the denoiser across processes (see `graph_cache`).
+      static_embeddings: Optional output of `embed_static_features`, computed
+        with the same parameters, so the static features of the denoiser graphs
+        are not re-embedded on every denoising step.
+      gather_after_project: Whether the denoiser GNN edge updates project the
+        node latents before gathering them (see `DeepTypedGraphNet`).
+      edge_chunk_size: If set, the denoiser grid2mesh and mesh2grid GNNs
+        process their edges in chunks of this size (see `DeepTypedGraphNet`).
+      sort_edges_by_receiver: Whether the denoiser grid2mesh and mesh2grid
+        edges are sorted by receiver, for sorted segment reductions.
+    """
     # Output size depends on number of variables being predicted.
     num_surface_vars = len(
         set(task_config.target_variables)
@@ -168,12 +192,38 @@ class GenCast(predictor_base.Predictor):
     self._denoiser = denoiser.Denoiser(
         noise_encoder_config,
         denoiser_architecture_config,
+        graph_cache_dir=graph_cache_dir,
+        static_embeddings=static_embeddings,
+        gather_after_project=gather_after_project,
+        edge_chunk_size=edge_chunk_size,
+        sort_edges_by_receiver=sort_edges_by_receiver,
     )
     self._sampler_config = sampler_config
     # Singleton to avoid re-initializing the sampler for each inference call.
     self._sampler = None
     self._noise_config = noise_config
 
+  def embed_static_features(
+      self,
+      inputs: xarray.Dataset,
+      targets_template: xarray.Dataset,
+      forcings: Optional[xarray.Dataset] = None,
+  ) -> denoiser.StaticEmbeddings:
+    """Computes the static embeddings of the denoiser graphs.
+
+    See `denoiser._DenoiserArchitecture.embed_static_features`.
+
+    Args:
+      inputs: Sample inputs, as passed to `__call__`.
+      targets_template: Sample targets template, as passed to `__call__`.
+      forcings: Sample forcings, as passed to `__call__`.
+
+    Returns:
+      Static embeddings to pass as `static_embeddings` to the constructor.
+    """
+    return self._denoiser.embed_static_features(
+        inputs, targets_template, forcings)
+
   def _c_in(self, noise_scale: xarray.DataArray) -> xarray.DataArray:
     """Scaling applied to the noisy targets input to the underlying network."""
     return (noise_scale**2 + 1)**-0.5
@@ -0,0 +1,216 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent on-disk cache for the static graph structures of the models.
+
+Building the grid2mesh, mesh and mesh2grid `TypedGraph`s (radius queries, face
+location and spatial features) is deterministic given the model and grid
+configuration, so it only needs to happen once per configuration. Each graph is
+stored in its own directory, as uncompressed `.npy` files that are loaded back
+with `mmap_mode="r"`, together with a `metadata.json` describing the graph
+structure and the key components it was built from.
+
+The directory name contains a hash of the key components, so changing any of
+them (mesh size, grid, query radius, normalization, spatial feature flags...)
+automatically results in a cache miss and a rebuild.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Callable, Mapping, Optional
+
+from graphcast import typed_graph
+import numpy as np
+
+# Bump when the on-disk layout, or the way graphs are built, changes in a way
+# that should invalidate existing caches.
+_FORMAT_VERSION = 2
+
+_METADATA_FILENAME = "metadata.json"
+
+
+def grid_hash(grid_lat: np.ndarray, grid_lon: np.ndarray) -> str:
+  """Returns a hash identifying the values of a lat/lon grid."""
+  hasher = hashlib.sha256()
+  for values in (grid_lat, grid_lon):
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    hasher.update(str(values.shape).encode())
+    hasher.update(values.tobytes())
+  return hasher.hexdigest()
+
+
+def cache_key(key_components: Mapping[str, Any]) -> str:
+  """Returns a short hash of the (json serializable) key components."""
+  serialized = json.dumps(
+      {"format_version": _FORMAT_VERSION, **key_components}, sort_keys=True)
+  return hashlib.sha256(serialized.encode()).hexdigest()[:16]
+
+
+def load_or_build(
+    cache_dir: Optional[str],
+    name: str,
+    key_components: Mapping[str, Any],
+    build_fn: Callable[[], typed_graph.TypedGraph],
+) -> typed_graph.TypedGraph:
+  """Loads a graph from the cache, building and storing it on a cache miss.
+
+  Args:
+    cache_dir: Directory for the cache. If None, caching is disabled and this
+      simply returns `build_fn()`.
+    name: Name of the graph (e.g. "grid2mesh"), used as a prefix for the
+      directory of the cache entry.
+    key_components: Json serializable mapping with everything the graph
+      depends on. Any change to these results in a different cache entry.
+    build_fn: Builds the graph on a cache miss.
+
+  Returns:
+    The `TypedGraph`, with numpy arrays that are memory mapped if it was read
+    from the cache.
+  """
+  if cache_dir is None:
+    return build_fn()
+
+  key_components = _to_json_compatible(key_components)
+  path = os.path.join(cache_dir, f"{name}_{cache_key(key_components)}")
+  if _is_valid_entry(path, key_components):
+    return load_typed_graph(path)
+
+  graph = build_fn()
+  save_typed_graph(path, graph, key_components)
+  return graph
+
+
+def save_typed_graph(
+    path: str,
+    graph: typed_graph.TypedGraph,
+    key_components: Optional[Mapping[str, Any]] = None) -> None:
+  """Stores `graph` as a directory of `.npy` files at `path`.
+
+  The entry is written to a temporary directory first and then moved into
+  place, so concurrent readers never observe a partially written entry.
+
+  Args:
+    path: Directory for the entry. Any existing entry is replaced.
+    graph: Graph to store. Context features must be empty.
+    key_components: Optional key components stored alongside the graph, used
+      to validate the entry when loading it from `load_or_build`.
+  """
+  if graph.context.features:
+    raise ValueError("Caching graphs with context features is not supported.")
+
+  parent_dir = os.path.dirname(os.path.abspath(path))
+  os.makedirs(parent_dir, exist_ok=True)
+  tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp_")
+  try:
+    metadata = {
+        "format_version": _FORMAT_VERSION,
+        "key_components": _to_json_compatible(key_components or {}),
+        "node_sets": sorted(graph.nodes),
+        "edge_sets": [
+            {"name": key.name, "node_sets": list(key.node_sets)}
+            for key in graph.edges],
+    }
+    _save_array(tmp_path, "context.n_graph", graph.context.n_graph)
+    for node_set_name, node_set in graph.nodes.items():
+      prefix = f"nodes.{node_set_name}"
+      _save_array(tmp_path, f"{prefix}.n_node", node_set.n_node)
+      _save_array(tmp_path, f"{prefix}.features", node_set.features)
+    for edge_key, edge_set in graph.edges.items():
+      prefix = f"edges.{edge_key.name}"
+      _save_array(tmp_path, f"{prefix}.n_edge", edge_set.n_edge)
+      _save_array(tmp_path, f"{prefix}.senders", edge_set.indices.senders)
+      _save_array(tmp_path, f"{prefix}.receivers", edge_set.indices.receivers)
+      _save_array(tmp_path, f"{prefix}.features", edge_set.features)
+    # Written last, as its presence marks the entry as complete.
+    with open(os.path.join(tmp_path, _METADATA_FILENAME), "w") as f:
+      json.dump(metadata, f, sort_keys=True, indent=2)
+
+    # Replace any stale or incomplete entry.
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+      os.rename(tmp_path, path)
+    except OSError:
+      # Another process stored the same entry concurrently, keep theirs.
+      shutil.rmtree(tmp_path, ignore_errors=True)
+  except BaseException:
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    raise
+
+
+def load_typed_graph(path: str) -> typed_graph.TypedGraph:
+  """Loads a graph stored with `save_typed_graph`, memory mapping arrays."""
+  metadata = _read_metadata(path)
+  if metadata is None:
+    raise FileNotFoundError(f"No cached graph found at {path}.")
+
+  nodes = {}
+  for node_set_name in metadata["node_sets"]:
+    prefix = f"nodes.{node_set_name}"
+    nodes[node_set_name] = typed_graph.NodeSet(
+        n_node=_load_array(path, f"{prefix}.n_node"),
+        features=_load_array(path, f"{prefix}.features"))
+  edges = {}
+  for edge_metadata in metadata["edge_sets"]:
+    prefix = f"edges.{edge_metadata['name']}"
+    edge_key = typed_graph.EdgeSetKey(
+        edge_metadata["name"], tuple(edge_metadata["node_sets"]))
+    edges[edge_key] = typed_graph.EdgeSet(
+        n_edge=_load_array(path, f"{prefix}.n_edge"),
+        indices=typed_graph.EdgesIndices(
+            senders=_load_array(path, f"{prefix}.senders"),
+            receivers=_load_array(path, f"{prefix}.receivers")),
+        features=_load_array(path, f"{prefix}.features"))
+  return typed_graph.TypedGraph(
+      context=typed_graph.Context(
+          n_graph=_load_array(path, "context.n_graph"), features=()),
+      nodes=nodes,
+      edges=edges)
+
+
+def _is_valid_entry(path: str, key_components: Mapping[str, Any]) -> bool:
+  metadata = _read_metadata(path)
+  return (metadata is not None and
+          metadata["format_version"] == _FORMAT_VERSION and
+          metadata["key_components"] == key_components)
+
+
+def _read_metadata(path: str) -> Optional[dict[str, Any]]:
+  try:
+    with open(os.path.join(path, _METADATA_FILENAME)) as f:
+      return json.load(f)
+  except (FileNotFoundError, json.JSONDecodeError):
+    return None
+
+
+def _save_array(path: str, name: str, value: Any) -> None:
+  np.save(os.path.join(path, f"{name}.npy"), np.asarray(value),
+          allow_pickle=False)
+
+
+def _load_array(path: str, name: str) -> np.ndarray:
+  return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r",
+                 allow_pickle=False)
+
+
+def _to_json_compatible(value: Any) -> Any:
+  """Round-trips through json, so values compare equal to the stored ones."""
+  return json.loads(json.dumps(value, sort_keys=True, default=_json_default))
+
+
+def _json_default(value: Any) -> Any:
+  if isinstance(value, np.generic):
+    return value.item()
+  raise TypeError(f"Unsupported key component type: {type(value)}")
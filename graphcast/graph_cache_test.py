@@ -0,0 +1,141 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for graph_cache."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from graphcast import graph_cache
+from graphcast import graphcast
+from graphcast import typed_graph
+import haiku as hk
+import numpy as np
+import xarray
+
+
+def _make_graph(num_edges=5):
+  rng = np.random.default_rng(0)
+  return typed_graph.TypedGraph(
+      context=typed_graph.Context(n_graph=np.array([1]), features=()),
+      nodes={
+          "grid_nodes": typed_graph.NodeSet(
+              n_node=np.array([4]),
+              features=rng.normal(size=(4, 3)).astype(np.float32)),
+          "mesh_nodes": typed_graph.NodeSet(
+              n_node=np.array([3]),
+              features=rng.normal(size=(3, 3)).astype(np.float32)),
+      },
+      edges={
+          typed_graph.EdgeSetKey("grid2mesh", ("grid_nodes", "mesh_nodes")):
+              typed_graph.EdgeSet(
+                  n_edge=np.array([num_edges]),
+                  indices=typed_graph.EdgesIndices(
+                      senders=rng.integers(4, size=num_edges),
+                      receivers=rng.integers(3, size=num_edges)),
+                  features=rng.normal(size=(num_edges, 4)).astype(np.float32))
+      })
+
+
+def _assert_graphs_equal(graph, expected_graph):
+  np.testing.assert_array_equal(
+      graph.context.n_graph, expected_graph.context.n_graph)
+  assert set(graph.nodes) == set(expected_graph.nodes)
+  for name, node_set in expected_graph.nodes.items():
+    np.testing.assert_array_equal(graph.nodes[name].n_node, node_set.n_node)
+    np.testing.assert_array_equal(
+        graph.nodes[name].features, node_set.features)
+  assert set(graph.edges) == set(expected_graph.edges)
+  for key, edge_set in expected_graph.edges.items():
+    np.testing.assert_array_equal(graph.edges[key].n_edge, edge_set.n_edge)
+    np.testing.assert_array_equal(
+        graph.edges[key].indices.senders, edge_set.indices.senders)
+    np.testing.assert_array_equal(
+        graph.edges[key].indices.receivers, edge_set.indices.receivers)
+    np.testing.assert_array_equal(
+        graph.edges[key].features, edge_set.features)
+
+
+class GraphCacheTest(absltest.TestCase):
+
+  def _tempdir(self):
+    tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    return tmp_dir.name
+
+  def test_save_load_round_trip(self):
+    graph = _make_graph()
+    path = os.path.join(self._tempdir(), "entry")
+    graph_cache.save_typed_graph(path, graph)
+    loaded = graph_cache.load_typed_graph(path)
+    _assert_graphs_equal(loaded, graph)
+    self.assertIsInstance(
+        loaded.edge_by_name("grid2mesh").features, np.memmap)
+
+  def test_load_or_build_caches_and_invalidates(self):
+    cache_dir = self._tempdir()
+    num_builds = 0
+
+    def build_fn(num_edges=5):
+      nonlocal num_builds
+      num_builds += 1
+      return _make_graph(num_edges)
+
+    key_components = dict(mesh_size=2, radius=0.6)
+    first = graph_cache.load_or_build(
+        cache_dir, "grid2mesh", key_components, build_fn)
+    second = graph_cache.load_or_build(
+        cache_dir, "grid2mesh", key_components, build_fn)
+    self.assertEqual(num_builds, 1)
+    _assert_graphs_equal(second, first)
+
+    # Changing any key component results in a rebuild.
+    third = graph_cache.load_or_build(
+        cache_dir, "grid2mesh", dict(key_components, radius=0.7),
+        lambda: build_fn(num_edges=7))
+    self.assertEqual(num_builds, 2)
+    self.assertLen(third.edge_by_name("grid2mesh").indices.senders, 7)
+
+  def test_graphcast_graphs_from_cache_match(self):
+    model_config = graphcast.ModelConfig(
+        resolution=30.,
+        mesh_size=2,
+        latent_size=4,
+        gnn_msg_steps=1,
+        hidden_layers=1,
+        radius_query_fraction_edge_length=0.6)
+    sample_inputs = xarray.Dataset(coords=dict(
+        lat=np.linspace(-90., 90., 7), lon=np.arange(0., 360., 30.)))
+    cache_dir = self._tempdir()
+
+    def get_graphs(cache_dir):
+      @hk.transform
+      def init():
+        model = graphcast.GraphCast(
+            model_config, graphcast.TASK_13, graph_cache_dir=cache_dir)
+        model._maybe_init(sample_inputs)
+        return (model._grid2mesh_graph_structure,
+                model._mesh_graph_structure,
+                model._mesh2grid_graph_structure)
+      return init.apply({}, None)
+
+    expected_graphs = get_graphs(None)
+    get_graphs(cache_dir)  # Populates the cache.
+    cached_graphs = get_graphs(cache_dir)
+    for graph, expected_graph in zip(cached_graphs, expected_graphs):
+      _assert_graphs_equal(graph, expected_graph)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -29,6 +29,7 @@ from typing import Any, Callable, Mapping, Optional
 
 import chex
 from graphcast import deep_typed_graph_net
+from graphcast import graph_cache
 from graphcast import grid_mesh_connectivity
 from graphcast import icosahedral_mesh
 from graphcast import losses
@@ -45,6 +46,9 @@ Kwargs = Mapping[str, Any]
 
 GNN = Callable[[jraph.GraphsTuple], jraph.GraphsTuple]
 
+# Static embeddings of each of the GNNs, indexed by graph name.
+StaticEmbeddings = Mapping[str, deep_typed_graph_net.StaticEmbeddings]
+
 
 # https://www.ecmwf.int/en/forecasts/dataset/ecmwf-reanalysis-v5
 PRESSURE_LEVELS_ERA5_37 = (
@@ -240,8 +244,47 @@ class GraphCast(predictor_base.Predictor):
 
   """
 
-  def __init__(self, model_config: ModelConfig, task_config: TaskConfig):
-    """Initializes the predictor."""
+  def __init__(self,
+               model_config: ModelConfig,
+               task_config: TaskConfig,
+               graph_cache_dir: Optional[str] = None,
+               static_embeddings: Optional[StaticEmbeddings] = None,
+               gather_after_project: bool = False,
+               edge_chunk_size: Optional[int] = None,
+               sort_edges_by_receiver: bool = False,
+               stack_processor_steps: bool = False):
+    """Initializes the predictor.
+
+    Args:
+      model_config: Model configuration.
+      task_config: Task configuration.
+      graph_cache_dir: Optional directory used to cache the grid2mesh, mesh
+        and mesh2grid graph structures across processes (see `graph_cache`).
+      static_embeddings: Optional output of `embed_static_features`, computed
+        with the same parameters this model is applied with. If given, the
+        embeddings of the static edge features, and of the mesh nodes in the
+        grid2mesh GNN, are taken from it instead of being recomputed on every
+        call, which is useful for inference (e.g. long rollouts).
+      gather_after_project: Whether the GNN edge updates project the node
+        latents before gathering them to the edges, instead of concatenating
+        gathered node latents (see `DeepTypedGraphNet`). Saves memory, and
+        uses the same parameters.
+      edge_chunk_size: If set, the grid2mesh and mesh2grid GNNs process their
+        edges in chunks of this size (see `DeepTypedGraphNet`), which bounds
+        the peak memory of the encoder and decoder, e.g. for CPU inference at
+        high resolution. Uses the same parameters. Takes precedence over
+        `gather_after_project` for those GNNs.
+      sort_edges_by_receiver: If True, the edges of all graphs are sorted by
+        receiver when the graphs are built (see
+        `typed_graph.sort_edges_by_receiver`), and the GNNs aggregate messages
+        with sorted segment reductions. Uses the same parameters, and only
+        changes the order in which messages are summed.
+      stack_processor_steps: If True, the `gnn_msg_steps` steps of the mesh
+        GNN are run with `hk.layer_stack` on stacked parameters (see
+        `DeepTypedGraphNet`), which cuts compile time. Parameters, including
+        those of released checkpoints, must be converted with
+        `deep_typed_graph_net.stack_processor_params(params, ["mesh_gnn"])`.
+    """
     self._spatial_features_kwargs = dict(
         add_node_positions=False,
         add_node_latitude=True,
@@ -273,6 +316,10 @@ class GraphCast(predictor_base.Predictor):
         activation="swish",
         f32_aggregation=True,
         aggregate_normalization=None,
+        gather_after_project=(
+            gather_after_project and edge_chunk_size is None),
+        edge_chunk_size=edge_chunk_size,
+        edges_sorted_by_receiver=sort_edges_by_receiver,
         name="grid2mesh_gnn",
     )
 
@@ -289,6 +336,9 @@ class GraphCast(predictor_base.Predictor):
         include_sent_messages_in_node_update=False,
         activation="swish",
         f32_aggregation=False,
+        gather_after_project=gather_after_project,
+        edges_sorted_by_receiver=sort_edges_by_receiver,
+        stack_processor_steps=stack_processor_steps,
         name="mesh_gnn",
     )
 
@@ -317,6 +367,10 @@ class GraphCast(predictor_base.Predictor):
         include_sent_messages_in_node_update=False,
         activation="swish",
         f32_aggregation=False,
+        gather_after_project=(
+            gather_after_project and edge_chunk_size is None),
+        edge_chunk_size=edge_chunk_size,
+        edges_sorted_by_receiver=sort_edges_by_receiver,
         name="mesh2grid_gnn",
     )
 
@@ -328,6 +382,20 @@ class GraphCast(predictor_base.Predictor):
         model_config.mesh2grid_edge_normalization_factor
     )
 
+    self._static_embeddings = static_embeddings or {}
+
+    self._sort_edges_by_receiver = sort_edges_by_receiver
+    self._graph_cache_dir = graph_cache_dir
+    self._graph_cache_key_components = dict(
+        model="graphcast",
+        mesh_size=model_config.mesh_size,
+        radius_query_fraction_edge_length=(
+            model_config.radius_query_fraction_edge_length),
+        mesh2grid_edge_normalization_factor=(
+            model_config.mesh2grid_edge_normalization_factor),
+        spatial_features=self._spatial_features_kwargs,
+    )
+
     # Other initialization is delayed until the first call (`_maybe_init`)
     # when we get some sample data so we know the lat/lon values.
     self._initialized = False
@@ -424,18 +492,101 @@ class GraphCast(predictor_base.Predictor):
     loss, _ = self.loss_and_predictions(inputs, targets, forcings)
     return loss  # pytype: disable=bad-return-type  # jax-ndarray
 
+  def embed_static_features(
+      self,
+      inputs: xarray.Dataset,
+      forcings: xarray.Dataset,
+      ) -> StaticEmbeddings:
+    """Computes the embeddings of the static features of the graphs.
+
+    These are the embeddings of the (purely geometric) grid2mesh, mesh and
+    mesh2grid edge features, and of the mesh nodes in the grid2mesh GNN, whose
+    inputs are only their position. They only depend on the parameters, so for
+    inference they can be computed once, e.g.:
+
+    ```
+    @hk.transform_with_state
+    def embed_static_features(inputs, forcings):
+      return GraphCast(model_config, task_config).embed_static_features(
+          inputs, forcings)
+
+    static_embeddings, _ = embed_static_features.apply(
+        params, state, None, inputs, forcings)
+    ```
+
+    and then passed as `static_embeddings` to the model that is used for the
+    rollout, so the embedding MLPs are skipped on every step. Embeddings are
+    computed in float32, and cast to the dtype of the inputs on each call.
+
+    Args:
+      inputs: Sample inputs, as passed to `__call__`. Only the coordinates and
+        the number of channels are used.
+      forcings: Sample forcings, as passed to `__call__`. Only the number of
+        channels is used.
+
+    Returns:
+      Static embeddings of the "grid2mesh", "mesh" and "mesh2grid" GNNs.
+    """
+    self._maybe_init(inputs)
+    num_input_channels = self._inputs_to_grid_node_features(
+        inputs, forcings).shape[-1]
+
+    # Mesh nodes in the grid2mesh GNN get dummy zero inputs (see
+    # `_run_grid2mesh_gnn`), so their input features are static too.
+    grid2mesh_graph = self._grid2mesh_graph_structure
+    assert grid2mesh_graph is not None
+    mesh_nodes = grid2mesh_graph.nodes["mesh_nodes"]
+    mesh_node_features = jnp.concatenate([
+        jnp.zeros((self._num_mesh_nodes, num_input_channels),
+                  dtype=jnp.float32),
+        mesh_nodes.features.astype(jnp.float32)], axis=-1)
+    grid2mesh_graph = grid2mesh_graph._replace(nodes=dict(
+        grid2mesh_graph.nodes,
+        mesh_nodes=mesh_nodes._replace(features=mesh_node_features)))
+
+    return {
+        "grid2mesh": self._grid2mesh_gnn.embed_static_features(
+            grid2mesh_graph, node_sets=["mesh_nodes"],
+            edge_sets=["grid2mesh"]),
+        "mesh": self._mesh_gnn.embed_static_features(
+            self._mesh_graph_structure, edge_sets=["mesh"]),
+        "mesh2grid": self._mesh2grid_gnn.embed_static_features(
+            self._mesh2grid_graph_structure, edge_sets=["mesh2grid"]),
+    }
+
   def _maybe_init(self, sample_inputs: xarray.Dataset):
     """Inits everything that has a dependency on the input coordinates."""
     if not self._initialized:
       self._init_mesh_properties()
       self._init_grid_properties(
           grid_lat=sample_inputs.lat, grid_lon=sample_inputs.lon)
-      self._grid2mesh_graph_structure = self._init_grid2mesh_graph()
-      self._mesh_graph_structure = self._init_mesh_graph()
-      self._mesh2grid_graph_structure = self._init_mesh2grid_graph()
+      self._grid2mesh_graph_structure = self._load_or_init_graph(
+          "grid2mesh", self._init_grid2mesh_graph)
+      self._mesh_graph_structure = self._load_or_init_graph(
+          "mesh", self._init_mesh_graph)
+      self._mesh2grid_graph_structure = self._load_or_init_graph(
+          "mesh2grid", self._init_mesh2grid_graph)
 
       self._initialized = True
 
+  def _load_or_init_graph(
+      self, name: str, init_fn: Callable[[], typed_graph.TypedGraph]
+      ) -> typed_graph.TypedGraph:
+    """Builds a graph structure, or loads it from the graph cache."""
+    assert self._grid_lat is not None and self._grid_lon is not None
+    if self._sort_edges_by_receiver:
+      build_fn = lambda: typed_graph.sort_edges_by_receiver(init_fn())
+    else:
+      build_fn = init_fn
+    return graph_cache.load_or_build(
+        cache_dir=self._graph_cache_dir,
+        name=name,
+        key_components=dict(
+            self._graph_cache_key_components,
+            grid=graph_cache.grid_hash(self._grid_lat, self._grid_lon),
+            sort_edges_by_receiver=self._sort_edges_by_receiver),
+        build_fn=build_fn)
+
   def _init_mesh_properties(self):
     """Inits static properties that have to do with mesh nodes."""
     self._num_mesh_nodes = self._finest_mesh.vertices.shape[0]
@@ -473,7 +624,9 @@ class GraphCast(predictor_base.Predictor):
         grid_latitude=self._grid_lat,
         grid_longitude=self._grid_lon,
         mesh=self._finest_mesh,
-        radius=self._query_radius)
+        radius=self._query_radius,
+        # Much cheaper than querying from the grid, for the same edges.
+        query_from="mesh")
 
     # Edges sending info from grid to mesh.
     senders = grid_indices
@@ -657,7 +810,8 @@ class GraphCast(predictor_base.Predictor):
         })
 
     # Run the GNN.
-    grid2mesh_out = self._grid2mesh_gnn(input_graph)
+    grid2mesh_out = self._grid2mesh_gnn(
+        input_graph, static_embeddings=self._static_embeddings.get("grid2mesh"))
     latent_mesh_nodes = grid2mesh_out.nodes["mesh_nodes"].features
     latent_grid_nodes = grid2mesh_out.nodes["grid_nodes"].features
     return latent_mesh_nodes, latent_grid_nodes
@@ -695,7 +849,9 @@ class GraphCast(predictor_base.Predictor):
         edges={mesh_edges_key: new_edges}, nodes={"mesh_nodes": nodes})
 
     # Run the GNN.
-    return self._mesh_gnn(input_graph).nodes["mesh_nodes"].features
+    return self._mesh_gnn(
+        input_graph, static_embeddings=self._static_embeddings.get("mesh")
+        ).nodes["mesh_nodes"].features
 
   def _run_mesh2grid_gnn(self,
                          updated_latent_mesh_nodes: chex.Array,
@@ -731,7 +887,8 @@ class GraphCast(predictor_base.Predictor):
         })
 
     # Run the GNN.
-    output_graph = self._mesh2grid_gnn(input_graph)
+    output_graph = self._mesh2grid_gnn(
+        input_graph, static_embeddings=self._static_embeddings.get("mesh2grid"))
     output_grid_nodes = output_graph.nodes["grid_nodes"].features
 
     return output_grid_nodes
@@ -0,0 +1,190 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for graphcast."""
+
+from absl.testing import absltest
+import chex
+from graphcast import deep_typed_graph_net
+from graphcast import graphcast
+from graphcast import xarray_jax
+import haiku as hk
+import jax
+import numpy as np
+import xarray
+
+
+_MODEL_CONFIG = graphcast.ModelConfig(
+    resolution=30.,
+    mesh_size=2,
+    latent_size=8,
+    gnn_msg_steps=2,
+    hidden_layers=1,
+    radius_query_fraction_edge_length=0.6)
+
+_TASK_CONFIG = graphcast.TaskConfig(
+    input_variables=("2m_temperature", "temperature",
+                     "toa_incident_solar_radiation"),
+    target_variables=("2m_temperature", "temperature"),
+    forcing_variables=("toa_incident_solar_radiation",),
+    pressure_levels=(500, 850),
+    input_duration="12h",
+)
+
+
+def _make_dataset(variables, num_times, seed):
+  rng = np.random.default_rng(seed)
+  coords = dict(
+      batch=np.arange(2),
+      time=np.arange(num_times) * np.timedelta64(6, "h"),
+      lat=np.linspace(-90., 90., 7),
+      lon=np.arange(0., 360., 30.),
+      level=np.array(_TASK_CONFIG.pressure_levels))
+  data_vars = {}
+  for name in variables:
+    dims = ("batch", "time", "lat", "lon")
+    if name in graphcast.ALL_ATMOSPHERIC_VARS:
+      dims += ("level",)
+    data_vars[name] = (
+        dims, rng.normal(size=[len(coords[d]) for d in dims]).astype(
+            np.float32))
+  return xarray.Dataset(data_vars, coords=coords)
+
+
+class GraphCastTest(absltest.TestCase):
+
+  def test_static_embeddings_give_identical_outputs(self):
+    inputs = _make_dataset(_TASK_CONFIG.input_variables, num_times=2, seed=0)
+    targets = _make_dataset(_TASK_CONFIG.target_variables, num_times=1, seed=1)
+    forcings = _make_dataset(
+        _TASK_CONFIG.forcing_variables, num_times=1, seed=2)
+
+    @hk.transform
+    def forward(inputs, targets_template, forcings, static_embeddings=None):
+      model = graphcast.GraphCast(
+          _MODEL_CONFIG, _TASK_CONFIG, static_embeddings=static_embeddings)
+      return model(inputs, targets_template, forcings)
+
+    @hk.transform
+    def embed_static_features(inputs, forcings):
+      model = graphcast.GraphCast(_MODEL_CONFIG, _TASK_CONFIG)
+      return model.embed_static_features(inputs, forcings)
+
+    params = forward.init(jax.random.PRNGKey(0), inputs, targets, forcings)
+    static_embeddings = embed_static_features.apply(
+        params, None, inputs, forcings)
+    self.assertSameElements(static_embeddings, ["grid2mesh", "mesh",
+                                                "mesh2grid"])
+
+    expected = forward.apply(params, None, inputs, targets, forcings)
+    actual = forward.apply(
+        params, None, inputs, targets, forcings, static_embeddings)
+    for name in _TASK_CONFIG.target_variables:
+      np.testing.assert_allclose(
+          xarray_jax.unwrap_data(actual[name]),
+          xarray_jax.unwrap_data(expected[name]),
+          rtol=1e-5, atol=1e-5)
+
+  def test_edge_chunking_gives_identical_outputs(self):
+    inputs = _make_dataset(_TASK_CONFIG.input_variables, num_times=2, seed=0)
+    targets = _make_dataset(_TASK_CONFIG.target_variables, num_times=1, seed=1)
+    forcings = _make_dataset(
+        _TASK_CONFIG.forcing_variables, num_times=1, seed=2)
+
+    @hk.transform
+    def forward(inputs, targets_template, forcings, edge_chunk_size=None):
+      model = graphcast.GraphCast(
+          _MODEL_CONFIG, _TASK_CONFIG, edge_chunk_size=edge_chunk_size)
+      return model(inputs, targets_template, forcings)
+
+    params = forward.init(jax.random.PRNGKey(0), inputs, targets, forcings)
+    expected = forward.apply(params, None, inputs, targets, forcings)
+    actual = forward.apply(
+        params, None, inputs, targets, forcings, edge_chunk_size=7)
+    for name in _TASK_CONFIG.target_variables:
+      np.testing.assert_allclose(
+          xarray_jax.unwrap_data(actual[name]),
+          xarray_jax.unwrap_data(expected[name]),
+          rtol=1e-5, atol=1e-5)
+
+  def test_sorted_edges_give_identical_outputs(self):
+    inputs = _make_dataset(_TASK_CONFIG.input_variables, num_times=2, seed=0)
+    targets = _make_dataset(_TASK_CONFIG.target_variables, num_times=1, seed=1)
+    forcings = _make_dataset(
+        _TASK_CONFIG.forcing_variables, num_times=1, seed=2)
+
+    @hk.transform
+    def forward(inputs, targets_template, forcings,
+                sort_edges_by_receiver=False, edge_chunk_size=None):
+      model = graphcast.GraphCast(
+          _MODEL_CONFIG, _TASK_CONFIG,
+          sort_edges_by_receiver=sort_edges_by_receiver,
+          edge_chunk_size=edge_chunk_size)
+      predictions = model(inputs, targets_template, forcings)
+      return predictions, [model._grid2mesh_graph_structure,
+                           model._mesh_graph_structure,
+                           model._mesh2grid_graph_structure]
+
+    params = forward.init(jax.random.PRNGKey(0), inputs, targets, forcings)
+    expected, _ = forward.apply(params, None, inputs, targets, forcings)
+    for edge_chunk_size in [None, 7]:
+      actual, graphs = forward.apply(
+          params, None, inputs, targets, forcings,
+          sort_edges_by_receiver=True, edge_chunk_size=edge_chunk_size)
+      for graph in graphs:
+        for edge_set in graph.edges.values():
+          receivers = edge_set.indices.receivers
+          self.assertTrue(np.all(np.diff(receivers) >= 0))
+      for name in _TASK_CONFIG.target_variables:
+        np.testing.assert_allclose(
+            xarray_jax.unwrap_data(actual[name]),
+            xarray_jax.unwrap_data(expected[name]),
+            rtol=1e-5, atol=1e-5)
+
+  def test_stacked_processor_gives_identical_outputs(self):
+    inputs = _make_dataset(_TASK_CONFIG.input_variables, num_times=2, seed=0)
+    targets = _make_dataset(_TASK_CONFIG.target_variables, num_times=1, seed=1)
+    forcings = _make_dataset(
+        _TASK_CONFIG.forcing_variables, num_times=1, seed=2)
+
+    @hk.transform
+    def forward(inputs, targets_template, forcings,
+                stack_processor_steps=False):
+      model = graphcast.GraphCast(
+          _MODEL_CONFIG, _TASK_CONFIG,
+          stack_processor_steps=stack_processor_steps)
+      return model(inputs, targets_template, forcings)
+
+    params = forward.init(jax.random.PRNGKey(0), inputs, targets, forcings)
+    stacked_params = deep_typed_graph_net.stack_processor_params(
+        params, ["mesh_gnn"])
+    chex.assert_trees_all_equal_shapes_and_dtypes(
+        stacked_params,
+        forward.init(jax.random.PRNGKey(0), inputs, targets, forcings,
+                     stack_processor_steps=True))
+    chex.assert_trees_all_equal(
+        deep_typed_graph_net.unstack_processor_params(stacked_params), params)
+
+    expected = forward.apply(params, None, inputs, targets, forcings)
+    actual = forward.apply(
+        stacked_params, None, inputs, targets, forcings,
+        stack_processor_steps=True)
+    for name in _TASK_CONFIG.target_variables:
+      np.testing.assert_allclose(
+          xarray_jax.unwrap_data(actual[name]),
+          xarray_jax.unwrap_data(expected[name]),
+          rtol=1e-5, atol=1e-5)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -13,10 +13,11 @@
 # limitations under the License.
 """Tools for converting from regular grids on a sphere, to triangular meshes."""
 
+import itertools
+
 from graphcast import icosahedral_mesh
 import numpy as np
 import scipy
-import trimesh
 
 
 def _grid_lat_lon_to_coordinates(
@@ -42,7 +43,9 @@ def radius_query_indices(
     grid_latitude: np.ndarray,
     grid_longitude: np.ndarray,
     mesh: icosahedral_mesh.TriangularMesh,
-    radius: float) -> tuple[np.ndarray, np.ndarray]:
+    radius: float,
+    query_from: str = "grid",
+    workers: int = 1) -> tuple[np.ndarray, np.ndarray]:
   """Returns mesh-grid edge indices for radius query.
 
   Args:
@@ -50,14 +53,24 @@ def radius_query_indices(
     grid_longitude: Longitude values for the grid [num_lon_points]
     mesh: Mesh object.
     radius: Radius of connectivity in R3. for a sphere of unit radius.
+    query_from: Which set of points to run the radius queries from. "grid"
+      builds a KD-tree over the mesh vertices and queries it once per grid
+      point, "mesh" builds a KD-tree over the grid points and queries it once
+      per mesh vertex, which is cheaper when there are many more grid points
+      than mesh vertices (e.g. 0.25 degree grids). Both return identical
+      edges.
+    workers: Number of workers used by the KD-tree queries, -1 to use all
+      available CPUs.
 
   Returns:
     tuple with `grid_indices` and `mesh_indices` indicating edges between the
     grid and the mesh such that the distances in a straight line (not geodesic)
-    are smaller than or equal to `radius`.
-    * grid_indices: Indices of shape [num_edges], that index into a
+    are smaller than or equal to `radius`. Edges are sorted by grid index, and
+    then by mesh index.
+    * grid_indices: int32 indices of shape [num_edges], that index into a
       [num_lat_points, num_lon_points] grid, after flattening the leading axes.
-    * mesh_indices: Indices of shape [num_edges], that index into mesh.vertices.
+    * mesh_indices: int32 indices of shape [num_edges], that index into
+      mesh.vertices.
   """
 
   # [num_grid_points=num_lat_points * num_lon_points, 3]
@@ -66,37 +79,62 @@ def radius_query_indices(
 
   # [num_mesh_points, 3]
   mesh_positions = mesh.vertices
-  kd_tree = scipy.spatial.cKDTree(mesh_positions)
 
-  # [num_grid_points, num_mesh_points_per_grid_point]
-  # Note `num_mesh_points_per_grid_point` is not constant, so this is a list
-  # of arrays, rather than a 2d array.
-  query_indices = kd_tree.query_ball_point(x=grid_positions, r=radius)
+  if query_from == "grid":
+    kd_tree = scipy.spatial.cKDTree(mesh_positions)
+    # [num_grid_points, num_mesh_points_per_grid_point]
+    # Note `num_mesh_points_per_grid_point` is not constant, so this is a list
+    # of arrays, rather than a 2d array. Each list is sorted.
+    query_indices = kd_tree.query_ball_point(
+        x=grid_positions, r=radius, workers=workers, return_sorted=True)
+    # [num_edges], already sorted by grid index and then by mesh index.
+    grid_edge_indices, mesh_edge_indices = _flatten_query_results(
+        query_indices)
+  elif query_from == "mesh":
+    kd_tree = scipy.spatial.cKDTree(grid_positions)
+    # [num_mesh_points, num_grid_points_per_mesh_point]
+    query_indices = kd_tree.query_ball_point(
+        x=mesh_positions, r=radius, workers=workers)
+    # [num_edges]
+    mesh_edge_indices, grid_edge_indices = _flatten_query_results(
+        query_indices)
+    order = np.lexsort((mesh_edge_indices, grid_edge_indices))
+    grid_edge_indices = grid_edge_indices[order]
+    mesh_edge_indices = mesh_edge_indices[order]
+  else:
+    raise ValueError(
+        f"Unknown query_from={query_from!r}, expected 'grid' or 'mesh'.")
 
-  grid_edge_indices = []
-  mesh_edge_indices = []
-  for grid_index, mesh_neighbors in enumerate(query_indices):
-    grid_edge_indices.append(np.repeat(grid_index, len(mesh_neighbors)))
-    mesh_edge_indices.append(mesh_neighbors)
+  return grid_edge_indices, mesh_edge_indices
 
-  # [num_edges]
-  grid_edge_indices = np.concatenate(grid_edge_indices, axis=0).astype(int)
-  mesh_edge_indices = np.concatenate(mesh_edge_indices, axis=0).astype(int)
 
-  return grid_edge_indices, mesh_edge_indices
+def _flatten_query_results(
+    query_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """Flattens `query_ball_point` lists into int32 query and neighbor indices."""
+  lengths = np.fromiter(
+      map(len, query_indices), dtype=np.int64, count=len(query_indices))
+  neighbor_indices = np.fromiter(
+      itertools.chain.from_iterable(query_indices), dtype=np.int32,
+      count=lengths.sum())
+  query_indices = np.repeat(
+      np.arange(len(lengths), dtype=np.int32), lengths)
+  return query_indices, neighbor_indices
 
 
 def in_mesh_triangle_indices(
     *,
     grid_latitude: np.ndarray,
     grid_longitude: np.ndarray,
-    mesh: icosahedral_mesh.TriangularMesh) -> tuple[np.ndarray, np.ndarray]:
+    mesh: icosahedral_mesh.TriangularMesh,
+    workers: int = 1) -> tuple[np.ndarray, np.ndarray]:
   """Returns mesh-grid edge indices for grid points contained in mesh triangles.
 
   Args:
     grid_latitude: Latitude values for the grid [num_lat_points]
     grid_longitude: Longitude values for the grid [num_lon_points]
     mesh: Mesh object.
+    workers: Number of workers used by the KD-tree queries, -1 to use all
+      available CPUs.
 
   Returns:
     tuple with `grid_indices` and `mesh_indices` indicating edges between the
@@ -106,28 +144,270 @@ def in_mesh_triangle_indices(
       [num_lat_points, num_lon_points] grid, after flattening the leading axes.
     * mesh_indices: Indices of shape [num_edges], that index into mesh.vertices.
   """
+  grid_edge_indices, mesh_edge_indices, _ = (
+      in_mesh_triangle_indices_and_weights(
+          grid_latitude=grid_latitude,
+          grid_longitude=grid_longitude,
+          mesh=mesh,
+          workers=workers))
+  return grid_edge_indices, mesh_edge_indices
+
+
+def in_mesh_triangle_indices_and_weights(
+    *,
+    grid_latitude: np.ndarray,
+    grid_longitude: np.ndarray,
+    mesh: icosahedral_mesh.TriangularMesh,
+    workers: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Like `in_mesh_triangle_indices`, also returning barycentric weights.
+
+  Args:
+    grid_latitude: Latitude values for the grid [num_lat_points]
+    grid_longitude: Longitude values for the grid [num_lon_points]
+    mesh: Mesh object.
+    workers: Number of workers used by the KD-tree queries, -1 to use all
+      available CPUs.
+
+  Returns:
+    tuple with `grid_indices`, `mesh_indices` and `weights`, each of shape
+    [num_edges=num_lat_points * num_lon_points * 3]. `grid_indices` and
+    `mesh_indices` are as in `in_mesh_triangle_indices`, and `weights` contains
+    the barycentric weight of each mesh vertex for the point of the triangle
+    closest to the grid point, so the weights of each grid point sum to 1.
+  """
 
   # [num_grid_points=num_lat_points * num_lon_points, 3]
   grid_positions = _grid_lat_lon_to_coordinates(
       grid_latitude, grid_longitude).reshape([-1, 3])
 
-  mesh_trimesh = trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.faces)
-
-  # [num_grid_points] with mesh face indices for each grid point.
-  _, _, query_face_indices = trimesh.proximity.closest_point(
-      mesh_trimesh, grid_positions)
+  # [num_grid_points], [num_grid_points, 3]
+  query_face_indices, barycentric_weights = locate_points_in_mesh_faces(
+      points=grid_positions, mesh=mesh, workers=workers)
 
   # [num_grid_points, 3] with mesh node indices for each grid point.
   mesh_edge_indices = mesh.faces[query_face_indices]
 
   # [num_grid_points, 3] with grid node indices, where every row simply contains
   # the row (grid_point) index.
-  grid_indices = np.arange(grid_positions.shape[0])
+  grid_indices = np.arange(grid_positions.shape[0], dtype=np.int32)
   grid_edge_indices = np.tile(grid_indices.reshape([-1, 1]), [1, 3])
 
   # Flatten to get a regular list.
   # [num_edges=num_grid_points*3]
   mesh_edge_indices = mesh_edge_indices.reshape([-1])
   grid_edge_indices = grid_edge_indices.reshape([-1])
+  barycentric_weights = barycentric_weights.reshape([-1])
 
-  return grid_edge_indices, mesh_edge_indices
+  return grid_edge_indices, mesh_edge_indices, barycentric_weights
+
+
+# Tolerances used to classify the closest point regions and to detect points
+# equally close to two faces. These match `trimesh.tol`, as used by
+# `trimesh.proximity.closest_point` before. For points exactly on an edge shared
+# by two faces, the face chosen can differ from trimesh's, which depends on its
+# R-tree traversal order. Either face is a valid containing triangle, but
+# mesh2grid graphs are not bit-identical to those built with trimesh.
+_ZERO_TOLERANCE = np.finfo(np.float64).resolution * 100
+_TIE_TOLERANCE = 1e-8
+
+
+def locate_points_in_mesh_faces(
+    *,
+    points: np.ndarray,
+    mesh: icosahedral_mesh.TriangularMesh,
+    num_candidates: int = 4,
+    workers: int = 1) -> tuple[np.ndarray, np.ndarray]:
+  """Finds the mesh face closest to each point, with barycentric weights.
+
+  Uses a KD-tree over the face centroids to select `num_candidates` candidate
+  faces per point, and computes the closest point on each candidate triangle
+  in closed form. The number of candidates is doubled for any point for which
+  a face outside of its candidate set could still be closer, so the result is
+  exact regardless of `num_candidates`.
+
+  For points on the unit sphere and an icosahedral mesh, the closest face is
+  the face containing the point.
+
+  Args:
+    points: Query points of shape [num_points, 3].
+    mesh: Mesh object.
+    num_candidates: Initial number of candidate faces per point.
+    workers: Number of workers used by the KD-tree queries, -1 to use all
+      available CPUs.
+
+  Returns:
+    tuple with:
+    * face_indices: int32 array of shape [num_points], indexing into
+      mesh.faces.
+    * barycentric_weights: float64 array of shape [num_points, 3], weights of
+      the three vertices of the face for the point of the face closest to
+      each point.
+  """
+  points = np.asarray(points, dtype=np.float64)
+  vertices = np.asarray(mesh.vertices, dtype=np.float64)
+  # [num_faces, 3 (vertex), 3 (xyz)]
+  triangles = vertices[mesh.faces]
+  num_faces = triangles.shape[0]
+  centroids = triangles.mean(axis=1)
+  # Maximum distance between a centroid and the vertices of its face.
+  max_face_radius = np.linalg.norm(
+      triangles - centroids[:, None], axis=-1).max()
+  normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                     triangles[:, 2] - triangles[:, 0])
+  normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+  kd_tree = scipy.spatial.cKDTree(centroids)
+
+  face_indices = np.zeros([points.shape[0]], dtype=np.int32)
+  barycentric_weights = np.zeros([points.shape[0], 3], dtype=np.float64)
+  pending = np.arange(points.shape[0])
+  k = min(max(num_candidates, 2), num_faces)
+  while pending.size:
+    # [num_pending, k]
+    centroid_distances, candidates = kd_tree.query(
+        points[pending], k=k, workers=workers)
+    best_faces, best_weights, best_distances = _select_closest_faces(
+        points[pending], candidates, triangles, normals)
+    face_indices[pending] = best_faces
+    barycentric_weights[pending] = best_weights
+
+    if k == num_faces:
+      break
+    # Any face that is not a candidate has its centroid at least as far as the
+    # furthest candidate centroid, so none of its points is closer than
+    # `centroid_distances[:, -1] - max_face_radius`.
+    unresolved = best_distances >= centroid_distances[:, -1] - max_face_radius
+    pending = pending[unresolved]
+    k = min(2 * k, num_faces)
+
+  return face_indices, barycentric_weights
+
+
+def _select_closest_faces(
+    points: np.ndarray,
+    candidates: np.ndarray,
+    triangles: np.ndarray,
+    normals: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Picks the closest of the [num_points, k] candidate faces of each point."""
+  num_points, k = candidates.shape
+  # [num_points * k, 3]
+  tiled_points = np.repeat(points, k, axis=0)
+  closest_points, weights = _closest_points_on_triangles(
+      triangles[candidates.reshape([-1])], tiled_points)
+  offsets = tiled_points - closest_points
+  # [num_points, k]
+  squared_distances = _row_sum(offsets * offsets).reshape([num_points, k])
+  offsets = offsets.reshape([num_points, k, 3])
+  weights = weights.reshape([num_points, k, 3])
+
+  # [num_points, 2], the two closest candidates.
+  order = np.argsort(squared_distances, axis=-1, kind="stable")[:, :2]
+  two_distances = np.take_along_axis(squared_distances, order, axis=-1)
+
+  # When two faces share the closest point (e.g. a point on an edge of the
+  # mesh), pick the face whose normal is most aligned with the direction from
+  # the closest point to the query point.
+  is_tie = ((two_distances[:, 1] - two_distances[:, 0] < _TIE_TOLERANCE) &
+            np.all(np.abs(two_distances) > _TIE_TOLERANCE, axis=-1))
+  two_faces = np.take_along_axis(candidates, order, axis=-1)
+  two_offsets = np.take_along_axis(offsets, order[..., None], axis=1)
+  alignment = np.sum(normals[two_faces] * two_offsets, axis=-1)
+  choice = np.where(is_tie, np.argmax(alignment, axis=-1), 0)
+
+  best = np.take_along_axis(order, choice[:, None], axis=-1)[:, 0]
+  rows = np.arange(num_points)
+  return (candidates[rows, best].astype(np.int32), weights[rows, best],
+          np.sqrt(squared_distances[rows, best]))
+
+
+def _row_sum(values: np.ndarray) -> np.ndarray:
+  # Equivalent to `values.sum(-1)` for [n, 3] arrays, but faster.
+  return np.dot(values, np.ones([3]))
+
+
+def _closest_points_on_triangles(
+    triangles: np.ndarray, points: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+  """Closest point on each triangle to each point, and barycentric weights.
+
+  Vectorized version of `ClosestPtPointTriangle` from "Real-Time Collision
+  Detection" (Ericson, 2004), section 5.1.5, using the same variable names.
+
+  Args:
+    triangles: Triangle vertices of shape [n, 3 (vertex), 3 (xyz)].
+    points: Query points of shape [n, 3].
+
+  Returns:
+    tuple with the closest points of shape [n, 3], and their barycentric
+    weights of shape [n, 3].
+  """
+  a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+  ab = b - a
+  ac = c - a
+  ap = points - a
+  d1 = _row_sum(ab * ap)
+  d2 = _row_sum(ac * ap)
+  bp = points - b
+  d3 = _row_sum(ab * bp)
+  d4 = _row_sum(ac * bp)
+  cp = points - c
+  d5 = _row_sum(ab * cp)
+  d6 = _row_sum(ac * cp)
+  va = d3 * d6 - d5 * d4
+  vb = d5 * d2 - d1 * d6
+  vc = d1 * d4 - d3 * d2
+
+  zero = _ZERO_TOLERANCE
+  # Each point falls in the first of these Voronoi regions of the triangle
+  # that matches, so each mask excludes the points of the previous regions.
+  remain = np.ones(points.shape[0], dtype=bool)
+  def region(mask):
+    mask &= remain
+    remain[mask] = False
+    return mask
+  is_a = region((d1 < zero) & (d2 < zero))
+  is_b = region((d3 > -zero) & (d4 <= d3))
+  is_ab = region((vc < zero) & (d1 > -zero) & (d3 < zero))
+  is_c = region((d6 > -zero) & (d5 <= d6))
+  is_ac = region((vb < zero) & (d2 > -zero) & (d6 < zero))
+  is_bc = region((va < zero) & (d4 - d3 > -zero) & (d5 - d6 > -zero))
+  is_face = remain
+
+  closest_points = np.zeros_like(points)
+  weights = np.zeros_like(points)
+
+  closest_points[is_a] = a[is_a]
+  weights[is_a, 0] = 1.
+
+  closest_points[is_b] = b[is_b]
+  weights[is_b, 1] = 1.
+
+  v = d1[is_ab] / (d1[is_ab] - d3[is_ab])
+  closest_points[is_ab] = a[is_ab] + v[:, None] * ab[is_ab]
+  weights[is_ab, 0] = 1. - v
+  weights[is_ab, 1] = v
+
+  closest_points[is_c] = c[is_c]
+  weights[is_c, 2] = 1.
+
+  w = d2[is_ac] / (d2[is_ac] - d6[is_ac])
+  closest_points[is_ac] = a[is_ac] + w[:, None] * ac[is_ac]
+  weights[is_ac, 0] = 1. - w
+  weights[is_ac, 2] = w
+
+  d43 = d4[is_bc] - d3[is_bc]
+  w = d43 / (d43 + (d5[is_bc] - d6[is_bc]))
+  closest_points[is_bc] = b[is_bc] + w[:, None] * (c[is_bc] - b[is_bc])
+  weights[is_bc, 1] = 1. - w
+  weights[is_bc, 2] = w
+
+  denominator = 1. / (va[is_face] + vb[is_face] + vc[is_face])
+  v = vb[is_face] * denominator
+  w = vc[is_face] * denominator
+  closest_points[is_face] = (
+      a[is_face] + ab[is_face] * v[:, None] + ac[is_face] * w[:, None])
+  weights[is_face, 0] = 1. - v - w
+  weights[is_face, 1] = v
+  weights[is_face, 2] = w
+
+  return closest_points, weights
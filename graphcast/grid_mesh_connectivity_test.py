@@ -58,6 +58,31 @@ class GridMeshConnectivityTest(absltest.TestCase):
         grid_longitude=grid_longitude,
         mesh=mesh, radius=0.2)
 
+  def test_radius_query_indices(self):
+    grid_latitude = np.linspace(-75, 75, 6)
+    grid_longitude = np.arange(12) * 30.
+    mesh = icosahedral_mesh.get_hierarchy_of_triangular_meshes_for_sphere(
+        splits=3)[-1]
+    radius = 0.2
+
+    # Brute force all pairwise distances.
+    grid_positions = grid_mesh_connectivity._grid_lat_lon_to_coordinates(
+        grid_latitude, grid_longitude).reshape([-1, 3])
+    distances = np.linalg.norm(
+        grid_positions[:, None] - mesh.vertices[None], axis=-1)
+    expected_grid_indices, expected_mesh_indices = np.nonzero(
+        distances <= radius)
+
+    for query_from in ("grid", "mesh"):
+      grid_indices, mesh_indices = grid_mesh_connectivity.radius_query_indices(
+          grid_latitude=grid_latitude,
+          grid_longitude=grid_longitude,
+          mesh=mesh, radius=radius, query_from=query_from)
+      self.assertEqual(grid_indices.dtype, np.int32)
+      self.assertEqual(mesh_indices.dtype, np.int32)
+      np.testing.assert_array_equal(grid_indices, expected_grid_indices)
+      np.testing.assert_array_equal(mesh_indices, expected_mesh_indices)
+
   def test_in_mesh_triangle_indices_smoke(self):
     # TODO(alvarosg): Add non-smoke test?
     grid_latitude = np.linspace(-75, 75, 6)
@@ -69,6 +94,58 @@ class GridMeshConnectivityTest(absltest.TestCase):
         grid_longitude=grid_longitude,
         mesh=mesh)
 
+  def test_locate_points_in_mesh_faces(self):
+    mesh = icosahedral_mesh.get_hierarchy_of_triangular_meshes_for_sphere(
+        splits=3)[-1]
+    points = np.random.default_rng(0).normal(size=(500, 3))
+    points /= np.linalg.norm(points, axis=-1, keepdims=True)
+
+    face_indices, weights = (
+        grid_mesh_connectivity.locate_points_in_mesh_faces(
+            points=points, mesh=mesh))
+
+    # Brute force, with every face as a candidate for every point.
+    expected_face_indices, expected_weights = (
+        grid_mesh_connectivity.locate_points_in_mesh_faces(
+            points=points, mesh=mesh, num_candidates=mesh.faces.shape[0]))
+    np.testing.assert_array_equal(face_indices, expected_face_indices)
+    np.testing.assert_allclose(weights, expected_weights)
+
+    # Points on the sphere are inside (the radial projection of) their face,
+    # so weights are positive, and the weighted vertices are the projection
+    # of the point on the plane of the face.
+    np.testing.assert_allclose(weights.sum(-1), 1.)
+    self.assertTrue(np.all(weights >= 0.))
+    triangles = mesh.vertices[mesh.faces[face_indices]]
+    projections = np.einsum("pv,pvd->pd", weights, triangles)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                       triangles[:, 2] - triangles[:, 0])
+    np.testing.assert_allclose(
+        np.einsum("pd,pd->p", points - projections, normals) /
+        np.linalg.norm(normals, axis=-1),
+        np.linalg.norm(points - projections, axis=-1), rtol=1e-4)
+
+  def test_in_mesh_triangle_indices_and_weights(self):
+    grid_latitude = np.linspace(-75, 75, 6)
+    grid_longitude = np.arange(12) * 30.
+    mesh = icosahedral_mesh.get_hierarchy_of_triangular_meshes_for_sphere(
+        splits=3)[-1]
+    grid_indices, mesh_indices, weights = (
+        grid_mesh_connectivity.in_mesh_triangle_indices_and_weights(
+            grid_latitude=grid_latitude,
+            grid_longitude=grid_longitude,
+            mesh=mesh))
+    num_grid_points = grid_latitude.shape[0] * grid_longitude.shape[0]
+    np.testing.assert_array_equal(
+        grid_indices, np.repeat(np.arange(num_grid_points), 3))
+    self.assertEqual(mesh_indices.shape, (num_grid_points * 3,))
+    np.testing.assert_allclose(weights.reshape([-1, 3]).sum(-1), 1.)
+
+    # Every grid point is in one of the faces of the mesh.
+    faces = {tuple(face) for face in mesh.faces}
+    for face in mesh_indices.reshape([-1, 3]):
+      self.assertIn(tuple(face), faces)
+
 
 if __name__ == "__main__":
   absltest.main()
@@ -172,6 +172,77 @@ def get_icosahedron() -> TriangularMesh:
 
 def _two_split_unit_sphere_triangle_faces(
     triangular_mesh: TriangularMesh) -> TriangularMesh:
+  """Splits each triangular face into 4 triangles keeping the orientation.
+
+  Array-based equivalent of `_two_split_unit_sphere_triangle_faces_loop`. The
+  child vertices are created in the same order (order of first appearance of
+  each edge when iterating over the faces, and over the edges `ind1->ind2`,
+  `ind2->ind3`, `ind3->ind1` within each face), so the output is identical.
+
+  Args:
+    triangular_mesh: Mesh to split.
+
+  Returns:
+    `TriangularMesh` with the vertices of `triangular_mesh`, followed by the
+    new child vertices, and 4 times as many faces.
+  """
+  parent_vertices = triangular_mesh.vertices
+  faces = triangular_mesh.faces
+  num_parent_vertices = parent_vertices.shape[0]
+
+  # [num_faces * 3, 2] with the edges (ind1, ind2), (ind2, ind3), (ind3, ind1)
+  # of each face, in the order they are visited by the loop-based version.
+  edges = np.stack([faces, np.roll(faces, -1, axis=1)], axis=-1).reshape(
+      [-1, 2])
+
+  # Adjacent faces share edges with opposite orientation, so we identify each
+  # edge by its sorted vertex indices, packed into a single integer key.
+  edges_min = edges.min(axis=-1).astype(np.int64)
+  edges_max = edges.max(axis=-1).astype(np.int64)
+  edge_keys = edges_min * num_parent_vertices + edges_max
+  _, first_occurrence, unique_edge_indices = np.unique(
+      edge_keys, return_index=True, return_inverse=True)
+
+  # `np.unique` returns the edges sorted by key, but child vertices must be
+  # numbered by order of first appearance.
+  creation_order = np.argsort(first_occurrence, kind="stable")
+  creation_rank = np.empty_like(creation_order)
+  creation_rank[creation_order] = np.arange(creation_order.shape[0])
+
+  # [num_faces, 3] with the child vertex indices ind12, ind23, ind31.
+  child_indices = (
+      num_parent_vertices + creation_rank[unique_edge_indices.reshape([-1])]
+  ).reshape([-1, 3])
+
+  # Position for new vertices is the middle point, between the parent points,
+  # projected to unit sphere. The norm is computed with a batched dot product,
+  # so it is bitwise identical to `np.linalg.norm` on each individual vertex.
+  # [num_child_vertices, 2]
+  child_parent_edges = edges[first_occurrence[creation_order]]
+  # [num_child_vertices, 3]
+  child_positions = parent_vertices[child_parent_edges].mean(1)
+  child_norms = np.sqrt(
+      child_positions[:, None, :] @ child_positions[:, :, None])[:, 0]
+  child_positions /= child_norms
+
+  ind1, ind2, ind3 = faces[:, 0], faces[:, 1], faces[:, 2]
+  ind12, ind23, ind31 = (
+      child_indices[:, 0], child_indices[:, 1], child_indices[:, 2])
+  # See `_two_split_unit_sphere_triangle_faces_loop` for a diagram of the
+  # 4 child faces. [num_faces, 4, 3]
+  new_faces = np.stack([
+      np.stack([ind1, ind12, ind31], axis=-1),  # 1
+      np.stack([ind12, ind2, ind23], axis=-1),  # 2
+      np.stack([ind31, ind23, ind3], axis=-1),  # 3
+      np.stack([ind12, ind23, ind31], axis=-1),  # 4
+  ], axis=1)
+  return TriangularMesh(
+      vertices=np.concatenate([parent_vertices, child_positions], axis=0),
+      faces=new_faces.reshape([-1, 3]).astype(np.int32))
+
+
+def _two_split_unit_sphere_triangle_faces_loop(
+    triangular_mesh: TriangularMesh) -> TriangularMesh:
   """Splits each triangular face into 4 triangles keeping the orientation."""
 
   # Every time we split a triangle into 4 we will be adding 3 extra vertices,
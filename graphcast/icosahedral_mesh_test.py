@@ -59,6 +59,18 @@ class IcosahedralMeshTest(parameterized.TestCase):
       if mesh_i < len(meshes) - 1:
         prev_vertices = mesh.vertices
 
+  @parameterized.parameters(list(range(5)))
+  def test_two_split_matches_loop_implementation(self, splits):
+    mesh = icosahedral_mesh.get_hierarchy_of_triangular_meshes_for_sphere(
+        splits=splits)[-1]
+    expected = icosahedral_mesh._two_split_unit_sphere_triangle_faces_loop(
+        mesh)
+    actual = icosahedral_mesh._two_split_unit_sphere_triangle_faces(mesh)
+    self.assertEqual(actual.vertices.dtype, expected.vertices.dtype)
+    self.assertEqual(actual.faces.dtype, expected.faces.dtype)
+    np.testing.assert_array_equal(actual.vertices, expected.vertices)
+    np.testing.assert_array_equal(actual.faces, expected.faces)
+
   @parameterized.parameters(list(range(4)))
   def test_merge_meshes(self, splits):
     mesh_hierarchy = (
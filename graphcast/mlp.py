@@ -16,6 +16,7 @@
 import haiku as hk
 import jax
 import jax.numpy as jnp
+import numpy as np
 
 
 # TODO(aelkadi): Move the mlp factory here from `deep_typed_graph_net.py`.
@@ -43,3 +44,77 @@ class LinearNormConditioning(hk.Module):
     scale_minus_one, offset = jnp.split(conditional_scale_offset, 2, axis=-1)
     scale = scale_minus_one + 1.
     return inputs * scale + offset
+
+
+class GatherAfterProjectMLP(hk.Module):
+  """MLP on edges, applied to the concatenation of edge and node features.
+
+  Computes the same as a `hk.nets.MLP` applied to
+  ```
+  concatenate([edge_features,
+               sender_features[senders],
+               receiver_features[receivers]], axis=-1)
+  ```
+  with the same parameters, but the first linear layer is split into edge,
+  sender and receiver blocks, and the sender and receiver blocks are applied to
+  the node features before gathering them to the edges. This avoids
+  materializing the concatenated inputs for every edge, and projects each node
+  once, rather than once for every edge it is part of.
+  """
+
+  def __init__(self, output_sizes, activation=jax.nn.relu, name=None):
+    super().__init__(name=name)
+    output_sizes = tuple(output_sizes)
+    self._activation = activation
+    # Same layer names as in `hk.nets.MLP`, so parameters are interchangeable.
+    self._first_layer = _GatherAfterProjectLinear(
+        output_size=output_sizes[0], name="linear_0")
+    self._layers = tuple(
+        hk.Linear(output_size=output_size, name="linear_%d" % index)
+        for index, output_size in enumerate(output_sizes[1:], start=1))
+
+  def __call__(self,
+               edge_features: jax.Array,
+               sender_features: jax.Array,
+               receiver_features: jax.Array,
+               senders: jax.Array,
+               receivers: jax.Array) -> jax.Array:
+    out = self._first_layer(
+        edge_features, sender_features, receiver_features, senders, receivers)
+    for layer in self._layers:
+      out = layer(self._activation(out))
+    return out
+
+
+class _GatherAfterProjectLinear(hk.Linear):
+  """First layer of `GatherAfterProjectMLP`, with the parameters of a Linear."""
+
+  def __call__(self,  # pytype: disable=signature-mismatch
+               edge_features: jax.Array,
+               sender_features: jax.Array,
+               receiver_features: jax.Array,
+               senders: jax.Array,
+               receivers: jax.Array) -> jax.Array:
+    input_sizes = [edge_features.shape[-1],
+                   sender_features.shape[-1],
+                   receiver_features.shape[-1]]
+    input_size = self.input_size = sum(input_sizes)
+    dtype = edge_features.dtype
+
+    w_init = self.w_init
+    if w_init is None:
+      stddev = 1. / np.sqrt(input_size)
+      w_init = hk.initializers.TruncatedNormal(stddev=stddev)
+    w = hk.get_parameter(
+        "w", [input_size, self.output_size], dtype, init=w_init)
+    edge_w, sender_w, receiver_w = jnp.split(
+        w, np.cumsum(input_sizes)[:-1], axis=0)
+
+    out = (jnp.dot(edge_features, edge_w) +
+           jnp.dot(sender_features, sender_w)[senders] +
+           jnp.dot(receiver_features, receiver_w)[receivers])
+
+    if self.with_bias:
+      b = hk.get_parameter("b", [self.output_size], dtype, init=self.b_init)
+      out = out + jnp.broadcast_to(b, out.shape)
+    return out
@@ -399,6 +399,69 @@ def rotate_with_matrices(rotation_matrices: np.ndarray, positions: np.ndarray,
   return np_.einsum("...ji,...i->...j", rotation_matrices, positions)
 
 
+def rotate_to_local_coordinates(
+    positions: np.ndarray,
+    reference_phi: np.ndarray,
+    reference_theta: np.ndarray,
+    rotate_latitude: bool,
+    rotate_longitude: bool,
+    np_: NumpyInterface = np,
+    ) -> np.ndarray:
+  """Closed form of `get_rotation_matrices_to_local_coordinates` + rotation.
+
+  Equivalent to
+  ```
+  rotate_with_matrices(
+      get_rotation_matrices_to_local_coordinates(
+          reference_phi, reference_theta, rotate_latitude, rotate_longitude),
+      positions)
+  ```
+  but computing the rotated coordinates directly from the sines and cosines of
+  the reference angles, without materializing any rotation matrices, and
+  keeping the dtype of the inputs.
+
+  Args:
+    positions: [leading_axis, 3] positions to rotate.
+    reference_phi: [leading_axis] Polar angles of the reference.
+    reference_theta: [leading_axis] Azimuthal angles of the reference.
+    rotate_latitude: Whether to rotate R^3 vectors to zero latitude.
+    rotate_longitude: Whether to rotate R^3 vectors to zero longitude.
+    np_: Numpy library interface.
+
+  Returns:
+    Rotated positions of shape [leading_axis, 3].
+  """
+  if not (rotate_latitude or rotate_longitude):
+    raise ValueError(
+        "At least one of longitude and latitude should be rotated.")
+
+  x, y, z = positions[..., 0], positions[..., 1], positions[..., 2]
+  # The angles are computed in the dtype of the reference, as in
+  # `get_rotation_matrices_to_local_coordinates`, and their sines and cosines
+  # in the dtype of the positions.
+  reference_phi = reference_phi.astype(positions.dtype)
+  cos_phi, sin_phi = np_.cos(reference_phi), np_.sin(reference_phi)
+
+  # Azimuthal rotation by -phi around the z axis, to zero longitude.
+  x_lon = cos_phi * x + sin_phi * y
+  y_lon = cos_phi * y - sin_phi * x
+  if not rotate_latitude:
+    return np_.stack([x_lon, y_lon, z], axis=-1)
+
+  # Polar rotation by pi/2 - theta around the y axis, to zero latitude.
+  polar_rotation = (-reference_theta + np.pi/2).astype(positions.dtype)
+  cos_polar, sin_polar = np_.cos(polar_rotation), np_.sin(polar_rotation)
+  x_lat = cos_polar * x_lon + sin_polar * z
+  z_lat = cos_polar * z - sin_polar * x_lon
+  if rotate_longitude:
+    return np_.stack([x_lat, y_lon, z_lat], axis=-1)
+
+  # Rotate back by phi around the z axis, to the original longitude.
+  return np_.stack([cos_phi * x_lat - sin_phi * y_lon,
+                    sin_phi * x_lat + cos_phi * y_lon,
+                    z_lat], axis=-1)
+
+
 def get_bipartite_graph_spatial_features(
     *,
     senders_node_lat: np.ndarray,
@@ -414,6 +477,8 @@ def get_bipartite_graph_spatial_features(
     edge_normalization_factor: Optional[float] = None,
     relative_longitude_local_coordinates: bool,
     relative_latitude_local_coordinates: bool,
+    relative_position_dtype: np.dtype = np.float64,
+    edge_chunk_size: Optional[int] = None,
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
   """Computes spatial features for the nodes.
 
@@ -421,6 +486,10 @@ def get_bipartite_graph_spatial_features(
   difference is that sender nodes and receiver nodes can be in different arrays.
   This is necessary to enable combination with typed Graph.
 
+  Relative positions in local coordinates are computed with
+  `get_bipartite_relative_position_in_receiver_local_coordinates_closed_form`,
+  without materializing a rotation matrix per edge.
+
   Args:
     senders_node_lat: Latitudes in the [-90, 90] interval of shape
       [num_sender_nodes]
@@ -453,6 +522,12 @@ def get_bipartite_graph_spatial_features(
       computed in a local space where the receiver is at 0 longitude.
     relative_latitude_local_coordinates: If True, relative positions are
       computed in a local space where the receiver is at 0 latitude.
+    relative_position_dtype: Dtype of the relative positions, and so of the
+      edge features, when they are in local coordinates. The default (float64)
+      gives the same edge features as with rotation matrices, as used to train
+      the released checkpoints. float32 halves peak memory.
+    edge_chunk_size: Optional number of edges for which to compute relative
+      positions in local coordinates at once, to bound peak memory.
 
   Returns:
     Arrays of shape: [num_nodes, num_features] and [num_edges, num_features].
@@ -506,15 +581,29 @@ def get_bipartite_graph_spatial_features(
 
   if add_relative_positions:
 
-    relative_position = get_bipartite_relative_position_in_receiver_local_coordinates(  # pylint: disable=line-too-long
-        senders_node_phi=senders_node_phi,
-        senders_node_theta=senders_node_theta,
-        receivers_node_phi=receivers_node_phi,
-        receivers_node_theta=receivers_node_theta,
-        senders=senders,
-        receivers=receivers,
-        latitude_local_coordinates=relative_latitude_local_coordinates,
-        longitude_local_coordinates=relative_longitude_local_coordinates)
+    if (relative_latitude_local_coordinates or
+        relative_longitude_local_coordinates):
+      relative_position = get_bipartite_relative_position_in_receiver_local_coordinates_closed_form(  # pylint: disable=line-too-long
+          senders_node_phi=senders_node_phi,
+          senders_node_theta=senders_node_theta,
+          receivers_node_phi=receivers_node_phi,
+          receivers_node_theta=receivers_node_theta,
+          senders=senders,
+          receivers=receivers,
+          latitude_local_coordinates=relative_latitude_local_coordinates,
+          longitude_local_coordinates=relative_longitude_local_coordinates,
+          dtype=relative_position_dtype,
+          edge_chunk_size=edge_chunk_size)
+    else:
+      relative_position = get_bipartite_relative_position_in_receiver_local_coordinates(  # pylint: disable=line-too-long
+          senders_node_phi=senders_node_phi,
+          senders_node_theta=senders_node_theta,
+          receivers_node_phi=receivers_node_phi,
+          receivers_node_theta=receivers_node_theta,
+          senders=senders,
+          receivers=receivers,
+          latitude_local_coordinates=False,
+          longitude_local_coordinates=False)
 
     # Note this is L2 distance in 3d space, rather than geodesic distance.
     relative_edge_distances = np.linalg.norm(
@@ -638,6 +727,79 @@ def get_bipartite_relative_position_in_receiver_local_coordinates(
   return sender_pos_in_in_rotated_space - receiver_pos_in_rotated_space
 
 
+def get_bipartite_relative_position_in_receiver_local_coordinates_closed_form(
+    senders_node_phi: np.ndarray,
+    senders_node_theta: np.ndarray,
+    senders: np.ndarray,
+    receivers_node_phi: np.ndarray,
+    receivers_node_theta: np.ndarray,
+    receivers: np.ndarray,
+    latitude_local_coordinates: bool,
+    longitude_local_coordinates: bool,
+    dtype: np.dtype = np.float32,
+    edge_chunk_size: Optional[int] = None,
+    ) -> np.ndarray:
+  """Closed form, float32 relative positions in receiver local coordinates.
+
+  Same as `get_bipartite_relative_position_in_receiver_local_coordinates`, but
+  instead of gathering a [num_edges, 3, 3] array of float64 rotation matrices,
+  this rotates the sender-receiver offsets directly with
+  `rotate_to_local_coordinates`, in `dtype`, optionally processing the edges in
+  chunks of `edge_chunk_size` so peak memory for intermediate values is
+  bounded. The results match the matrix based version to the precision of
+  `dtype`.
+
+  Args:
+    senders_node_phi: [num_sender_nodes] with polar angles.
+    senders_node_theta: [num_sender_nodes] with azimuthal angles.
+    senders: [num_edges] with indices into sender nodes.
+    receivers_node_phi: [num_receiver_nodes] with polar angles.
+    receivers_node_theta: [num_receiver_nodes] with azimuthal angles.
+    receivers: [num_edges] with indices into receiver nodes.
+    latitude_local_coordinates: Whether to rotate edges such that in the
+      positions are computed such that the receiver is always at latitude 0.
+    longitude_local_coordinates: Whether to rotate edges such that in the
+      positions are computed such that the receiver is always at longitude 0.
+    dtype: Floating point dtype for the computation and the output.
+    edge_chunk_size: Optional number of edges to process at once.
+
+  Returns:
+    Array of relative positions in R3 [num_edges, 3]
+  """
+  # Node positions are computed in the dtype of the angles, as in
+  # `get_bipartite_relative_position_in_receiver_local_coordinates`, so that
+  # with a float64 `dtype` the results match it to float64 precision.
+  senders_node_pos = np.stack(
+      spherical_to_cartesian(senders_node_phi, senders_node_theta),
+      axis=-1).astype(dtype)
+  receivers_node_pos = np.stack(
+      spherical_to_cartesian(receivers_node_phi, receivers_node_theta),
+      axis=-1).astype(dtype)
+  receivers_node_phi = np.asarray(receivers_node_phi)
+  receivers_node_theta = np.asarray(receivers_node_theta)
+
+  num_edges = senders.shape[0]
+  if edge_chunk_size is None:
+    edge_chunk_size = max(num_edges, 1)
+  relative_position = np.empty([num_edges, 3], dtype=dtype)
+  for start in range(0, num_edges, edge_chunk_size):
+    chunk = slice(start, start + edge_chunk_size)
+    chunk_senders = senders[chunk]
+    chunk_receivers = receivers[chunk]
+    # Rotations are linear, so we can rotate the offsets directly.
+    offsets = (senders_node_pos[chunk_senders] -
+               receivers_node_pos[chunk_receivers])
+    if latitude_local_coordinates or longitude_local_coordinates:
+      offsets = rotate_to_local_coordinates(
+          offsets,
+          reference_phi=receivers_node_phi[chunk_receivers],
+          reference_theta=receivers_node_theta[chunk_receivers],
+          rotate_latitude=latitude_local_coordinates,
+          rotate_longitude=longitude_local_coordinates)
+    relative_position[chunk] = offsets
+  return relative_position
+
+
 def variable_to_stacked(
     variable: xarray.Variable,
     sizes: Mapping[str, int],
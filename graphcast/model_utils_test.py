@@ -0,0 +1,154 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for model_utils."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from graphcast import model_utils
+import numpy as np
+from scipy.spatial import transform
+
+
+class ModelUtilsTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      ("latitude_and_longitude", True, True, None),
+      ("latitude_only", True, False, None),
+      ("longitude_only", False, True, None),
+      ("chunked", True, True, 7),
+  )
+  def test_closed_form_relative_positions_match_rotation_matrices(
+      self, latitude_local_coordinates, longitude_local_coordinates,
+      edge_chunk_size):
+    rng = np.random.default_rng(0)
+    num_senders, num_receivers, num_edges = 20, 15, 50
+    senders_lat = rng.uniform(-90., 90., size=num_senders)
+    senders_lon = rng.uniform(0., 360., size=num_senders)
+    receivers_lat = rng.uniform(-90., 90., size=num_receivers)
+    receivers_lon = rng.uniform(0., 360., size=num_receivers)
+    senders = rng.integers(num_senders, size=num_edges)
+    receivers = rng.integers(num_receivers, size=num_edges)
+    senders_phi, senders_theta = model_utils.lat_lon_deg_to_spherical(
+        senders_lat, senders_lon)
+    receivers_phi, receivers_theta = model_utils.lat_lon_deg_to_spherical(
+        receivers_lat, receivers_lon)
+
+    if latitude_local_coordinates:
+      expected = (
+          model_utils
+          .get_bipartite_relative_position_in_receiver_local_coordinates(
+              senders_node_phi=senders_phi,
+              senders_node_theta=senders_theta,
+              senders=senders,
+              receivers_node_phi=receivers_phi,
+              receivers_node_theta=receivers_theta,
+              receivers=receivers,
+              latitude_local_coordinates=latitude_local_coordinates,
+              longitude_local_coordinates=longitude_local_coordinates))
+    else:
+      # Built directly, as `from_euler("z", ...)` requires [N, 1] angles.
+      rotation_matrices = transform.Rotation.from_euler(
+          "z", -receivers_phi[:, None]).as_matrix()
+      senders_pos = np.stack(
+          model_utils.spherical_to_cartesian(senders_phi, senders_theta), -1)
+      receivers_pos = np.stack(
+          model_utils.spherical_to_cartesian(receivers_phi, receivers_theta),
+          -1)
+      expected = model_utils.rotate_with_matrices(
+          rotation_matrices[receivers],
+          senders_pos[senders] - receivers_pos[receivers])
+
+    actual = (
+        model_utils
+        .get_bipartite_relative_position_in_receiver_local_coordinates_closed_form(  # pylint: disable=line-too-long
+            senders_node_phi=senders_phi,
+            senders_node_theta=senders_theta,
+            senders=senders,
+            receivers_node_phi=receivers_phi,
+            receivers_node_theta=receivers_theta,
+            receivers=receivers,
+            latitude_local_coordinates=latitude_local_coordinates,
+            longitude_local_coordinates=longitude_local_coordinates,
+            edge_chunk_size=edge_chunk_size))
+
+    self.assertEqual(actual.dtype, np.float32)
+    self.assertEqual(actual.shape, (num_edges, 3))
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+  @parameterized.named_parameters(
+      ("latitude_and_longitude", True),
+      ("latitude_only", False),
+  )
+  def test_bipartite_graph_spatial_features_match_rotation_matrices(
+      self, longitude_local_coordinates):
+    # Float32 node coordinates, as in `GraphCast` and the `Denoiser`.
+    rng = np.random.default_rng(0)
+    num_senders, num_receivers, num_edges = 40, 25, 120
+    senders_lat = rng.uniform(-90., 90., size=num_senders).astype(np.float32)
+    senders_lon = rng.uniform(0., 360., size=num_senders).astype(np.float32)
+    receivers_lat = rng.uniform(-90., 90., size=num_receivers).astype(
+        np.float32)
+    receivers_lon = rng.uniform(0., 360., size=num_receivers).astype(
+        np.float32)
+    senders = rng.integers(num_senders, size=num_edges)
+    receivers = rng.integers(num_receivers, size=num_edges)
+    kwargs = dict(
+        senders_node_lat=senders_lat,
+        senders_node_lon=senders_lon,
+        senders=senders,
+        receivers_node_lat=receivers_lat,
+        receivers_node_lon=receivers_lon,
+        receivers=receivers,
+        add_node_positions=False,
+        add_node_latitude=True,
+        add_node_longitude=True,
+        add_relative_positions=True,
+        relative_longitude_local_coordinates=longitude_local_coordinates,
+        relative_latitude_local_coordinates=True,
+    )
+
+    # Edge features as computed with rotation matrices, before the closed form
+    # was used.
+    senders_phi, senders_theta = model_utils.lat_lon_deg_to_spherical(
+        senders_lat, senders_lon)
+    receivers_phi, receivers_theta = model_utils.lat_lon_deg_to_spherical(
+        receivers_lat, receivers_lon)
+    relative_position = (
+        model_utils
+        .get_bipartite_relative_position_in_receiver_local_coordinates(
+            senders_node_phi=senders_phi,
+            senders_node_theta=senders_theta,
+            senders=senders,
+            receivers_node_phi=receivers_phi,
+            receivers_node_theta=receivers_theta,
+            receivers=receivers,
+            latitude_local_coordinates=True,
+            longitude_local_coordinates=longitude_local_coordinates))
+    distances = np.linalg.norm(relative_position, axis=-1, keepdims=True)
+    expected = np.concatenate(
+        [distances, relative_position], axis=-1) / distances.max()
+
+    _, _, edge_features = model_utils.get_bipartite_graph_spatial_features(
+        **kwargs)
+    self.assertEqual(edge_features.dtype, expected.dtype)
+    np.testing.assert_allclose(edge_features, expected, rtol=0, atol=1e-12)
+
+    _, _, edge_features = model_utils.get_bipartite_graph_spatial_features(
+        relative_position_dtype=np.float32, edge_chunk_size=16, **kwargs)
+    self.assertEqual(edge_features.dtype, np.float32)
+    np.testing.assert_allclose(edge_features, expected, rtol=0, atol=1e-6)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -13,19 +13,44 @@
 # limitations under the License.
 """Utils for rolling out models."""
 
-from typing import Iterator, Optional, Sequence
+from concurrent import futures
+import dataclasses
+import functools
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time as time_lib
+from typing import Callable, Iterator, Optional, Sequence, Union
 
 from absl import logging
 import chex
 import dask.array
+from graphcast import data_utils
 from graphcast import xarray_jax
 from graphcast import xarray_tree
 import jax
+import jax.numpy as jnp
 import numpy as np
+import pandas as pd
 import typing_extensions
 import xarray
 
 
+class ChunkWriter(typing_extensions.Protocol):
+  """Consumer of the predictions of a rollout, one chunk at a time."""
+
+  def write(self, chunk: xarray.Dataset) -> None:
+    """Writes a chunk of predictions, with host (numpy) data."""
+
+
+# Computes the forcings for the given target datetimes (with a "time" and
+# optionally a "batch" dimension), e.g. `data_utils.compute_forcings`.
+ForcingsFn = Callable[[xarray.DataArray], xarray.Dataset]
+
+
 class PredictorFn(typing_extensions.Protocol):
   """Functional version of base.Predictor.__call__ with explicit rng."""
 
@@ -38,6 +63,200 @@ class PredictorFn(typing_extensions.Protocol):
     ...
 
 
+@dataclasses.dataclass
+class RolloutState:
+  """Autoregressive state of a rollout, from which it can be resumed.
+
+  Attributes:
+    chunk_index: Index of the next chunk to predict. It is the number of chunks
+      once the rollout is complete.
+    inputs: Inputs for the next chunk, or None once the rollout is complete.
+    rng: Random key for the next chunk.
+    samples: Optional (start, stop) range of the samples being rolled out, see
+      `chunked_prediction_generator_multiple_runs`.
+  """
+  chunk_index: int
+  inputs: Optional[xarray.Dataset]
+  rng: np.ndarray
+  samples: Optional[tuple[int, int]] = None
+
+
+class RolloutCheckpointer:
+  """Periodically snapshots the state of a rollout to a directory.
+
+  Passing the same checkpointer (i.e. directory) to a rollout which was
+  interrupted resumes it from the last snapshot, skipping the chunks that had
+  already been yielded (and e.g. written) before the snapshot.
+
+  Each snapshot is stored in its own subdirectory (with the inputs as a Zarr
+  store), and a `LATEST` file pointing to it is atomically replaced once it is
+  complete, so an interrupted save never corrupts the previous snapshot.
+  """
+
+  _LATEST_FILENAME = "LATEST"
+  _METADATA_FILENAME = "metadata.json"
+
+  def __init__(
+      self,
+      directory: str,
+      every_num_chunks: int = 1,
+      samples: Optional[tuple[int, int]] = None):
+    """Initializes the checkpointer.
+
+    Args:
+      directory: Directory of the snapshots.
+      every_num_chunks: Snapshots are saved after every `every_num_chunks`
+        chunks, as well as after the last one.
+      samples: Optional range of samples the rollout is for, see
+        `for_samples`.
+    """
+    self._directory = directory
+    self.every_num_chunks = every_num_chunks
+    self._samples = samples
+
+  def for_samples(self, start: int, stop: int) -> "RolloutCheckpointer":
+    """Checkpointer for the rollout of samples [start, stop) of an ensemble.
+
+    It shares the directory, but only restores snapshots for the same samples.
+
+    Args:
+      start: First sample.
+      stop: End of the range of samples (exclusive).
+
+    Returns:
+      The checkpointer.
+    """
+    return RolloutCheckpointer(
+        self._directory, self.every_num_chunks, samples=(start, stop))
+
+  def save(self, state: RolloutState) -> None:
+    """Saves a snapshot of `state`, replacing the previous one."""
+    os.makedirs(self._directory, exist_ok=True)
+    samples = state.samples if state.samples is not None else self._samples
+    name = f"snapshot_{samples[0] if samples else 0}_{state.chunk_index}"
+    path = os.path.join(self._directory, name)
+    tmp_path = tempfile.mkdtemp(dir=self._directory, prefix=".tmp_")
+    try:
+      if state.inputs is not None:
+        inputs = jax.device_get(state.inputs)
+        for variable in inputs.variables.values():
+          variable.encoding = {}
+        inputs.to_zarr(os.path.join(tmp_path, "inputs.zarr"))
+      np.save(os.path.join(tmp_path, "rng.npy"),
+              np.asarray(jax.device_get(state.rng)), allow_pickle=False)
+      with open(os.path.join(tmp_path, self._METADATA_FILENAME), "w") as f:
+        json.dump({
+            "chunk_index": state.chunk_index,
+            "input_variables": (list(state.inputs.data_vars)
+                                if state.inputs is not None else None),
+            "samples": list(samples) if samples is not None else None,
+        }, f)
+      shutil.rmtree(path, ignore_errors=True)
+      os.rename(tmp_path, path)
+    except BaseException:
+      shutil.rmtree(tmp_path, ignore_errors=True)
+      raise
+
+    latest_tmp_path = os.path.join(
+        self._directory, f".{self._LATEST_FILENAME}.tmp")
+    with open(latest_tmp_path, "w") as f:
+      f.write(name)
+    os.replace(latest_tmp_path,
+               os.path.join(self._directory, self._LATEST_FILENAME))
+
+    # Older snapshots are no longer needed.
+    for other_name in os.listdir(self._directory):
+      if other_name.startswith("snapshot_") and other_name != name:
+        shutil.rmtree(
+            os.path.join(self._directory, other_name), ignore_errors=True)
+
+  def restore(self, any_samples: bool = False) -> Optional[RolloutState]:
+    """Returns the last snapshot, or None if there is none.
+
+    Args:
+      any_samples: Whether to return the last snapshot regardless of its
+        samples. Otherwise only a snapshot for the samples of this checkpointer
+        is returned.
+    """
+    try:
+      with open(os.path.join(self._directory, self._LATEST_FILENAME)) as f:
+        path = os.path.join(self._directory, f.read().strip())
+      with open(os.path.join(path, self._METADATA_FILENAME)) as f:
+        metadata = json.load(f)
+    except FileNotFoundError:
+      return None
+
+    samples = (tuple(metadata["samples"])
+               if metadata["samples"] is not None else None)
+    if not any_samples and samples != self._samples:
+      return None
+    if metadata["input_variables"] is not None:
+      with xarray.open_zarr(os.path.join(path, "inputs.zarr")) as inputs:
+        # Models may depend on the order of the variables.
+        inputs = inputs[metadata["input_variables"]].compute()
+    else:
+      inputs = None
+    return RolloutState(
+        chunk_index=metadata["chunk_index"],
+        inputs=inputs,
+        rng=np.load(os.path.join(path, "rng.npy"), allow_pickle=False),
+        samples=samples)
+
+
+@dataclasses.dataclass(frozen=True)
+class OutputSpec:
+  """Subset of the predictions of a rollout that is output.
+
+  The subset is taken on device, before predictions are transferred to host,
+  while the rollout itself still uses the full predictions. Fields left as
+  None are not subset.
+
+  Attributes:
+    variables: Names of the variables to output.
+    levels: Pressure levels to output, for variables with a "level" dimension.
+    lead_times: Lead times to output, as in the "time" coordinate of the
+      targets template (e.g. "24h" or `np.timedelta64(24, "h")`).
+    lat_range: Inclusive (min, max) range of latitudes to output.
+    lon_range: Inclusive (min, max) range of longitudes to output. If min is
+      greater than max, the range wraps around, e.g. (350, 10).
+  """
+  variables: Optional[Sequence[str]] = None
+  levels: Optional[Sequence[int]] = None
+  lead_times: Optional[Sequence[data_utils.TimedeltaLike]] = None
+  lat_range: Optional[tuple[float, float]] = None
+  lon_range: Optional[tuple[float, float]] = None
+
+  def apply(self, dataset: xarray.Dataset) -> xarray.Dataset:
+    """Returns the subset of `dataset` (e.g. predictions or a template)."""
+    indexers = {}
+    if self.lead_times is not None:
+      indexers["time"] = _isin_indices(
+          dataset.coords["time"].data, pd.to_timedelta(self.lead_times))
+    if self.levels is not None and "level" in dataset.dims:
+      indexers["level"] = _isin_indices(
+          dataset.coords["level"].data, self.levels)
+    if self.lat_range is not None:
+      lat = dataset.coords["lat"].data
+      indexers["lat"] = np.flatnonzero(
+          (lat >= min(self.lat_range)) & (lat <= max(self.lat_range)))
+    if self.lon_range is not None:
+      lon = dataset.coords["lon"].data
+      lon_min, lon_max = self.lon_range
+      if lon_min <= lon_max:
+        lon_mask = (lon >= lon_min) & (lon <= lon_max)
+      else:
+        lon_mask = (lon >= lon_min) | (lon <= lon_max)
+      indexers["lon"] = np.flatnonzero(lon_mask)
+    if self.variables is not None:
+      dataset = dataset[list(self.variables)]
+    # Integer indices, which also work on device (xarray_jax) data.
+    return dataset.isel(indexers)
+
+
+def _isin_indices(values: np.ndarray, selected) -> np.ndarray:
+  return np.flatnonzero(np.isin(values, np.asarray(selected, values.dtype)))
+
+
 def _replicate_dataset(
     data: xarray.Dataset, replica_dim: str,
     replicate_to_device: bool,
@@ -83,6 +302,11 @@ def chunked_prediction_generator_multiple_runs(
     forcings: Optional[xarray.Dataset],
     num_samples: Optional[int],
     pmap_devices: Optional[Sequence[jax.Device]] = None,
+    vectorize_samples: bool = False,
+    samples_per_group: Optional[int] = None,
+    memory_budget_bytes: Optional[int] = None,
+    checkpointer: Optional[RolloutCheckpointer] = None,
+    mesh: Optional[jax.sharding.Mesh] = None,
     **chunked_prediction_kwargs,
 ) -> Iterator[xarray.Dataset]:
   """Outputs a trajectory of multiple samples by yielding chunked predictions.
@@ -97,6 +321,25 @@ def chunked_prediction_generator_multiple_runs(
     num_samples: The number of runs / samples to rollout.
     pmap_devices: List of devices over which predictor_fn is pmapped, or None if
       it is not pmapped.
+    vectorize_samples: If True (and not pmapped), groups of samples are
+      predicted together, by vmapping (and jitting) `predictor_fn` over a
+      "sample" dimension, with one rng per sample. Otherwise samples are
+      predicted one after the other.
+    samples_per_group: Number of samples to vectorize over. If None, it is
+      derived from `memory_budget_bytes`, or all samples are predicted at once
+      if that is None too. The last group is padded to this size, so
+      `predictor_fn` is only compiled once.
+    memory_budget_bytes: Device memory available for a call of the vmapped
+      `predictor_fn`, used if `samples_per_group` is None.
+    checkpointer: Optional checkpointer, see `chunked_prediction_generator`.
+      Snapshots record the range of samples being rolled out, and on resume
+      the samples before that range are skipped.
+    mesh: Optional device mesh to shard the samples over, an alternative to
+      `pmap_devices`. Groups of samples are vectorized as with
+      `vectorize_samples`, and the "sample" dimension of their inputs and rngs
+      is sharded over all the axes of the mesh, with the inputs kept on device
+      between chunks. `samples_per_group` is rounded up to a multiple of the
+      number of devices, so `num_samples` does not need to be one.
     **chunked_prediction_kwargs:
       See chunked_prediction, some of these are required arguments.
 
@@ -106,6 +349,20 @@ def chunked_prediction_generator_multiple_runs(
     this would match the targets template in structure.
 
   """
+  first_sample = 0
+  if checkpointer is not None:
+    state = checkpointer.restore(any_samples=True)
+    if state is not None and state.samples is not None:
+      first_sample = state.samples[0]
+
+  def samples_checkpointer(start, stop):
+    if checkpointer is None:
+      return None
+    return checkpointer.for_samples(start, stop)
+
+  if pmap_devices is not None and mesh is not None:
+    raise ValueError("Only one of `pmap_devices` and `mesh` can be set.")
+
   if pmap_devices is not None:
     assert (
         num_samples % len(pmap_devices) == 0
@@ -121,6 +378,8 @@ def chunked_prediction_generator_multiple_runs(
       return predictor_fn(rng, inputs, targets_template, forcings)
 
     for i in range(0, num_samples, len(pmap_devices)):
+      if i + len(pmap_devices) <= first_sample:
+        continue
       sample_idx = slice(i, i + len(pmap_devices))
       logging.info("Samples %s out of %s", sample_idx, num_samples)
       logging.flush()
@@ -167,6 +426,7 @@ def chunked_prediction_generator_multiple_runs(
           targets_template=targets_template,
           forcings=sample_forcings,
           pmap_devices=pmap_devices,
+          checkpointer=samples_checkpointer(sample_idx.start, sample_idx.stop),
           **chunked_prediction_kwargs,
       ):
         prediction_chunk.coords["sample"] = np.arange(
@@ -174,8 +434,80 @@ def chunked_prediction_generator_multiple_runs(
         )
         yield prediction_chunk
         del prediction_chunk
+  elif vectorize_samples or mesh is not None:
+    vmapped_predictor_fn = xarray_jax.vmap(
+        _predictor_fn_with_positional_args(predictor_fn), dim="sample")
+    jitted_predictor_fn = jax.jit(vmapped_predictor_fn)
+
+    def predictor_fn_vmap_named_args(rng, inputs, targets_template, forcings):
+      return jitted_predictor_fn(rng, inputs, targets_template, forcings)
+
+    def select_samples(data, sample_indices):
+      if data is None or "sample" not in data.dims:
+        return data
+      return data.isel(sample=sample_indices).drop_vars(
+          "sample", errors="ignore")
+
+    if samples_per_group is None:
+      if memory_budget_bytes is None:
+        samples_per_group = num_samples
+      else:
+        chunk_slice = slice(
+            0, chunked_prediction_kwargs.get("num_steps_per_chunk", 1))
+        chunk_forcings = (forcings.isel(time=chunk_slice)
+                          if forcings is not None else xarray.Dataset())
+
+        def memory_bytes(num_copies):
+          sample_indices = np.arange(num_copies) % num_samples
+          return _compiled_memory_bytes(
+              vmapped_predictor_fn,
+              rngs[sample_indices],
+              select_samples(inputs, sample_indices),
+              targets_template.isel(time=chunk_slice),
+              select_samples(chunk_forcings, sample_indices))
+
+        samples_per_group = _max_copies_within_budget(
+            memory_bytes, memory_budget_bytes)
+    samples_per_group = min(samples_per_group, num_samples)
+    if mesh is not None:
+      samples_per_group = -(-samples_per_group // mesh.size) * mesh.size
+      chunked_prediction_kwargs.update(mesh=mesh, sharded_dim="sample")
+
+    for i in range(0, num_samples, samples_per_group):
+      if i + samples_per_group <= first_sample:
+        continue
+      sample_indices = np.arange(i, min(i + samples_per_group, num_samples))
+      logging.info("Samples %s out of %s", sample_indices, num_samples)
+      logging.flush()
+      # Pad with the last sample, so the shapes do not change.
+      padded_sample_indices = np.pad(
+          sample_indices, (0, samples_per_group - len(sample_indices)),
+          mode="edge")
+
+      sample_inputs = select_samples(inputs, padded_sample_indices)
+      if mesh is not None and "sample" not in sample_inputs.dims:
+        # The time-varying inputs become different for each sample after the
+        # first chunk, so they need a (sharded) "sample" dimension from the
+        # start to be updated in place.
+        sample_inputs = _broadcast_time_varying(
+            sample_inputs, "sample", samples_per_group)
+
+      for prediction_chunk in chunked_prediction_generator(
+          predictor_fn=predictor_fn_vmap_named_args,
+          rng=rngs[padded_sample_indices],
+          inputs=sample_inputs,
+          targets_template=targets_template,
+          forcings=select_samples(forcings, padded_sample_indices),
+          checkpointer=samples_checkpointer(
+              int(sample_indices[0]), int(sample_indices[-1]) + 1),
+          **chunked_prediction_kwargs):
+        prediction_chunk = prediction_chunk.isel(
+            sample=slice(0, len(sample_indices)))
+        prediction_chunk.coords["sample"] = sample_indices
+        yield prediction_chunk
+        del prediction_chunk
   else:
-    for i in range(num_samples):
+    for i in range(first_sample, num_samples):
       logging.info("Sample %d/%d", i, num_samples)
       logging.flush()
       this_sample_rng = rngs[i]
@@ -196,20 +528,33 @@ def chunked_prediction_generator_multiple_runs(
           inputs=sample_inputs,
           targets_template=targets_template,
           forcings=sample_forcings,
+          checkpointer=samples_checkpointer(i, i + 1),
           **chunked_prediction_kwargs):
         prediction_chunk.coords["sample"] = i
         yield prediction_chunk
         del prediction_chunk
 
 
+def _broadcast_time_varying(
+    inputs: xarray.Dataset, dim: str, size: int) -> xarray.Dataset:
+  """Adds a leading `dim` of `size` to the time-varying variables of `inputs`."""
+  inputs = inputs.copy()
+  for name, variable in inputs.data_vars.items():
+    if "time" in variable.dims:
+      inputs[name] = variable.expand_dims({dim: size})
+  return inputs
+
+
 def chunked_prediction(
     predictor_fn: PredictorFn,
     rng: chex.PRNGKey,
     inputs: xarray.Dataset,
     targets_template: xarray.Dataset,
-    forcings: xarray.Dataset,
+    forcings: Union[xarray.Dataset, ForcingsFn, None],
     num_steps_per_chunk: int = 1,
     verbose: bool = False,
+    output_spec: Optional[OutputSpec] = None,
+    mesh: Optional[jax.sharding.Mesh] = None,
 ) -> xarray.Dataset:
   """Outputs a long trajectory by iteratively concatenating chunked predictions.
 
@@ -219,11 +564,16 @@ def chunked_prediction(
     inputs: Inputs for the model.
     targets_template: Template for the target prediction, requires targets
         equispaced in time.
-    forcings: Optional forcing for the model.
+    forcings: Optional forcing for the model, or a function computing them
+      for each chunk, see `chunked_prediction_generator`.
     num_steps_per_chunk: How many of the steps in `targets_template` to predict
         at each call of `predictor_fn`. It must evenly divide the number of
         steps in `targets_template`.
     verbose: Whether to log the current chunk being predicted.
+    output_spec: Optional subset of the predictions to return, see
+      `chunked_prediction_generator`.
+    mesh: Optional device mesh to shard the "batch" dimension over, see
+      `chunked_prediction_generator`.
 
   Returns:
     Predictions for the targets template.
@@ -237,48 +587,532 @@ def chunked_prediction(
       targets_template=targets_template,
       forcings=forcings,
       num_steps_per_chunk=num_steps_per_chunk,
-      verbose=verbose):
+      verbose=verbose,
+      output_spec=output_spec,
+      mesh=mesh):
     chunks_list.append(jax.device_get(prediction_chunk))
   return xarray.concat(chunks_list, dim="time")
 
 
+def chunked_prediction_multiple_inits(
+    predictor_fn: PredictorFn,
+    rng: chex.PRNGKey,
+    inputs: Sequence[xarray.Dataset],
+    targets_templates: Sequence[xarray.Dataset],
+    forcings: Union[Sequence[xarray.Dataset], ForcingsFn, None],
+    batch_size: Optional[int] = None,
+    memory_budget_bytes: Optional[int] = None,
+    num_steps_per_chunk: int = 1,
+    verbose: bool = False,
+    output_spec: Optional[OutputSpec] = None,
+    mesh: Optional[jax.sharding.Mesh] = None,
+) -> Iterator[xarray.Dataset]:
+  """Forecasts from several initialization times, packed along "batch".
+
+  Initializations are grouped into batches of `batch_size`, whose inputs,
+  forcings and targets templates (including their "datetime" coordinates) are
+  concatenated along the "batch" dimension and rolled out together with
+  `chunked_prediction`. The last batch is padded by repeating its last
+  initialization, so all the batches have the same shape and `predictor_fn` is
+  only compiled once.
+
+  Args:
+    predictor_fn: Function to use to make predictions for each chunk.
+    rng: Random key, split for each batch.
+    inputs: Inputs for each initialization, with a "batch" dimension.
+    targets_templates: Templates for the target prediction of each
+      initialization. These must all have the same (relative) time
+      coordinates, and are typically only different in their "datetime".
+    forcings: Optional forcings for each initialization, or a function
+      computing them for each chunk of a batch, see
+      `chunked_prediction_generator`.
+    batch_size: How many initializations to predict at once. If None, it is
+      derived from `memory_budget_bytes` with `max_batch_size_for_memory`, or
+      all the initializations are predicted at once if that is None too.
+    memory_budget_bytes: Device memory available for each call of
+      `predictor_fn`, used if `batch_size` is None.
+    num_steps_per_chunk: See `chunked_prediction`.
+    verbose: Whether to log the current batch being predicted.
+    output_spec: Optional subset of the predictions to yield, see
+      `chunked_prediction_generator`.
+    mesh: Optional device mesh to shard the "batch" dimension of each batch
+      over, see `chunked_prediction_generator`. `batch_size` is rounded up to a
+      multiple of the number of devices, so with a "batch" of size 1 per
+      initialization the number of initializations does not need to be one.
+
+  Yields:
+    The predictions for each initialization, in order, with a "batch"
+    dimension of the same size as in its inputs.
+  """
+  num_inits = len(inputs)
+  if callable(forcings):
+    forcings_fn, forcings = forcings, None
+  else:
+    forcings_fn = None
+  if len(targets_templates) != num_inits or (
+      forcings is not None and len(forcings) != num_inits):
+    raise ValueError(
+        "Expected the same number of inputs, targets templates and forcings, "
+        f"got {num_inits}, {len(targets_templates)} and "
+        f"{len(forcings) if forcings is not None else None}.")
+  if num_inits == 0:
+    return
+
+  if batch_size is None:
+    if memory_budget_bytes is None:
+      batch_size = num_inits
+    else:
+      chunk_slice = slice(0, num_steps_per_chunk)
+      chunk_targets_template = targets_templates[0].isel(time=chunk_slice)
+      if forcings is not None:
+        chunk_forcings = forcings[0].isel(time=chunk_slice)
+      elif forcings_fn is not None:
+        chunk_forcings = _chunk_forcings_fn(
+            forcings_fn, targets_templates[0].coords.get("datetime"))(
+                chunk_slice)
+      else:
+        chunk_forcings = None
+      batch_size = max_batch_size_for_memory(
+          predictor_fn, rng, inputs[0], chunk_targets_template,
+          chunk_forcings, memory_budget_bytes)
+    batch_size = min(batch_size, num_inits)
+  if mesh is not None:
+    batch_size = -(-batch_size // mesh.size) * mesh.size
+
+  for start in range(0, num_inits, batch_size):
+    indices = list(range(start, min(start + batch_size, num_inits)))
+    if verbose:
+      logging.info("Initializations %d-%d/%d",
+                   indices[0], indices[-1], num_inits)
+      logging.flush()
+    # Pad with the last initialization, so the shapes do not change.
+    padded_indices = indices + [indices[-1]] * (batch_size - len(indices))
+    rng, this_rng = jax.random.split(rng)
+    predictions = chunked_prediction(
+        predictor_fn=predictor_fn,
+        rng=this_rng,
+        inputs=_pack_batch([inputs[i] for i in padded_indices]),
+        targets_template=_pack_batch(
+            [targets_templates[i] for i in padded_indices]),
+        forcings=(_pack_batch([forcings[i] for i in padded_indices])
+                  if forcings is not None else forcings_fn),
+        num_steps_per_chunk=num_steps_per_chunk,
+        output_spec=output_spec,
+        mesh=mesh)
+    batch_sizes = [inputs[i].sizes["batch"] for i in indices]
+    offsets = np.cumsum([0] + batch_sizes)
+    for offset, size in zip(offsets, batch_sizes):
+      yield predictions.isel(batch=slice(offset, offset + size))
+
+
+def max_batch_size_for_memory(
+    predictor_fn: PredictorFn,
+    rng: chex.PRNGKey,
+    inputs: xarray.Dataset,
+    targets_template: xarray.Dataset,
+    forcings: Optional[xarray.Dataset],
+    memory_budget_bytes: int,
+) -> int:
+  """Largest number of copies of a case to pack along "batch" within a budget.
+
+  The device memory of a call of `predictor_fn` is measured by compiling it
+  for one and two copies of the case. Their difference is the memory used by
+  each additional copy, and the rest (e.g. the parameters) is a fixed cost.
+
+  Args:
+    predictor_fn: Function to use to make predictions, as in
+      `chunked_prediction`.
+    rng: Random key.
+    inputs: Inputs of a single case.
+    targets_template: Targets template of a single call of `predictor_fn`
+      (i.e. a single chunk).
+    forcings: Optional forcings of a single call of `predictor_fn`.
+    memory_budget_bytes: Device memory available for a call of `predictor_fn`.
+
+  Returns:
+    The batch size, at least 1.
+  """
+  forcings = forcings if forcings is not None else xarray.Dataset()
+
+  def memory_bytes(num_copies):
+    return _compiled_memory_bytes(
+        _predictor_fn_with_positional_args(predictor_fn),
+        rng,
+        _pack_batch([inputs] * num_copies),
+        _pack_batch([targets_template] * num_copies),
+        _pack_batch([forcings] * num_copies))
+
+  return _max_copies_within_budget(memory_bytes, memory_budget_bytes)
+
+
+def _predictor_fn_with_positional_args(
+    predictor_fn: PredictorFn) -> Callable[..., xarray.Dataset]:
+  def fn(rng, inputs, targets_template, forcings):
+    return predictor_fn(
+        rng=rng, inputs=inputs, targets_template=targets_template,
+        forcings=forcings)
+  return fn
+
+
+def _compiled_memory_bytes(fn: Callable[..., object], *args) -> int:
+  """Device memory used by a call of `fn` once jitted, from `memory_analysis`."""
+  stats = jax.jit(fn).lower(*args).compile().memory_analysis()
+  if stats is None:
+    raise ValueError(
+        "Memory analysis is not available on this backend, pass the batch "
+        "size explicitly.")
+  return (stats.argument_size_in_bytes + stats.output_size_in_bytes +
+          stats.temp_size_in_bytes - stats.alias_size_in_bytes)
+
+
+def _max_copies_within_budget(
+    memory_bytes: Callable[[int], int], memory_budget_bytes: int) -> int:
+  """Largest number of copies within budget, given the memory of 1 and 2."""
+  single, double = memory_bytes(1), memory_bytes(2)
+  per_copy = max(double - single, 1)
+  fixed = single - per_copy
+  return max(1, (memory_budget_bytes - fixed) // per_copy)
+
+
+def _pack_batch(datasets: Sequence[xarray.Dataset]) -> xarray.Dataset:
+  """Concatenates datasets along "batch", sharing variables without it."""
+  if len(datasets) == 1:
+    return datasets[0]
+  return xarray.concat(
+      datasets, dim="batch", data_vars="minimal", coords="minimal",
+      compat="override", join="exact")
+
+
+@dataclasses.dataclass
+class WriteStats:
+  """Throughput of a rollout written with `chunked_prediction_to_writer`."""
+  num_chunks: int = 0
+  num_steps: int = 0
+  num_bytes: int = 0
+  # Time spent predicting (including transfer to host) and writing.
+  predict_seconds: float = 0.
+  write_seconds: float = 0.
+
+  @property
+  def steps_per_second(self) -> float:
+    total_seconds = self.predict_seconds + self.write_seconds
+    return self.num_steps / total_seconds if total_seconds else 0.
+
+  @property
+  def write_bytes_per_second(self) -> float:
+    return self.num_bytes / self.write_seconds if self.write_seconds else 0.
+
+
+def chunked_prediction_to_writer(
+    predictor_fn: PredictorFn,
+    rng: chex.PRNGKey,
+    inputs: xarray.Dataset,
+    targets_template: xarray.Dataset,
+    forcings: Union[xarray.Dataset, ForcingsFn, None],
+    writer: ChunkWriter,
+    num_steps_per_chunk: int = 1,
+    verbose: bool = False,
+    max_pending_chunks: Optional[int] = None,
+    output_spec: Optional[OutputSpec] = None,
+    checkpointer: Optional[RolloutCheckpointer] = None,
+) -> WriteStats:
+  """Like `chunked_prediction`, but streams each chunk to `writer`.
+
+  Each chunk is transferred to host memory, written and released before the
+  next one is consumed, so peak host memory is that of a single chunk,
+  regardless of the number of steps in `targets_template`.
+
+  Args:
+    predictor_fn: Function to use to make predictions for each chunk.
+    rng: Random key.
+    inputs: Inputs for the model.
+    targets_template: Template for the target prediction, requires targets
+        equispaced in time.
+    forcings: Optional forcing for the model, or a function computing them
+      for each chunk, see `chunked_prediction_generator`.
+    writer: Consumer of the predicted chunks, e.g. a `ZarrChunkWriter`.
+    num_steps_per_chunk: How many of the steps in `targets_template` to predict
+        at each call of `predictor_fn`. It must evenly divide the number of
+        steps in `targets_template`.
+    verbose: Whether to log the current chunk being predicted, and throughput.
+    max_pending_chunks: If set, the rollout is pipelined with
+      `pipelined_chunked_prediction_generator`, with up to this many chunks in
+      flight, so writing a chunk overlaps with predicting the next ones. Time
+      spent waiting for predictions is then reported as `predict_seconds`.
+    output_spec: Optional subset of the predictions to write, see
+      `chunked_prediction_generator`. The writer must expect the subset, e.g.
+      a `ZarrChunkWriter` created with `output_spec.apply(targets_template)`.
+    checkpointer: Optional checkpointer, which snapshots the rollout after
+      chunks have been written, see `chunked_prediction_generator`. To resume
+      an interrupted rollout, call this again with the same checkpointer and a
+      writer to the same store (e.g. a `ZarrChunkWriter` with mode "r+"): the
+      chunks written before the last snapshot are not predicted again. Not
+      supported with `max_pending_chunks`.
+
+  Returns:
+    Throughput statistics of the rollout.
+  """
+  if checkpointer is not None and max_pending_chunks is not None:
+    raise ValueError(
+        "Checkpointing is not supported with pipelined rollouts, as chunks "
+        "are predicted before the previous ones are written.")
+  generator_kwargs = dict(
+      predictor_fn=predictor_fn,
+      rng=rng,
+      inputs=inputs,
+      targets_template=targets_template,
+      forcings=forcings,
+      num_steps_per_chunk=num_steps_per_chunk,
+      verbose=verbose,
+      output_spec=output_spec,
+      checkpointer=checkpointer)
+  if max_pending_chunks is None:
+    prediction_chunks = chunked_prediction_generator(**generator_kwargs)
+  else:
+    prediction_chunks = pipelined_chunked_prediction_generator(
+        max_pending_chunks=max_pending_chunks, **generator_kwargs)
+
+  stats = WriteStats()
+  start_time = time_lib.perf_counter()
+  for prediction_chunk in prediction_chunks:
+    prediction_chunk = jax.device_get(prediction_chunk)
+    write_start_time = time_lib.perf_counter()
+    stats.predict_seconds += write_start_time - start_time
+
+    writer.write(prediction_chunk)
+
+    start_time = time_lib.perf_counter()
+    stats.write_seconds += start_time - write_start_time
+    stats.num_chunks += 1
+    stats.num_steps += prediction_chunk.sizes["time"]
+    stats.num_bytes += prediction_chunk.nbytes
+    del prediction_chunk
+    if verbose:
+      logging.info(
+          "Wrote %d steps, %.3f steps/s, %.1f MB/s written.", stats.num_steps,
+          stats.steps_per_second, stats.write_bytes_per_second / 1e6)
+  return stats
+
+
+class ZarrChunkWriter:
+  """Writes the chunks of a rollout to a pre-allocated Zarr store.
+
+  The store is allocated on construction from `targets_template` (without
+  writing any data), chunked along time by `num_steps_per_chunk`, so that each
+  chunk of predictions is written to its own Zarr chunks with a region write.
+
+  Example usage::
+
+    writer = rollout.ZarrChunkWriter(
+        "predictions.zarr", targets_template, num_steps_per_chunk=1)
+    rollout.chunked_prediction_to_writer(
+        predictor_fn, rng, inputs, targets_template, forcings, writer)
+    predictions = xarray.open_zarr("predictions.zarr")
+  """
+
+  def __init__(
+      self,
+      path: str,
+      targets_template: xarray.Dataset,
+      num_steps_per_chunk: int = 1,
+      mode: str = "w-",
+  ):
+    """Allocates the store.
+
+    Args:
+      path: Path of the Zarr store.
+      targets_template: Template of the whole rollout, as passed to
+        `chunked_prediction_to_writer`. Only its structure, coordinates and
+        dtypes are used.
+      num_steps_per_chunk: Number of time steps per Zarr chunk, which should
+        match (or divide) the number of steps of the written chunks.
+      mode: Passed to `xarray.Dataset.to_zarr`, "w-" fails if the store exists
+        and "w" overwrites it. "r+" reuses an existing store without
+        allocating it, e.g. to resume a rollout with a `RolloutCheckpointer`.
+    """
+    self._path = path
+    self._time = targets_template.coords["time"].data
+
+    def lazy_zeros(variable: xarray.Variable) -> xarray.Variable:
+      chunks = tuple(
+          num_steps_per_chunk if dim == "time" else -1
+          for dim in variable.dims)
+      return xarray.Variable(
+          variable.dims,
+          dask.array.zeros(variable.shape, dtype=variable.dtype, chunks=chunks),
+          attrs=variable.attrs)
+
+    template = targets_template.copy(data={
+        name: lazy_zeros(variable.variable)
+        for name, variable in targets_template.data_vars.items()})
+    for variable in template.data_vars.values():
+      variable.encoding = {}
+    if mode != "r+":
+      template.to_zarr(path, mode=mode, compute=False)
+
+  def write(self, chunk: xarray.Dataset) -> None:
+    """Writes `chunk` to the region of the store matching its times."""
+    indices = np.searchsorted(self._time, chunk.coords["time"].data)
+    if not np.array_equal(self._time[indices], chunk.coords["time"].data):
+      raise ValueError(
+          f"Chunk times {chunk.coords['time'].data} are not in the template.")
+    region = slice(int(indices[0]), int(indices[-1]) + 1)
+    if region.stop - region.start != len(indices):
+      raise ValueError("Chunk times must be contiguous in the template.")
+    # Only variables along time are written, the others (e.g. lat/lon
+    # coordinates) are already in the store.
+    chunk = chunk.drop_vars(
+        [name for name, variable in chunk.variables.items()
+         if "time" not in variable.dims])
+    chunk.to_zarr(self._path, mode="r+", region={"time": region})
+
+
+def pipelined_chunked_prediction_generator(
+    max_pending_chunks: int = 2,
+    postprocess_fn: Callable[[xarray.Dataset], xarray.Dataset] = jax.device_get,
+    **chunked_prediction_kwargs,
+) -> Iterator[xarray.Dataset]:
+  """Like `chunked_prediction_generator`, overlapping device and host work.
+
+  A background thread runs `chunked_prediction_generator`, which dispatches
+  the prediction of each chunk asynchronously as soon as its inputs are
+  available (i.e. as soon as the previous chunk has been dispatched), and hands
+  each chunk to a second thread, which transfers it to host and applies
+  `postprocess_fn`. Chunks are yielded in order, once post-processed, so the
+  device computes chunk i+1 while chunk i is transferred, post-processed and
+  consumed.
+
+  At most `max_pending_chunks` chunks are dispatched and not yet consumed at any
+  time, which bounds memory use. Exceptions raised while predicting or
+  post-processing are re-raised by this generator, and closing it early stops
+  the background threads after the chunk being dispatched.
+
+  Args:
+    max_pending_chunks: Maximum number of chunks in flight.
+    postprocess_fn: Applied to each chunk of (device) predictions, in a
+      background thread. Defaults to transferring the chunk to host.
+    **chunked_prediction_kwargs: See `chunked_prediction_generator`.
+
+  Yields:
+    The post-processed predictions for each chunk, in order.
+  """
+  if max_pending_chunks < 1:
+    raise ValueError("`max_pending_chunks` must be positive.")
+  pending_chunks = queue.Queue()
+  # Counts the chunks that may still be dispatched, i.e. `max_pending_chunks`
+  # minus the chunks dispatched and not yet consumed. Acquired by the dispatch
+  # thread before advancing `chunked_prediction_generator`, and released once
+  # the consumer is done with a chunk.
+  dispatch_slots = threading.Semaphore(max_pending_chunks)
+  stop = threading.Event()
+  done = object()  # Marks the end of the chunks.
+
+  def acquire_dispatch_slot():
+    while not stop.is_set():
+      if dispatch_slots.acquire(timeout=0.1):
+        return True
+    return False
+
+  def dispatch_chunks(executor):
+    try:
+      prediction_chunks = chunked_prediction_generator(
+          **chunked_prediction_kwargs)
+      while acquire_dispatch_slot():
+        prediction_chunk = next(prediction_chunks, done)
+        if prediction_chunk is done:
+          pending_chunks.put(done)
+          return
+        pending_chunks.put(executor.submit(postprocess_fn, prediction_chunk))
+        del prediction_chunk
+    except BaseException as e:  # pylint: disable=broad-exception-caught
+      pending_chunks.put(e)
+
+  with futures.ThreadPoolExecutor(max_workers=1) as executor:
+    dispatch_thread = threading.Thread(
+        target=dispatch_chunks, args=(executor,), daemon=True)
+    dispatch_thread.start()
+    try:
+      while True:
+        item = pending_chunks.get()
+        if item is done:
+          break
+        if isinstance(item, BaseException):
+          raise item
+        yield item.result()
+        del item
+        dispatch_slots.release()
+    finally:
+      stop.set()
+      dispatch_thread.join()
+
+
 def chunked_prediction_generator(
     predictor_fn: PredictorFn,
     rng: chex.PRNGKey,
     inputs: xarray.Dataset,
     targets_template: xarray.Dataset,
-    forcings: xarray.Dataset,
+    forcings: Union[xarray.Dataset, ForcingsFn, None],
     num_steps_per_chunk: int = 1,
     verbose: bool = False,
-    pmap_devices: Optional[Sequence[jax.Device]] = None
+    pmap_devices: Optional[Sequence[jax.Device]] = None,
+    device_resident_inputs: bool = False,
+    output_spec: Optional[OutputSpec] = None,
+    checkpointer: Optional[RolloutCheckpointer] = None,
+    mesh: Optional[jax.sharding.Mesh] = None,
+    sharded_dim: str = "batch",
 ) -> Iterator[xarray.Dataset]:
   """Outputs a long trajectory by yielding chunked predictions.
 
   Args:
     predictor_fn: Function to use to make predictions for each chunk.
-    rng: Random key.
+    rng: Random key, or a batch of keys (e.g. one per vmapped sample) which are
+      each split independently.
     inputs: Inputs for the model.
     targets_template: Template for the target prediction, requires targets
         equispaced in time.
-    forcings: Optional forcing for the model.
+    forcings: Optional forcing for the model. This can also be a function
+      computing the forcings of each chunk just-in-time from the target
+      datetimes of the chunk (see `ForcingsFn`), in which case the targets
+      template must have a "datetime" coordinate.
     num_steps_per_chunk: How many of the steps in `targets_template` to predict
         at each call of `predictor_fn`. It must evenly divide the number of
         steps in `targets_template`.
     verbose: Whether to log the current chunk being predicted.
     pmap_devices: List of devices over which predictor_fn is pmapped, or None if
       it is not pmapped.
+    device_resident_inputs: If True, the time-varying inputs are kept on
+      device in a fixed-shape window, which is updated with the predictions
+      and forcings of each chunk by a jitted (or pmapped) function that donates
+      the previous window, instead of being rebuilt with `xarray.concat`. This
+      avoids copying and comparing the inputs on every chunk and, when
+      pmapped, transferring inputs and predictions back to host.
+    output_spec: Optional subset of the predictions to yield. It is applied to
+      the predictions of each chunk on device (unless pmapped without
+      `device_resident_inputs`, where predictions are transferred to host
+      anyway), after they have been used for the next inputs. Chunks without
+      any of the requested lead times are not yielded.
+    checkpointer: Optional checkpointer, which snapshots the state of the
+      rollout once the consumer has processed a chunk (i.e. when the next chunk
+      is requested). If it already has a snapshot, the rollout resumes from it,
+      and the chunks before it are not yielded again.
+    mesh: Optional device mesh, an alternative to `pmap_devices` where
+      `predictor_fn` is a jitted function of unreplicated data. The inputs
+      are sharded along `sharded_dim` over all the axes of the mesh (as is the
+      rng, if it is a batch of keys), and they are kept on device as with
+      `device_resident_inputs`, so the predictions are sharded too.
+    sharded_dim: Dimension of the inputs to shard over `mesh`. Its size must be
+      divisible by the number of devices in the mesh.
 
   Yields:
     The predictions for each chunked step of the chunked rollout, such as
     if all predictions are concatenated in time this would match the targets
-    template in structure.
+    template (subset with `output_spec`, if any) in structure.
 
   """
 
   # Create copies to avoid mutating inputs.
-  inputs = xarray.Dataset(inputs)
-  targets_template = xarray.Dataset(targets_template)
-  forcings = xarray.Dataset(forcings)
+  inputs = inputs.copy()
+  targets_template = targets_template.copy()
 
   if "datetime" in inputs.coords:
     del inputs.coords["datetime"]
@@ -289,10 +1123,9 @@ def chunked_prediction_generator(
   else:
     output_datetime = None
 
-  if "datetime" in forcings.coords:
-    del forcings.coords["datetime"]
+  get_forcings = _chunk_forcings_fn(forcings, output_datetime)
 
-  num_target_steps = targets_template.dims["time"]
+  num_target_steps = targets_template.sizes["time"]
   num_chunks, remainder = divmod(num_target_steps, num_steps_per_chunk)
   if remainder != 0:
     raise ValueError(
@@ -308,6 +1141,26 @@ def chunked_prediction_generator(
       time=slice(0, num_steps_per_chunk))
 
   current_inputs = inputs
+  start_chunk_index = 0
+  if checkpointer is not None:
+    state = checkpointer.restore()
+    if state is not None:
+      if verbose:
+        logging.info("Resuming from chunk %d/%d", state.chunk_index, num_chunks)
+      start_chunk_index = state.chunk_index
+      current_inputs = state.inputs
+      rng = state.rng
+  if mesh is not None:
+    if pmap_devices is not None:
+      raise ValueError("Only one of `pmap_devices` and `mesh` can be set.")
+    device_resident_inputs = True
+    if current_inputs is not None:
+      current_inputs = _shard_over_mesh(current_inputs, mesh, sharded_dim)
+    if _is_batch_of_keys(rng):
+      rng = _shard_over_mesh(rng, mesh)
+  if device_resident_inputs and current_inputs is not None:
+    input_window = _DeviceInputWindow(current_inputs, pmap_devices)
+    current_inputs = input_window.inputs()
 
   def split_rng_fn(rng):
     # Note, this is *not* equivalent to `return jax.random.split(rng)`, because
@@ -320,8 +1173,11 @@ def chunked_prediction_generator(
 
   if pmap_devices is not None:
     split_rng_fn = jax.pmap(split_rng_fn, devices=pmap_devices)
+  elif _is_batch_of_keys(rng):
+    # E.g. one key per sample of a vmapped predictor, each split on its own.
+    split_rng_fn = jax.vmap(split_rng_fn)
 
-  for chunk_index in range(num_chunks):
+  for chunk_index in range(start_chunk_index, num_chunks):
     if verbose:
       logging.info("Chunk %d/%d", chunk_index, num_chunks)
       logging.flush()
@@ -337,7 +1193,7 @@ def chunked_prediction_generator(
     current_targets_template = current_targets_template.assign_coords(
         time=targets_chunk_time).compute()
 
-    current_forcings = forcings.isel(time=target_slice)
+    current_forcings = get_forcings(target_slice)
     current_forcings = current_forcings.assign_coords(time=targets_chunk_time)
     current_forcings = current_forcings.compute()
     # Make predictions for the chunk.
@@ -354,7 +1210,7 @@ def chunked_prediction_generator(
     # some performance impact, but maximise the memory efficiency.
     # TODO(aelkadi): Pmap `_get_next_inputs` when running under pmap, and
     # remove the device_get.
-    if pmap_devices is not None:
+    if pmap_devices is not None and not device_resident_inputs:
       predictions = jax.device_get(predictions)
       current_forcings = jax.device_get(current_forcings)
       current_inputs = jax.device_get(current_inputs)
@@ -362,6 +1218,9 @@ def chunked_prediction_generator(
     if chunk_index == num_chunks - 1:
       # No need to call `_get_next_inputs` on the last iteration.
       current_inputs = None
+    elif device_resident_inputs:
+      input_window.update(predictions, current_forcings)
+      current_inputs = input_window.inputs()
     else:
       next_frame = xarray.merge([predictions, current_forcings])
       next_inputs = _get_next_inputs(current_inputs, next_frame)
@@ -375,10 +1234,325 @@ def chunked_prediction_generator(
     if output_datetime is not None:
       predictions.coords["datetime"] = output_datetime.isel(
           time=target_slice)
+    if output_spec is not None:
+      predictions = output_spec.apply(predictions)
+    if output_spec is None or predictions.sizes["time"]:
+      yield predictions
+    del predictions
+
+    # Snapshots are taken once the chunk has been consumed (e.g. written).
+    if checkpointer is not None and (
+        (chunk_index + 1) % checkpointer.every_num_chunks == 0
+        or chunk_index == num_chunks - 1):
+      checkpointer.save(RolloutState(
+          chunk_index=chunk_index + 1, inputs=current_inputs, rng=rng))
+
+
+def scanned_chunked_prediction_generator(
+    predictor_fn: PredictorFn,
+    rng: chex.PRNGKey,
+    inputs: xarray.Dataset,
+    targets_template: xarray.Dataset,
+    forcings: Union[xarray.Dataset, ForcingsFn, None],
+    num_steps_per_chunk: int = 1,
+    num_chunks_per_scan: Optional[int] = None,
+    use_scan: bool = True,
+    verbose: bool = False,
+    output_spec: Optional[OutputSpec] = None,
+) -> Iterator[xarray.Dataset]:
+  """Outputs a long trajectory, compiling several chunks into one program.
+
+  The chunks of each scan (a "super-chunk") are rolled out by a single jitted
+  call, using `xarray_jax.scan` over the chunks, so there is no Python
+  overhead or dispatch latency between chunks. The inputs are donated to the
+  jitted call and carried from one scan to the next on device, and the
+  predictions of a scan are gathered by the scan into a single device buffer.
+
+  Chunks are predicted with the same rngs as in `chunked_prediction_generator`,
+  so both give the same predictions.
+
+  Args:
+    predictor_fn: Function to use to make predictions for each chunk. It must be
+      traceable by `jax.jit` (it may itself be jitted).
+    rng: Random key.
+    inputs: Inputs for the model.
+    targets_template: Template for the target prediction, requires targets
+        equispaced in time.
+    forcings: Optional forcing for the model, or a function computing them
+      for each scan, see `chunked_prediction_generator`.
+    num_steps_per_chunk: How many of the steps in `targets_template` to predict
+        at each call of `predictor_fn`. It must evenly divide the number of
+        steps in `targets_template`.
+    num_chunks_per_scan: How many chunks to roll out in each jitted call. It
+      must evenly divide the number of chunks. Defaults to all the chunks, in
+      which case the whole trajectory is compiled into a single program.
+    use_scan: If False, falls back to `chunked_prediction_generator` with
+      device resident inputs, yielding one chunk at a time. This is useful for
+      memory constrained runs, where the predictions of a whole scan do not
+      fit on device.
+    verbose: Whether to log the current scan being predicted.
+    output_spec: Optional subset of the predictions to yield, see
+      `chunked_prediction_generator`.
+
+  Yields:
+    The predictions for each scan of the rollout, such that if all predictions
+    are concatenated in time this would match the targets template in
+    structure. These are device arrays.
+  """
+  if not use_scan:
+    yield from chunked_prediction_generator(
+        predictor_fn=predictor_fn,
+        rng=rng,
+        inputs=inputs,
+        targets_template=targets_template,
+        forcings=forcings,
+        num_steps_per_chunk=num_steps_per_chunk,
+        verbose=verbose,
+        device_resident_inputs=True,
+        output_spec=output_spec)
+    return
+
+  # Create copies to avoid mutating inputs.
+  inputs = inputs.copy()
+  targets_template = targets_template.copy()
+
+  if "datetime" in inputs.coords:
+    del inputs.coords["datetime"]
+
+  if "datetime" in targets_template.coords:
+    output_datetime = targets_template.coords["datetime"]
+    del targets_template.coords["datetime"]
+  else:
+    output_datetime = None
+
+  get_forcings = _chunk_forcings_fn(forcings, output_datetime)
+
+  num_target_steps = targets_template.sizes["time"]
+  num_chunks, remainder = divmod(num_target_steps, num_steps_per_chunk)
+  if remainder != 0:
+    raise ValueError(
+        f"The number of steps per chunk {num_steps_per_chunk} must "
+        f"evenly divide the number of target steps {num_target_steps} ")
+  if num_chunks_per_scan is None:
+    num_chunks_per_scan = num_chunks
+  num_scans, remainder = divmod(num_chunks, num_chunks_per_scan)
+  if remainder != 0:
+    raise ValueError(
+        f"The number of chunks per scan {num_chunks_per_scan} must "
+        f"evenly divide the number of chunks {num_chunks} ")
+
+  if len(np.unique(np.diff(targets_template.coords["time"].data))) > 1:
+    raise ValueError("The targets time coordinates must be evenly spaced")
+
+  targets_chunk_time = targets_template.time.isel(
+      time=slice(0, num_steps_per_chunk))
+  chunk_targets_template = targets_template.isel(
+      time=slice(0, num_steps_per_chunk)).assign_coords(
+          time=targets_chunk_time).compute()
+
+  # Same sequence of rngs as in `chunked_prediction_generator`.
+  chunk_rngs = []
+  for _ in range(num_chunks):
+    rng, this_rng = jax.random.split(rng)
+    chunk_rngs.append(this_rng)
+
+  scan_fn = jax.jit(
+      functools.partial(_scan_chunks, predictor_fn), donate_argnums=0)
+  # Copied, so donating the carried inputs never invalidates the caller's
+  # arrays.
+  current_inputs = jax.tree.map(jnp.array, inputs)
+  num_steps_per_scan = num_steps_per_chunk * num_chunks_per_scan
+  for scan_index in range(num_scans):
+    if verbose:
+      logging.info("Scan %d/%d", scan_index, num_scans)
+      logging.flush()
+
+    target_offset = num_steps_per_scan * scan_index
+    target_slice = slice(target_offset, target_offset + num_steps_per_scan)
+    # Forcings of each chunk of the scan, stacked along a "chunk" dimension.
+    scan_forcings = get_forcings(target_slice)
+    scan_forcings = xarray.concat(
+        [scan_forcings.isel(time=slice(offset, offset + num_steps_per_chunk))
+         .assign_coords(time=targets_chunk_time)
+         for offset in range(0, num_steps_per_scan, num_steps_per_chunk)],
+        dim="chunk").compute()
+    missing_names = [
+        name for name, variable in inputs.data_vars.items()
+        if "time" in variable.dims and name not in targets_template
+        and name not in scan_forcings]
+    if missing_names:
+      raise ValueError(
+          "Found an input with a time index that is not predicted or forced: "
+          f"{missing_names}.")
+    chunk_index = scan_index * num_chunks_per_scan
+    scan_rngs = jnp.stack(
+        chunk_rngs[chunk_index:chunk_index + num_chunks_per_scan])
+
+    current_inputs, predictions = scan_fn(
+        current_inputs, chunk_targets_template, scan_forcings, scan_rngs)
+
+    predictions = predictions.assign_coords(
+        time=targets_template.coords["time"].isel(time=target_slice))
+    if output_datetime is not None:
+      predictions.coords["datetime"] = output_datetime.isel(
+          time=target_slice)
+    if output_spec is not None:
+      predictions = output_spec.apply(predictions)
+      if not predictions.sizes["time"]:
+        continue
     yield predictions
     del predictions
 
 
+def _shard_over_mesh(
+    data, mesh: jax.sharding.Mesh, dim: Optional[str] = None):
+  """Shards `dim` of xarray data (or the leading axis of an array) on `mesh`."""
+  if dim is None:
+    return jax.device_put(data, jax.sharding.NamedSharding(
+        mesh, jax.sharding.PartitionSpec(mesh.axis_names)))
+  return xarray_jax.shard(data, mesh, {dim: mesh.axis_names})
+
+
+def _is_batch_of_keys(rng: chex.PRNGKey) -> bool:
+  if jax.dtypes.issubdtype(rng.dtype, jax.dtypes.prng_key):
+    return rng.ndim > 0
+  # Raw uint32 keys have a trailing axis of size 2.
+  return rng.ndim > 1
+
+
+def _chunk_forcings_fn(
+    forcings: Union[xarray.Dataset, ForcingsFn, None],
+    output_datetime: Optional[xarray.DataArray],
+) -> Callable[[slice], xarray.Dataset]:
+  """Returns a function from a slice of target steps to their forcings."""
+  if callable(forcings):
+    if output_datetime is None:
+      raise ValueError(
+          "Computing forcings requires a `datetime` coordinate on the targets "
+          "template.")
+    forcings_fn = forcings
+    return lambda target_slice: forcings_fn(  # pylint: disable=g-long-lambda
+        output_datetime.isel(time=target_slice)).drop_vars(
+            "datetime", errors="ignore")
+
+  # Create a copy to avoid mutating forcings.
+  forcings = forcings.copy() if forcings is not None else xarray.Dataset()
+  if "datetime" in forcings.coords:
+    del forcings.coords["datetime"]
+  return lambda target_slice: forcings.isel(time=target_slice)
+
+
+def _scan_chunks(
+    predictor_fn: PredictorFn,
+    inputs: xarray.Dataset,
+    targets_template: xarray.Dataset,
+    forcings: xarray.Dataset,
+    rngs: chex.PRNGKey,
+) -> tuple[xarray.Dataset, xarray.Dataset]:
+  """Rolls out the chunks stacked along the "chunk" dimension of `forcings`."""
+
+  def step(current_inputs, rng_and_forcings):
+    rng, current_forcings = rng_and_forcings
+    predictions = predictor_fn(
+        rng=rng,
+        inputs=current_inputs,
+        targets_template=targets_template,
+        forcings=current_forcings)
+    next_frame = {**current_forcings.data_vars, **predictions.data_vars}
+    next_inputs = current_inputs.copy()
+    for name, variable in current_inputs.data_vars.items():
+      if "time" in variable.dims:
+        next_inputs[name] = xarray_jax.Variable(
+            variable.dims,
+            _shift_window(
+                xarray_jax.unwrap_data(variable),
+                xarray_jax.unwrap_data(
+                    next_frame[name].transpose(*variable.dims)),
+                axis=variable.dims.index("time")),
+            attrs=variable.attrs)
+    predictions = predictions.drop_vars("time")
+    return next_inputs, predictions
+
+  next_inputs, predictions = xarray_jax.scan(
+      step, init=inputs, dim="chunk", xs=(rngs, forcings))
+
+  # Merge the "chunk" and "time" dimensions of the predictions.
+  merged_predictions = xarray.Dataset(
+      coords={name: coord for name, coord in predictions.coords.items()
+              if "chunk" not in coord.dims})
+  for name, variable in predictions.data_vars.items():
+    time_axis = variable.dims.index("time")
+    data = jnp.moveaxis(xarray_jax.unwrap_data(variable), 0, time_axis - 1)
+    data = data.reshape(
+        data.shape[:time_axis - 1] + (-1,) + data.shape[time_axis + 1:])
+    merged_predictions[name] = xarray_jax.Variable(
+        variable.dims[1:], data, attrs=variable.attrs)
+  return next_inputs, merged_predictions
+
+
+class _DeviceInputWindow:
+  """Time-varying inputs of a rollout, kept on device across chunks."""
+
+  def __init__(
+      self,
+      inputs: xarray.Dataset,
+      pmap_devices: Optional[Sequence[jax.Device]] = None):
+    self._inputs = inputs
+    self._time_varying_names = [
+        name for name, variable in inputs.data_vars.items()
+        if "time" in variable.dims]
+    # The window is copied, so donating it never invalidates the caller's
+    # arrays.
+    if pmap_devices is None:
+      copy_fn = jax.jit(jnp.copy)
+      shift_fn = lambda axis: jax.jit(  # pylint: disable=g-long-lambda
+          functools.partial(_shift_window, axis=axis), donate_argnums=0)
+      time_axis_offset = 0
+    else:
+      copy_fn = jax.pmap(jnp.copy, devices=pmap_devices)
+      shift_fn = lambda axis: jax.pmap(  # pylint: disable=g-long-lambda
+          functools.partial(_shift_window, axis=axis),
+          devices=pmap_devices, donate_argnums=0)
+      # Variables are replicated along a leading device axis (see
+      # `_replicate_dataset`), which is not seen by the pmapped function.
+      time_axis_offset = 1
+    self._window = {
+        name: copy_fn(xarray_jax.unwrap_data(inputs[name]))
+        for name in self._time_varying_names}
+    self._shift_fns = {
+        name: shift_fn(inputs[name].dims.index("time") - time_axis_offset)
+        for name in self._time_varying_names}
+
+  def inputs(self) -> xarray.Dataset:
+    """Returns the current inputs, wrapping the device arrays."""
+    inputs = self._inputs.copy()
+    for name in self._time_varying_names:
+      inputs[name] = xarray_jax.Variable(
+          inputs[name].dims, self._window[name], attrs=inputs[name].attrs)
+    return inputs
+
+  def update(self, predictions: xarray.Dataset, forcings: xarray.Dataset):
+    """Shifts the predictions and forcings of a chunk into the window."""
+    next_frame = {**forcings.data_vars, **predictions.data_vars}
+    missing_names = set(self._time_varying_names) - set(next_frame)
+    if missing_names:
+      raise ValueError(
+          "Found an input with a time index that is not predicted or forced: "
+          f"{sorted(missing_names)}.")
+    for name in self._time_varying_names:
+      frame = next_frame[name].transpose(*self._inputs[name].dims)
+      self._window[name] = self._shift_fns[name](
+          self._window[name], xarray_jax.unwrap_data(frame))
+
+
+def _shift_window(window: jax.Array, frame: jax.Array, axis: int) -> jax.Array:
+  """Appends `frame` to `window` along `axis`, dropping the oldest entries."""
+  num_inputs = window.shape[axis]
+  shifted = jnp.concatenate([window, frame.astype(window.dtype)], axis=axis)
+  return jax.lax.slice_in_dim(
+      shifted, shifted.shape[axis] - num_inputs, shifted.shape[axis], axis=axis)
+
+
 def _get_next_inputs(
     prev_inputs: xarray.Dataset, next_frame: xarray.Dataset,
     ) -> xarray.Dataset:
@@ -397,7 +1571,7 @@ def _get_next_inputs(
   next_inputs = next_frame[next_inputs_keys]
 
   # Apply concatenate next frame with inputs, crop what we don't need.
-  num_inputs = prev_inputs.dims["time"]
+  num_inputs = prev_inputs.sizes["time"]
   return (
       xarray.concat(
           [prev_inputs, next_inputs], dim="time", data_vars="different")
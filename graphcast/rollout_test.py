@@ -0,0 +1,461 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for rollout."""
+
+import itertools
+import os
+import tempfile
+import time
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from graphcast import rollout
+from graphcast import xarray_jax
+import jax
+import numpy as np
+import xarray
+
+
+_NUM_TARGET_STEPS = 6
+
+
+def _make_datasets():
+  """Returns inputs, targets template and forcings of a toy model."""
+  rng = np.random.default_rng(0)
+  timestep = np.timedelta64(6, "h")
+  lat = np.linspace(-90., 90., 3)
+  lon = np.arange(0., 360., 90.)
+
+  def dataset(name, times):
+    return xarray.Dataset(
+        {name: (("batch", "time", "lat", "lon"),
+                rng.normal(size=(1, len(times), 3, 4)).astype(np.float32))},
+        coords=dict(time=times, lat=lat, lon=lon))
+
+  target_times = np.arange(1, _NUM_TARGET_STEPS + 1) * timestep
+  inputs = dataset("x", np.array([-1, 0]) * timestep)
+  inputs["static"] = (("lat", "lon"), np.ones((3, 4), np.float32))
+  targets_template = dataset("x", target_times) * np.nan
+  forcings = dataset("f", target_times)
+  datetime = np.datetime64("2024-01-01T00") + target_times
+  targets_template.coords["datetime"] = (("batch", "time"), datetime[None])
+  return inputs, targets_template, forcings
+
+
+def _make_init_datasets(num_inits):
+  """Returns inputs, targets templates and forcings of several inits."""
+  all_inputs, targets_templates, all_forcings = [], [], []
+  for i in range(num_inits):
+    inputs, targets_template, forcings = _make_datasets()
+    inputs["x"] = inputs["x"] + i
+    forcings["f"] = forcings["f"] * i
+    targets_template.coords["datetime"] = (
+        targets_template.coords["datetime"] + i * np.timedelta64(1, "D"))
+    all_inputs.append(inputs)
+    targets_templates.append(targets_template)
+    all_forcings.append(forcings)
+  return all_inputs, targets_templates, all_forcings
+
+
+def _predictor_fn(rng, inputs, targets_template, forcings):
+  """Predicts `x[t] = x[t - 1] - x[t - 2] + f[t]` for all target steps."""
+  del rng
+  previous, current = inputs["x"].isel(time=-2), inputs["x"].isel(time=-1)
+  predictions = []
+  for i in range(targets_template.sizes["time"]):
+    previous, current = current, (
+        current - previous + forcings["f"].isel(time=i))
+    predictions.append(current)
+  predictions = xarray.concat(predictions, dim="time").transpose(
+      *targets_template["x"].dims)
+  return xarray.Dataset(
+      {"x": predictions.assign_coords(time=targets_template.coords["time"])})
+
+
+def _noisy_predictor_fn(rng, inputs, targets_template, forcings):
+  """Like `_predictor_fn`, plus noise that depends on `rng`."""
+  predictions = _predictor_fn(rng, inputs, targets_template, forcings)
+  noise = xarray_jax.DataArray(jax.random.uniform(rng, ()), dims=())
+  return predictions + noise
+
+
+def _concat_samples(chunks):
+  """Concatenates chunks of multiple runs along "time", then "sample"."""
+  return jax.device_get(xarray.concat(
+      [xarray.concat(list(group), dim="time") for _, group in
+       itertools.groupby(
+           chunks, key=lambda chunk: tuple(chunk.sample.values.flat))],
+      dim="sample"))
+
+
+class ListWriter:
+
+  def __init__(self):
+    self.chunks = []
+
+  def write(self, chunk):
+    self.chunks.append(chunk)
+
+
+class RolloutTest(parameterized.TestCase):
+
+  def _tempdir(self):
+    tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    return tmp_dir.name
+
+  @parameterized.parameters(1, 2, 3)
+  def test_chunked_prediction_to_zarr_matches_chunked_prediction(
+      self, num_steps_per_chunk):
+    inputs, targets_template, forcings = _make_datasets()
+    expected = rollout.chunked_prediction(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk)
+
+    path = os.path.join(self._tempdir(), "predictions.zarr")
+    writer = rollout.ZarrChunkWriter(
+        path, targets_template, num_steps_per_chunk=num_steps_per_chunk)
+    stats = rollout.chunked_prediction_to_writer(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, writer, num_steps_per_chunk=num_steps_per_chunk)
+    self.assertEqual(stats.num_chunks, _NUM_TARGET_STEPS // num_steps_per_chunk)
+    self.assertEqual(stats.num_steps, _NUM_TARGET_STEPS)
+
+    with xarray.open_zarr(path) as actual:
+      xarray.testing.assert_allclose(actual.compute(), expected)
+
+  def test_chunked_prediction_to_writer_streams_host_chunks(self):
+    inputs, targets_template, forcings = _make_datasets()
+    writer = ListWriter()
+    rollout.chunked_prediction_to_writer(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, writer, num_steps_per_chunk=2, max_pending_chunks=2)
+    self.assertLen(writer.chunks, _NUM_TARGET_STEPS // 2)
+    for chunk in writer.chunks:
+      self.assertIsInstance(chunk["x"].data, np.ndarray)
+
+  @parameterized.parameters(1, 2, 3)
+  def test_device_resident_inputs_match_generator(self, num_steps_per_chunk):
+    inputs, targets_template, forcings = _make_datasets()
+    kwargs = dict(
+        predictor_fn=_predictor_fn, rng=jax.random.PRNGKey(0), inputs=inputs,
+        targets_template=targets_template, forcings=forcings,
+        num_steps_per_chunk=num_steps_per_chunk)
+    expected = list(rollout.chunked_prediction_generator(**kwargs))
+    actual = list(rollout.chunked_prediction_generator(
+        device_resident_inputs=True, **kwargs))
+    self.assertLen(actual, len(expected))
+    for actual_chunk, expected_chunk in zip(actual, expected):
+      xarray.testing.assert_allclose(
+          jax.device_get(actual_chunk), expected_chunk)
+    # The caller's inputs are not donated.
+    xarray.testing.assert_equal(inputs, _make_datasets()[0])
+
+  @parameterized.parameters(
+      dict(num_steps_per_chunk=1, num_chunks_per_scan=None),
+      dict(num_steps_per_chunk=1, num_chunks_per_scan=2),
+      dict(num_steps_per_chunk=3, num_chunks_per_scan=1),
+      dict(num_steps_per_chunk=2, num_chunks_per_scan=None, use_scan=False),
+  )
+  def test_scanned_generator_matches_chunked_prediction(
+      self, num_steps_per_chunk, num_chunks_per_scan, use_scan=True):
+    inputs, targets_template, forcings = _make_datasets()
+    expected = rollout.chunked_prediction(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk)
+    chunks = list(rollout.scanned_chunked_prediction_generator(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk,
+        num_chunks_per_scan=num_chunks_per_scan, use_scan=use_scan))
+    actual = jax.device_get(xarray.concat(chunks, dim="time"))
+    xarray.testing.assert_allclose(actual, expected)
+    xarray.testing.assert_equal(inputs, _make_datasets()[0])
+
+  @parameterized.parameters(None, 1, 2, 5)
+  def test_multiple_inits_match_chunked_prediction(self, batch_size):
+    inputs, targets_templates, forcings = _make_init_datasets(3)
+    actual = list(rollout.chunked_prediction_multiple_inits(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_templates,
+        forcings, batch_size=batch_size, num_steps_per_chunk=2))
+    self.assertLen(actual, 3)
+    for i, actual_init in enumerate(actual):
+      expected = rollout.chunked_prediction(
+          _predictor_fn, jax.random.PRNGKey(0), inputs[i],
+          targets_templates[i], forcings[i], num_steps_per_chunk=2)
+      xarray.testing.assert_allclose(actual_init, expected)
+
+  def test_max_batch_size_for_memory(self):
+    inputs, targets_template, forcings = _make_datasets()
+    targets_template = targets_template.isel(time=slice(0, 1))
+    forcings = forcings.isel(time=slice(0, 1))
+    sizes = [
+        rollout.max_batch_size_for_memory(
+            _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+            forcings, memory_budget_bytes=budget)
+        for budget in (0, 10_000, 100_000)]
+    self.assertEqual(sizes[0], 1)
+    self.assertLess(sizes[1], sizes[2])
+
+  @parameterized.parameters(1, 3)
+  def test_output_spec_subsets_predictions(self, num_steps_per_chunk):
+    inputs, targets_template, forcings = _make_datasets()
+    output_spec = rollout.OutputSpec(
+        variables=["x"], lead_times=["12h", "36h"], lat_range=(-10., 90.),
+        lon_range=(200., 10.))
+    expected = output_spec.apply(rollout.chunked_prediction(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk))
+    self.assertEqual(dict(expected.sizes),
+                     dict(batch=1, time=2, lat=2, lon=2))
+    np.testing.assert_array_equal(expected.lon, [0., 270.])
+
+    actual = rollout.chunked_prediction(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk,
+        output_spec=output_spec)
+    xarray.testing.assert_allclose(actual, expected)
+    scanned = rollout.scanned_chunked_prediction_generator(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk,
+        num_chunks_per_scan=1, output_spec=output_spec)
+    xarray.testing.assert_allclose(
+        jax.device_get(xarray.concat(list(scanned), dim="time")), expected)
+
+  @parameterized.parameters(1, 2)
+  def test_forcings_fn_matches_precomputed_forcings(self, num_steps_per_chunk):
+    inputs, targets_template, forcings = _make_datasets()
+    expected = rollout.chunked_prediction(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, num_steps_per_chunk=num_steps_per_chunk)
+    requested_datetimes = []
+
+    def forcings_fn(datetime):
+      requested_datetimes.append(datetime)
+      return forcings.sel(time=datetime.coords["time"])
+
+    actual = rollout.chunked_prediction(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings_fn, num_steps_per_chunk=num_steps_per_chunk)
+    xarray.testing.assert_allclose(actual, expected)
+    self.assertLen(requested_datetimes,
+                   _NUM_TARGET_STEPS // num_steps_per_chunk)
+    for datetime in requested_datetimes:
+      self.assertEqual(datetime.sizes["time"], num_steps_per_chunk)
+
+    scanned = rollout.scanned_chunked_prediction_generator(
+        _predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings_fn, num_steps_per_chunk=num_steps_per_chunk,
+        num_chunks_per_scan=1)
+    xarray.testing.assert_allclose(
+        jax.device_get(xarray.concat(list(scanned), dim="time")), expected)
+
+  @parameterized.parameters(
+      dict(samples_per_group=None, with_sample_inputs=False),
+      dict(samples_per_group=2, with_sample_inputs=False),
+      dict(samples_per_group=2, with_sample_inputs=True),
+      dict(samples_per_group=None, with_sample_inputs=False,
+           memory_budget_bytes=10_000),
+  )
+  def test_vectorized_samples_match_sequential_samples(
+      self, samples_per_group, with_sample_inputs, memory_budget_bytes=None):
+    inputs, targets_template, forcings = _make_datasets()
+    num_samples = 3
+    if with_sample_inputs:
+      inputs = xarray.concat(
+          [inputs.assign(x=inputs["x"] + i) for i in range(num_samples)],
+          dim="sample", data_vars=["x"])
+    rngs = jax.random.split(jax.random.PRNGKey(0), num_samples)
+    kwargs = dict(
+        predictor_fn=_noisy_predictor_fn, rngs=rngs, inputs=inputs,
+        targets_template=targets_template, forcings=forcings,
+        num_samples=num_samples, num_steps_per_chunk=2)
+
+    expected = _concat_samples(
+        rollout.chunked_prediction_generator_multiple_runs(**kwargs))
+    actual = _concat_samples(rollout.chunked_prediction_generator_multiple_runs(
+        vectorize_samples=True, samples_per_group=samples_per_group,
+        memory_budget_bytes=memory_budget_bytes, **kwargs))
+    xarray.testing.assert_allclose(
+        actual, expected.transpose(*actual["x"].dims), rtol=1e-5)
+
+  @parameterized.parameters(False, True)
+  def test_mesh_sharded_samples_match_sequential_samples(
+      self, with_sample_inputs):
+    inputs, targets_template, forcings = _make_datasets()
+    # Not a multiple of the number of devices when they are forced (e.g. with
+    # --xla_force_host_platform_device_count=4).
+    num_samples = 3
+    if with_sample_inputs:
+      inputs = xarray.concat(
+          [inputs.assign(x=inputs["x"] + i) for i in range(num_samples)],
+          dim="sample", data_vars=["x"])
+    rngs = jax.random.split(jax.random.PRNGKey(0), num_samples)
+    mesh = jax.sharding.Mesh(np.array(jax.devices()), ("devices",))
+    kwargs = dict(
+        predictor_fn=_noisy_predictor_fn, rngs=rngs, inputs=inputs,
+        targets_template=targets_template, forcings=forcings,
+        num_samples=num_samples, num_steps_per_chunk=2)
+
+    expected = _concat_samples(
+        rollout.chunked_prediction_generator_multiple_runs(**kwargs))
+    chunks = list(rollout.chunked_prediction_generator_multiple_runs(
+        mesh=mesh, **kwargs))
+    self.assertIsInstance(
+        xarray_jax.unwrap_data(chunks[0]["x"]).sharding,
+        jax.sharding.NamedSharding)
+    actual = _concat_samples(chunks)
+    xarray.testing.assert_allclose(
+        actual, expected.transpose(*actual["x"].dims), rtol=1e-5)
+
+  def test_mesh_sharded_multiple_inits_match_chunked_prediction(self):
+    inputs, targets_templates, forcings = _make_init_datasets(3)
+    mesh = jax.sharding.Mesh(np.array(jax.devices()), ("devices",))
+    actual = list(rollout.chunked_prediction_multiple_inits(
+        jax.jit(_predictor_fn), jax.random.PRNGKey(0), inputs,
+        targets_templates, forcings, batch_size=1, num_steps_per_chunk=2,
+        mesh=mesh))
+    self.assertLen(actual, 3)
+    for i, actual_init in enumerate(actual):
+      expected = rollout.chunked_prediction(
+          _predictor_fn, jax.random.PRNGKey(0), inputs[i],
+          targets_templates[i], forcings[i], num_steps_per_chunk=2)
+      xarray.testing.assert_allclose(actual_init, expected)
+
+  def test_checkpointer_resumes_interrupted_rollout(self):
+    inputs, targets_template, forcings = _make_datasets()
+    expected = rollout.chunked_prediction(
+        _noisy_predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings)
+    path = os.path.join(self._tempdir(), "predictions.zarr")
+    checkpointer = rollout.RolloutCheckpointer(
+        self._tempdir(), every_num_chunks=2)
+    num_calls = 0
+    preempted_call = 4
+
+    def predictor_fn(**kwargs):
+      nonlocal num_calls
+      num_calls += 1
+      if num_calls == preempted_call:
+        raise RuntimeError("Preempted.")
+      return _noisy_predictor_fn(**kwargs)
+
+    with self.assertRaisesRegex(RuntimeError, "Preempted."):
+      rollout.chunked_prediction_to_writer(
+          predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+          forcings, rollout.ZarrChunkWriter(path, targets_template),
+          checkpointer=checkpointer)
+    self.assertEqual(checkpointer.restore().chunk_index, 2)
+
+    num_calls = 0
+    preempted_call = None
+    stats = rollout.chunked_prediction_to_writer(
+        predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, rollout.ZarrChunkWriter(path, targets_template, mode="r+"),
+        checkpointer=checkpointer)
+    self.assertEqual(num_calls, _NUM_TARGET_STEPS - 2)
+    self.assertEqual(stats.num_chunks, _NUM_TARGET_STEPS - 2)
+    with xarray.open_zarr(path) as actual:
+      xarray.testing.assert_allclose(actual.compute(), expected)
+
+    # Resuming a complete rollout does not predict anything.
+    self.assertEmpty(list(rollout.chunked_prediction_generator(
+        predictor_fn, jax.random.PRNGKey(0), inputs, targets_template,
+        forcings, checkpointer=checkpointer)))
+
+  def test_checkpointer_resumes_multiple_runs(self):
+    inputs, targets_template, forcings = _make_datasets()
+    rngs = jax.random.split(jax.random.PRNGKey(0), 3)
+    kwargs = dict(
+        rngs=rngs, inputs=inputs, targets_template=targets_template,
+        forcings=forcings, num_samples=3, num_steps_per_chunk=2)
+    expected = list(rollout.chunked_prediction_generator_multiple_runs(
+        predictor_fn=_noisy_predictor_fn, **kwargs))
+    checkpointer = rollout.RolloutCheckpointer(self._tempdir())
+    # Interrupt the rollout after the first chunk of the second sample.
+    chunks = rollout.chunked_prediction_generator_multiple_runs(
+        predictor_fn=_noisy_predictor_fn, checkpointer=checkpointer, **kwargs)
+    for _ in range(5):
+      next(chunks)
+    chunks.close()
+
+    actual = list(rollout.chunked_prediction_generator_multiple_runs(
+        predictor_fn=_noisy_predictor_fn, checkpointer=checkpointer, **kwargs))
+    self.assertLen(actual, len(expected) - 4)
+    for actual_chunk, expected_chunk in zip(actual, expected[4:]):
+      xarray.testing.assert_allclose(actual_chunk, expected_chunk)
+
+  @parameterized.parameters(1, 3)
+  def test_pipelined_generator_matches_generator(self, max_pending_chunks):
+    inputs, targets_template, forcings = _make_datasets()
+    kwargs = dict(
+        predictor_fn=_predictor_fn, rng=jax.random.PRNGKey(0), inputs=inputs,
+        targets_template=targets_template, forcings=forcings,
+        num_steps_per_chunk=2)
+    expected = list(rollout.chunked_prediction_generator(**kwargs))
+    actual = list(rollout.pipelined_chunked_prediction_generator(
+        max_pending_chunks=max_pending_chunks, **kwargs))
+    self.assertLen(actual, len(expected))
+    for actual_chunk, expected_chunk in zip(actual, expected):
+      xarray.testing.assert_allclose(actual_chunk, expected_chunk)
+
+  @parameterized.parameters(1, 2)
+  def test_pipelined_generator_bounds_pending_chunks(self, max_pending_chunks):
+    inputs, targets_template, forcings = _make_datasets()
+    num_calls = 0
+
+    def counting_predictor_fn(**kwargs):
+      nonlocal num_calls
+      num_calls += 1
+      return _predictor_fn(**kwargs)
+
+    chunks = rollout.pipelined_chunked_prediction_generator(
+        max_pending_chunks=max_pending_chunks,
+        predictor_fn=counting_predictor_fn, rng=jax.random.PRNGKey(0),
+        inputs=inputs, targets_template=targets_template, forcings=forcings)
+    for num_consumed, _ in enumerate(chunks):
+      # Gives the background threads time to dispatch as far as they can.
+      time.sleep(0.3)
+      self.assertLessEqual(num_calls - num_consumed, max_pending_chunks)
+    self.assertEqual(num_calls, _NUM_TARGET_STEPS)
+
+  def test_pipelined_generator_propagates_exceptions(self):
+    inputs, targets_template, forcings = _make_datasets()
+    num_calls = 0
+
+    def failing_predictor_fn(**kwargs):
+      nonlocal num_calls
+      num_calls += 1
+      if num_calls == 2:
+        raise RuntimeError("Prediction failed.")
+      return _predictor_fn(**kwargs)
+
+    chunks = rollout.pipelined_chunked_prediction_generator(
+        predictor_fn=failing_predictor_fn, rng=jax.random.PRNGKey(0),
+        inputs=inputs, targets_template=targets_template, forcings=forcings)
+    next(chunks)
+    with self.assertRaisesRegex(RuntimeError, "Prediction failed."):
+      next(chunks)
+
+  def test_pipelined_generator_can_be_closed_early(self):
+    inputs, targets_template, forcings = _make_datasets()
+    chunks = rollout.pipelined_chunked_prediction_generator(
+        max_pending_chunks=1, predictor_fn=_predictor_fn,
+        rng=jax.random.PRNGKey(0), inputs=inputs,
+        targets_template=targets_template, forcings=forcings)
+    next(chunks)
+    chunks.close()
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -40,6 +40,12 @@ _DEFAULT_INTEGRATION_PERIOD = pd.Timedelta(hours=1)
 # approximation of the solar radiation in ERA5.
 _DEFAULT_NUM_INTEGRATION_BINS = 360
 
+# Default value for the `bins_per_chunk` argument, when integrating several
+# timestamps at once. On CPU, XLA fuses the reduction over up to 16 integration
+# time steps into the elementwise computation, so the (time, lat, lon, bins)
+# intermediate is never materialized; larger chunks are several times slower.
+_DEFAULT_BINS_PER_CHUNK = 16
+
 # The length of a Julian year in days.
 # https://en.wikipedia.org/wiki/Julian_year_(astronomy)
 _JULIAN_YEAR_LENGTH_IN_DAYS = 365.25
@@ -440,6 +446,303 @@ _get_integrated_radiation_jitted = jax.jit(
 )
 
 
+@functools.partial(
+    jax.jit,
+    static_argnames=[
+        "integration_period",
+        "num_integration_bins",
+        "timestamps_per_chunk",
+        "bins_per_chunk",
+    ],
+)
+def _get_integrated_radiation_batched(
+    j2000_days: chex.Array,
+    sin_latitude: chex.Array,
+    cos_latitude: chex.Array,
+    longitude: chex.Array,
+    tsi: chex.Array,
+    integration_period: pd.Timedelta,
+    num_integration_bins: int,
+    timestamps_per_chunk: int,
+    bins_per_chunk: int,
+) -> chex.Array:
+  """Like `_get_integrated_radiation`, for many timestamps in bounded memory.
+
+  Timestamps are processed `timestamps_per_chunk` at a time, and for each of
+  these chunks the trapezoidal rule is accumulated over `bins_per_chunk`
+  integration time steps at a time, so the largest intermediate has shape
+  `(timestamps_per_chunk, lat, lon, bins_per_chunk)` rather than
+  `(lat, lon, num_integration_bins + 1)` per timestamp.
+
+  Args:
+    j2000_days: 1D array of timestamps represented as the number of days since
+      the J2000 epoch, corresponding to the end times of each integration
+      period. Its length must be a multiple of `timestamps_per_chunk`.
+    sin_latitude: Sine of latitude coordinates, with shape (lat, 1).
+    cos_latitude: Cosine of latitude coordinates, with shape (lat, 1).
+    longitude: Longitude in radians, with shape (lon,).
+    tsi: 1D array of Total Solar Irradiance (TSI) in W⋅m⁻² for each timestamp.
+    integration_period: Integration period.
+    num_integration_bins: Number of bins to divide the `integration_period` to
+      approximate the integral using the trapezoidal rule.
+    timestamps_per_chunk: Number of timestamps to process at once.
+    bins_per_chunk: Number of integration time steps to process at once.
+
+  Returns:
+    The TOA solar radiation flux integrated over the requested time period, with
+    shape (time, lat, lon). Unit is J⋅m⁻² .
+  """
+  # Offsets and trapezoidal rule weights of the integration time steps, padded
+  # with zero weights to a whole number of chunks.
+  offsets = (
+      pd.timedelta_range(
+          start=-integration_period,
+          end=pd.Timedelta(0),
+          periods=num_integration_bins + 1,
+      )
+      / pd.Timedelta(days=1)
+  ).to_numpy()
+  dx = (integration_period / num_integration_bins) / pd.Timedelta(seconds=1)
+  weights = np.full(offsets.shape, dx)
+  weights[[0, -1]] = dx / 2
+  num_bin_chunks = -(-len(offsets) // bins_per_chunk)
+  padding = num_bin_chunks * bins_per_chunk - len(offsets)
+  offsets = np.pad(offsets, (0, padding)).reshape(num_bin_chunks, -1)
+  weights = np.pad(weights, (0, padding)).reshape(num_bin_chunks, -1)
+
+  cos_longitude = jnp.cos(longitude)
+  sin_longitude = jnp.sin(longitude)
+
+  def integrate_timestamps(days_and_tsi):
+    days, chunk_tsi = days_and_tsi
+
+    def accumulate(total, offsets_and_weights):
+      bin_offsets, bin_weights = offsets_and_weights
+      # Everything that does not depend on the location has dimensions
+      # (time, bins), and is computed as in `_get_radiation_flux`.
+      op = _get_orbital_parameters(days[:, None] + bin_offsets)
+      solar_factor = chunk_tsi[:, None] * (1.0 / op.solar_distance_au) ** 2
+      solar_time = (
+          op.rotational_phase + op.eq_of_time_seconds / _SECONDS_PER_DAY
+      )
+      # The cosine of the hour angle `2 * pi * solar_time + longitude` is
+      # expanded with the angle addition formula, so no trigonometric function
+      # is evaluated for each (time, lat, lon, bins) element.
+      cos_dec_cos_time = op.cos_declination * jnp.cos(2.0 * jnp.pi * solar_time)
+      cos_dec_sin_time = op.cos_declination * jnp.sin(2.0 * jnp.pi * solar_time)
+      # Dimensions (time, lat, lon, bins).
+      expand = lambda x: x[:, None, None, :]
+      sin_altitude = cos_latitude[..., None] * (
+          expand(cos_dec_cos_time) * cos_longitude[:, None]
+          - expand(cos_dec_sin_time) * sin_longitude[:, None]
+      ) + sin_latitude[..., None] * expand(op.sin_declination)
+      fluxes = jnp.maximum(sin_altitude, 0.0)
+      weighted_factor = expand(solar_factor * bin_weights)
+      return total + jnp.sum(fluxes * weighted_factor, axis=-1), None
+
+    init = jnp.zeros(
+        (len(days), sin_latitude.shape[0], longitude.shape[0]),
+        jnp.result_type(days, cos_latitude, chunk_tsi),
+    )
+    total, _ = jax.lax.scan(accumulate, init, (offsets, weights))
+    return total
+
+  chunks = (
+      j2000_days.reshape(-1, timestamps_per_chunk),
+      tsi.reshape(-1, timestamps_per_chunk),
+  )
+  results = jax.lax.map(integrate_timestamps, chunks)
+  return results.reshape((-1,) + results.shape[2:])
+
+
+def _get_hour_angle_table_size(
+    integration_period: pd.Timedelta, num_integration_bins: int
+) -> int:
+  """Returns the number of integration time steps in a day.
+
+  This is the size of the hour angle table used by
+  `_get_integrated_radiation_from_hour_angle_table`, whose step is the change
+  of hour angle over one integration time step.
+
+  Args:
+    integration_period: Integration period.
+    num_integration_bins: Number of bins the `integration_period` is divided in.
+
+  Raises:
+    ValueError: If a day is not a whole number of integration time steps.
+  """
+  table_size = num_integration_bins * (
+      pd.Timedelta(days=1) / integration_period
+  )
+  if not np.isclose(table_size, np.round(table_size)):
+    raise ValueError(
+        "A day must be a whole number of integration time steps to use the "
+        f"hour angle table, got integration_period={integration_period} and "
+        f"num_integration_bins={num_integration_bins}."
+    )
+  return int(np.round(table_size))
+
+
+def _get_hour_angle_table_positions(
+    longitude: np.ndarray, table_size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Returns where longitudes fall in an hour angle table of `table_size`.
+
+  Args:
+    longitude: 1D array of longitude coordinates in degrees.
+    table_size: Number of equally spaced hour angles in the table, starting at
+      a longitude of 0°.
+
+  Returns:
+    A tuple `(lower, upper, weight)` of arrays with the same shape as
+    `longitude`, such that the value at each longitude is interpolated as
+    `table[lower] * (1 - weight) + table[upper] * weight`. Longitudes on the
+    table, e.g. all of them when the longitude spacing is a multiple of the
+    table step, have `upper == lower` and a `weight` of 0.
+  """
+  positions = np.mod(np.asarray(longitude, np.float64) / 360.0, 1.0)
+  positions = positions * table_size
+  rounded = np.round(positions)
+  positions = np.where(
+      np.isclose(positions, rounded, rtol=0, atol=1e-6), rounded, positions
+  )
+  lower = np.floor(positions)
+  weight = positions - lower
+  lower = lower.astype(np.int32) % table_size
+  upper = np.where(weight > 0, (lower + 1) % table_size, lower)
+  return lower, upper, weight
+
+
+def _get_hour_angle_table_block_size(
+    positions: np.ndarray, table_size: int
+) -> int:
+  """Returns the largest block size of the table aligned with all `positions`.
+
+  Args:
+    positions: 1D array of positions in the hour angle table.
+    table_size: Size of the hour angle table.
+
+  Returns:
+    The greatest common divisor of `table_size` and of the distances between
+    the `positions`, e.g. the longitude spacing in number of table steps on a
+    regular grid, so that the table splits in blocks of this size starting at
+    each of the positions.
+  """
+  return int(np.gcd.reduce(np.append(positions - positions[0], table_size)))
+
+
+@functools.partial(
+    jax.jit,
+    static_argnames=[
+        "integration_period",
+        "num_integration_bins",
+        "block_size",
+    ],
+)
+def _get_integrated_radiation_from_hour_angle_table(
+    j2000_days: chex.Array,
+    sin_latitude: chex.Array,
+    cos_latitude: chex.Array,
+    positions: chex.Array,
+    tsi: chex.Array,
+    integration_period: pd.Timedelta,
+    num_integration_bins: int,
+    block_size: int,
+) -> chex.Array:
+  """Like `_get_integrated_radiation`, from a (lat, hour angle) table.
+
+  Longitude only enters the radiation flux through the hour angle
+  `2 * pi * solar_time + longitude`. Holding the orbital parameters at their
+  value in the middle of the integration period, the hour angle advances by a
+  fixed step over each integration time step, so the integrated radiation at a
+  longitude is a trapezoidal sum over `num_integration_bins + 1` consecutive
+  entries of a table of the instantaneous flux at each latitude and at equally
+  spaced hour angles, with this step, i.e. with one entry per integration time
+  step in a day.
+
+  These sums are computed from cumulative sums over blocks of `block_size`
+  table entries, which are aligned with all the `positions` (on a regular
+  grid, a block spans the longitude spacing), plus the remaining entries. Each
+  timestamp costs O(lat * table_size + lat * len(positions) * block_size)
+  rather than O(lat * lon * num_integration_bins).
+
+  Args:
+    j2000_days: 1D array of timestamps represented as the number of days since
+      the J2000 epoch, corresponding to the end times of each integration
+      period.
+    sin_latitude: Sine of latitude coordinates, with shape (lat, 1).
+    cos_latitude: Cosine of latitude coordinates, with shape (lat, 1).
+    positions: 1D array of the positions in the table at which to compute the
+      integrated radiation, see `_get_hour_angle_table_positions`.
+    tsi: 1D array of Total Solar Irradiance (TSI) in W⋅m⁻² for each timestamp.
+    integration_period: Integration period.
+    num_integration_bins: Number of bins to divide the `integration_period` to
+      approximate the integral using the trapezoidal rule.
+    block_size: Size of the blocks, see `_get_hour_angle_table_block_size`.
+
+  Returns:
+    The TOA solar radiation flux integrated over the requested time period, with
+    shape (time, lat, positions). Unit is J⋅m⁻² .
+  """
+  table_size = _get_hour_angle_table_size(
+      integration_period, num_integration_bins
+  )
+  num_blocks = table_size // block_size
+  # A sum over the integration time steps is over `num_full_blocks` blocks and
+  # `num_remaining` further entries of the table.
+  num_full_blocks, num_remaining = divmod(num_integration_bins + 1, block_size)
+  period_in_days = integration_period / pd.Timedelta(days=1)
+  dx = (integration_period / num_integration_bins) / pd.Timedelta(seconds=1)
+  steps = 2.0 * np.pi * np.arange(table_size) / table_size
+  cos_steps = jnp.array(np.cos(steps), dtype=cos_latitude.dtype)
+  sin_steps = jnp.array(np.sin(steps), dtype=cos_latitude.dtype)
+
+  # Entries of the table at which the sums start, all in the same position
+  # relative to the blocks.
+  starts = (positions - num_integration_bins) % table_size
+  offset = starts[0] % block_size
+  block_starts = (starts - offset) // block_size
+  remaining = (
+      starts[:, None]
+      + num_full_blocks * block_size
+      + jnp.arange(num_remaining)
+  ) % table_size
+
+  def integrate_timestamp(days_and_tsi):
+    days, timestamp_tsi = days_and_tsi
+    op = _get_orbital_parameters(days - period_in_days / 2)
+    solar_factor = timestamp_tsi * (1.0 / op.solar_distance_au) ** 2
+    # Hour angles at the end of the integration period, for a longitude of 0°
+    # plus each step of the table. Expanded with the angle addition formula,
+    # otherwise XLA evaluates the cosine for each (lat, step) element.
+    solar_time = days % 1.0 + op.eq_of_time_seconds / _SECONDS_PER_DAY
+    cos_hour_angle = (
+        jnp.cos(2.0 * jnp.pi * solar_time) * cos_steps
+        - jnp.sin(2.0 * jnp.pi * solar_time) * sin_steps
+    )
+    fluxes = solar_factor * jnp.maximum(
+        cos_latitude * op.cos_declination * cos_hour_angle
+        + sin_latitude * op.sin_declination,
+        0.0,
+    )
+    blocks = jnp.roll(fluxes, -offset, axis=-1).reshape(
+        fluxes.shape[0], num_blocks, block_size
+    ).sum(axis=-1)
+    # Sums may wrap around the table.
+    blocks = blocks[:, np.arange(num_blocks + num_full_blocks) % num_blocks]
+    block_sums = jnp.pad(jnp.cumsum(blocks, axis=-1), ((0, 0), (1, 0)))
+    sums = (
+        block_sums[:, block_starts + num_full_blocks]
+        - block_sums[:, block_starts]
+        + fluxes[:, remaining].sum(axis=-1)
+    )
+    # Trapezoidal rule.
+    ends = (starts + num_integration_bins) % table_size
+    return dx * (sums - 0.5 * (fluxes[:, starts] + fluxes[:, ends]))
+
+  return jax.lax.map(integrate_timestamp, (j2000_days, tsi))
+
+
 def get_toa_incident_solar_radiation(
     timestamps: Sequence[_TimestampLike],
     latitude: chex.Array,
@@ -448,6 +751,9 @@ def get_toa_incident_solar_radiation(
     integration_period: _TimedeltaLike = _DEFAULT_INTEGRATION_PERIOD,
     num_integration_bins: int = _DEFAULT_NUM_INTEGRATION_BINS,
     use_jit: bool = False,
+    timestamps_per_chunk: int | None = None,
+    bins_per_chunk: int = _DEFAULT_BINS_PER_CHUNK,
+    use_hour_angle_table: bool = False,
 ) -> chex.Array:
   """Computes the solar radiation incident at the top of the atmosphere.
 
@@ -478,6 +784,26 @@ def get_toa_incident_solar_radiation(
       may work to improve performance and reduce memory usage.
     use_jit: Set to True to use the jitted implementation, or False (default) to
       use the non-jitted one.
+    timestamps_per_chunk: If set, all the timestamps are computed in a single
+      jitted call (regardless of `use_jit`), this many timestamps at a time,
+      accumulating the integral over `bins_per_chunk` integration time steps
+      at a time. Peak memory usage is then proportional to
+      `timestamps_per_chunk * bins_per_chunk`. If None (default), timestamps
+      are computed one after the other, each with all the integration time
+      steps at once.
+    bins_per_chunk: Number of integration time steps to process at once when
+      `timestamps_per_chunk` is set.
+    use_hour_angle_table: If True, all the timestamps are computed in a single
+      jitted call (regardless of `use_jit` and `timestamps_per_chunk`), by
+      integrating a table of the radiation flux at each latitude and at the
+      hour angles of the integration time steps over a day, which is then
+      sampled at each longitude. This is much faster, but holds the orbital
+      parameters constant over the integration period, which changes results
+      by about 5e-6 relative to their maximum. Longitudes that are not on the
+      table, i.e. unless the longitude spacing is a multiple of
+      `360 * integration_period / (num_integration_bins * 1 day)` degrees
+      (0.04167° by default), are linearly interpolated. A day must be a whole
+      number of integration time steps.
 
   Returns:
     An 3D array with dimensions (time, lat, lon) containing the total
@@ -493,6 +819,52 @@ def get_toa_incident_solar_radiation(
   if tsi_data is None:
     tsi_data = _DEFAULT_TSI_DATA_LOADER()
   tsi = get_tsi(timestamps, tsi_data)
+  if use_hour_angle_table:
+    table_size = _get_hour_angle_table_size(
+        integration_period, num_integration_bins
+    )
+    lower, upper, weight = _get_hour_angle_table_positions(
+        np.ravel(longitude), table_size
+    )
+    interpolate = np.any(weight > 0)
+    positions = np.concatenate([lower, upper]) if interpolate else lower
+    radiation = _get_integrated_radiation_from_hour_angle_table(
+        j2000_days=jnp.array([
+            _get_j2000_days(pd.Timestamp(timestamp)) for timestamp in timestamps
+        ]),
+        sin_latitude=sin_lat,
+        cos_latitude=cos_lat,
+        positions=jnp.array(positions),
+        tsi=jnp.array(tsi),
+        integration_period=integration_period,
+        num_integration_bins=num_integration_bins,
+        block_size=_get_hour_angle_table_block_size(positions, table_size),
+    )
+    if interpolate:
+      lower_radiation, upper_radiation = jnp.split(radiation, 2, axis=-1)
+      weight = jnp.array(weight, dtype=radiation.dtype)
+      radiation = lower_radiation * (1 - weight) + upper_radiation * weight
+    return radiation
+  if timestamps_per_chunk is not None:
+    j2000_days = np.array(
+        [_get_j2000_days(pd.Timestamp(timestamp)) for timestamp in timestamps]
+    )
+    # Pad to a whole number of chunks, so the shapes (and compilation) only
+    # depend on the number of chunks.
+    timestamps_per_chunk = max(1, min(timestamps_per_chunk, len(j2000_days)))
+    padding = -len(j2000_days) % timestamps_per_chunk
+    return _get_integrated_radiation_batched(
+        j2000_days=jnp.array(np.pad(j2000_days, (0, padding), mode="edge")),
+        sin_latitude=sin_lat,
+        cos_latitude=cos_lat,
+        longitude=lon,
+        tsi=jnp.array(np.pad(tsi, (0, padding), mode="edge")),
+        integration_period=integration_period,
+        num_integration_bins=num_integration_bins,
+        timestamps_per_chunk=timestamps_per_chunk,
+        bins_per_chunk=bins_per_chunk,
+    )[: len(j2000_days)]
+
   fn = (
       _get_integrated_radiation_jitted if use_jit else _get_integrated_radiation
   )
@@ -526,6 +898,9 @@ def get_toa_incident_solar_radiation_for_xarray(
     integration_period: _TimedeltaLike = _DEFAULT_INTEGRATION_PERIOD,
     num_integration_bins: int = _DEFAULT_NUM_INTEGRATION_BINS,
     use_jit: bool = False,
+    timestamps_per_chunk: int | None = None,
+    bins_per_chunk: int = _DEFAULT_BINS_PER_CHUNK,
+    use_hour_angle_table: bool = False,
 ) -> xa.DataArray:
   """Computes the solar radiation incident at the top of the atmosphere.
 
@@ -554,6 +929,9 @@ def get_toa_incident_solar_radiation_for_xarray(
       may work to improve performance and reduce memory usage.
     use_jit: Set to True to use the jitted implementation, or False to use the
       non-jitted one.
+    timestamps_per_chunk: See `get_toa_incident_solar_radiation`.
+    bins_per_chunk: See `get_toa_incident_solar_radiation`.
+    use_hour_angle_table: See `get_toa_incident_solar_radiation`.
 
   Returns:
     xa.DataArray with dimensions `(time, lat, lon)` if `data_array_like` had
@@ -590,6 +968,9 @@ def get_toa_incident_solar_radiation_for_xarray(
       integration_period=integration_period,
       num_integration_bins=num_integration_bins,
       use_jit=use_jit,
+      timestamps_per_chunk=timestamps_per_chunk,
+      bins_per_chunk=bins_per_chunk,
+      use_hour_angle_table=use_hour_angle_table,
   )
 
   if "time" in data_array_like.dims:
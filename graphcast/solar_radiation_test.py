@@ -131,9 +131,28 @@ class SolarRadiationTest(parameterized.TestCase):
           repeats=1,
           use_jit=False,
       ),
+      dict(
+          testcase_name="ten_timestamps_chunked",
+          periods=10,
+          repeats=1,
+          use_jit=False,
+          timestamps_per_chunk=1,
+      ),
+      dict(
+          testcase_name="ten_timestamps_hour_angle_table",
+          periods=10,
+          repeats=3,
+          use_jit=False,
+          use_hour_angle_table=True,
+      ),
   )
   def test_full_spatial_resolution(
-      self, periods: int, repeats: int, use_jit: bool
+      self,
+      periods: int,
+      repeats: int,
+      use_jit: bool,
+      timestamps_per_chunk: int | None = None,
+      use_hour_angle_table: bool = False,
   ):
     timestamps = pd.date_range(start="2023-09-25", periods=periods, freq="6h")
     # Generate a linear grid with 0.25 degrees resolution similar to ERA5.
@@ -147,6 +166,8 @@ class SolarRadiationTest(parameterized.TestCase):
           integration_period="1h",
           num_integration_bins=360,
           use_jit=use_jit,
+          timestamps_per_chunk=timestamps_per_chunk,
+          use_hour_angle_table=use_hour_angle_table,
       ).block_until_ready()
 
     results = timeit.repeat(benchmark, repeat=repeats, number=1)
@@ -159,6 +180,86 @@ class SolarRadiationTest(parameterized.TestCase):
         np.array2string(np.array(results), precision=1),
     )
 
+  @parameterized.named_parameters(
+      dict(testcase_name="one_by_one", timestamps_per_chunk=1,
+           bins_per_chunk=1),
+      dict(testcase_name="uneven_chunks", timestamps_per_chunk=3,
+           bins_per_chunk=7),
+      dict(testcase_name="all_at_once", timestamps_per_chunk=5,
+           bins_per_chunk=37),
+      dict(testcase_name="more_than_timestamps", timestamps_per_chunk=16,
+           bins_per_chunk=16),
+  )
+  def test_chunked_matches_unchunked(
+      self, timestamps_per_chunk: int, bins_per_chunk: int
+  ):
+    timestamps = pd.date_range(start="2023-09-25", periods=5, freq="5h")
+    lat, lon = _get_grid_lat_lon_coords(num_lat=19, num_lon=36)
+
+    expected = solar_radiation.get_toa_incident_solar_radiation(
+        timestamps,
+        lat,
+        lon,
+        integration_period="1h",
+        num_integration_bins=36,
+        use_jit=True,
+    )
+    actual = solar_radiation.get_toa_incident_solar_radiation(
+        timestamps,
+        lat,
+        lon,
+        integration_period="1h",
+        num_integration_bins=36,
+        timestamps_per_chunk=timestamps_per_chunk,
+        bins_per_chunk=bins_per_chunk,
+    )
+
+    self.assertEqual(expected.shape, actual.shape)
+    # Values are up to about 5e6 J⋅m⁻², compared up to float32 rounding.
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=10.0)
+
+  @parameterized.named_parameters(
+      # 10° is a multiple of the table step (1/24° with 360 bins per hour), so
+      # longitudes are on the table.
+      dict(testcase_name="on_table", num_lon=36, integration_period="1h"),
+      # 7.2° is not, so longitudes are interpolated.
+      dict(testcase_name="interpolated", num_lon=50, integration_period="1h"),
+      dict(testcase_name="six_hours", num_lon=36, integration_period="6h"),
+  )
+  def test_hour_angle_table_matches_direct_integration(
+      self, num_lon: int, integration_period: str
+  ):
+    timestamps = pd.date_range(start="2023-06-20", periods=5, freq="5h")
+    lat, lon = _get_grid_lat_lon_coords(num_lat=19, num_lon=num_lon)
+    kwargs = dict(
+        integration_period=integration_period, num_integration_bins=360
+    )
+
+    expected = solar_radiation.get_toa_incident_solar_radiation(
+        timestamps, lat, lon, use_jit=True, **kwargs
+    )
+    actual = solar_radiation.get_toa_incident_solar_radiation(
+        timestamps, lat, lon, use_hour_angle_table=True, **kwargs
+    )
+
+    self.assertEqual(expected.shape, actual.shape)
+    # Orbital parameters are held constant over the integration period.
+    np.testing.assert_allclose(
+        actual, expected, rtol=1e-4, atol=1e-4 * np.max(expected)
+    )
+
+  def test_hour_angle_table_requires_whole_steps_per_day(self):
+    lat, lon = _get_grid_lat_lon_coords(num_lat=3, num_lon=4)
+    with self.assertRaisesRegex(ValueError, "whole number of integration"):
+      solar_radiation.get_toa_incident_solar_radiation(
+          ["2023-06-20T12"],
+          lat,
+          lon,
+          integration_period="7min",
+          num_integration_bins=1,
+          use_hour_angle_table=True,
+      )
+
 
 class GetTsiTest(parameterized.TestCase):
 
@@ -0,0 +1,308 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Precomputed climatology of the TOA incident solar radiation (TISR).
+
+The TISR computed by `solar_radiation` depends on the timestamp through the
+Total Solar Irradiance (TSI), by which it is simply scaled, through the orbital
+parameters, which are (nearly) periodic over a tropical year of about 365.2422
+days, and through the time of day. A climatology stores the TISR per unit of
+TSI on a lat/lon grid, for each day of a reference year (plus one, see below)
+and each time of day in a fixed number of slots, so that it can be looked up
+for any timestamp on one of these slots rather than computed.
+
+Calendar years are 365 or 366 days long, so a given calendar day drifts by
+about a quarter of a day relative to the orbit from one year to the next, until
+the next leap year, and by a few minutes per year in the long run. A timestamp
+is therefore mapped to its orbital position in the reference year, i.e. its
+number of days since the start of the reference year modulo the tropical year,
+and the TISR is linearly interpolated between the two days of the climatology
+around this position, at the same time of day, before being scaled by the TSI
+of the timestamp. Away from the terminator, looked up values are within about
+1e-4 of the maximum TISR of computed ones in the years around the reference
+year, and this grows by about 2e-5 per year away from it, as the equation of
+time repeats with a slightly different period.
+
+The climatology is stored in a directory, as an uncompressed `.npy` file of
+shape (day, slot, lat, lon) that is loaded back with `mmap_mode="r"`, so a
+lookup only reads the planes it needs, together with the grid and a
+`metadata.json` file.
+"""
+
+import dataclasses
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional, Sequence
+
+from graphcast import solar_radiation
+import numpy as np
+import pandas as pd
+import xarray
+
+# Bump when the on-disk layout, or the way climatologies are computed, changes.
+_FORMAT_VERSION = 1
+
+_METADATA_FILENAME = "metadata.json"
+
+# Period of the ecliptic longitude of the Sun in the orbital parameters of
+# `solar_radiation`, `4.8952 + 6.283320 * theta` with `theta` in Julian years of
+# 365.25 days, i.e. a tropical year of about 365.2422 days. The declination of
+# the Sun, the orbital parameter the TISR is most sensitive to, repeats with
+# this period.
+_YEAR_LENGTH_IN_DAYS = 365.25 * 2 * np.pi / 6.283320
+
+# Days in the climatology: a year rounded up, plus one to interpolate up to its
+# end.
+_NUM_DAYS = 367
+
+_ONE_DAY = np.timedelta64(1, "D")
+
+
+def _unit_tsi_data() -> xarray.DataArray:
+  """A TsiDataLoader with a TSI of 1 W⋅m⁻², so results are per unit of TSI."""
+  return xarray.DataArray(
+      np.array([1.0]), dims=["time"], coords={"time": np.array([0.0])}
+  )
+
+
+@dataclasses.dataclass(frozen=True)
+class TisrClimatology:
+  """TISR per unit of TSI for each day of a reference year and time of day.
+
+  Attributes:
+    values: Array of shape (day, slot, lat, lon), with the TISR in J⋅m⁻² per
+      W⋅m⁻² of TSI, integrated over an hour ending at the start of the
+      reference year plus `day` days and `slot / slots_per_day` of a day.
+    lat: Latitudes of the grid, in degrees.
+    lon: Longitudes of the grid, in degrees.
+    reference_year: Year the climatology was computed for.
+    slots_per_day: Number of equally spaced times of day, starting at 00:00.
+  """
+  values: np.ndarray
+  lat: np.ndarray
+  lon: np.ndarray
+  reference_year: int
+  slots_per_day: int
+
+  @property
+  def _reference_date(self) -> np.datetime64:
+    return np.datetime64(f"{self.reference_year:04d}-01-01", "ns")
+
+  @property
+  def _slot_length(self) -> np.timedelta64:
+    return _ONE_DAY.astype("timedelta64[ns]") // self.slots_per_day
+
+  def covers(
+      self,
+      timestamps: Sequence[np.datetime64],
+      latitude: np.ndarray,
+      longitude: np.ndarray,
+  ) -> bool:
+    """Returns whether the TISR can be looked up on the given grid and times."""
+    return (
+        _same_coordinates(latitude, self.lat)
+        and _same_coordinates(longitude, self.lon)
+        and bool(np.all(self._time_of_day(timestamps) % self._slot_length == 0))
+    )
+
+  def get_toa_incident_solar_radiation(
+      self,
+      timestamps: Sequence[np.datetime64],
+      tsi_data: Optional[xarray.DataArray] = None,
+  ) -> np.ndarray:
+    """Looks up the TISR for the given timestamps.
+
+    Args:
+      timestamps: Timestamps for which to look up the TISR. Their times of day
+        must be on the slots of the climatology.
+      tsi_data: A DataArray containing yearly TSI data as returned by a
+        `solar_radiation.TsiDataLoader`. The default is to use ERA5 compatible
+        TSI data.
+
+    Returns:
+      An array with dimensions (time, lat, lon) containing the total top of
+      atmosphere solar radiation integrated for an hour up to each timestamp.
+
+    Raises:
+      ValueError: If some timestamps are not on the slots of the climatology.
+    """
+    timestamps = np.asarray(timestamps, dtype="datetime64[ns]")
+    time_of_day = self._time_of_day(timestamps)
+    if np.any(time_of_day % self._slot_length != 0):
+      raise ValueError(
+          f"Timestamps must be on one of the {self.slots_per_day} slots of the "
+          "climatology per day."
+      )
+    slots = (time_of_day // self._slot_length).astype(np.int64)
+    # Whole days since the start of the reference year, mapped to the same
+    # orbital position in the reference year.
+    days = (timestamps - time_of_day - self._reference_date) // _ONE_DAY
+    position = np.mod(days, _YEAR_LENGTH_IN_DAYS)
+    lower = np.floor(position).astype(np.int64)
+    weight = (position - lower).astype(np.float32)[:, None, None]
+    radiation = (1 - weight) * self.values[lower, slots]
+    radiation += weight * self.values[lower + 1, slots]
+
+    if tsi_data is None:
+      tsi_data = solar_radiation.era5_tsi_data()
+    tsi = solar_radiation.get_tsi(timestamps, tsi_data)
+    return radiation * tsi.astype(np.float32)[:, None, None]
+
+  def get_toa_incident_solar_radiation_for_xarray(
+      self,
+      data_array_like: xarray.DataArray | xarray.Dataset,
+      tsi_data: Optional[xarray.DataArray] = None,
+  ) -> xarray.DataArray:
+    """Like `solar_radiation.get_toa_incident_solar_radiation_for_xarray`."""
+    if "time" in data_array_like.dims:
+      timestamps = data_array_like.coords["datetime"].data
+    else:
+      timestamps = [data_array_like.coords["datetime"].data.item()]
+
+    radiation = self.get_toa_incident_solar_radiation(timestamps, tsi_data)
+
+    if "time" in data_array_like.dims:
+      output = xarray.DataArray(radiation, dims=("time", "lat", "lon"))
+    else:
+      output = xarray.DataArray(radiation[0], dims=("lat", "lon"))
+    for k, coord in data_array_like.coords.items():
+      if set(coord.dims).issubset(set(output.dims)):
+        output.coords[k] = coord
+    return output
+
+  def _time_of_day(self, timestamps: Sequence[np.datetime64]) -> np.ndarray:
+    timestamps = np.asarray(timestamps, dtype="datetime64[ns]")
+    return timestamps - timestamps.astype("datetime64[D]")
+
+
+def build(
+    path: str,
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    *,
+    reference_year: int = 2020,
+    slots_per_day: int = 24,
+    days_per_chunk: int = 1,
+    use_hour_angle_table: bool = False,
+) -> TisrClimatology:
+  """Computes a climatology and stores it at `path`.
+
+  The TISR is computed with `solar_radiation.get_toa_incident_solar_radiation`
+  and its default (ERA5 compatible) integration period and number of bins,
+  `days_per_chunk` days at a time, which are written to the memory mapped
+  array directly. The entry is written to a temporary directory first and then
+  moved into place, so concurrent readers never observe a partially written
+  entry.
+
+  Args:
+    path: Directory for the climatology. Any existing one is replaced.
+    latitude: Latitudes of the grid, in degrees.
+    longitude: Longitudes of the grid, in degrees.
+    reference_year: Year to compute the climatology for.
+    slots_per_day: Number of equally spaced times of day, e.g. 24 for hourly
+      or 4 for 6-hourly timestamps.
+    days_per_chunk: Number of days to compute at once.
+    use_hour_angle_table: See
+      `solar_radiation.get_toa_incident_solar_radiation`.
+
+  Returns:
+    The climatology, memory mapped from `path`.
+  """
+  latitude = np.asarray(latitude)
+  longitude = np.asarray(longitude)
+  parent_dir = os.path.dirname(os.path.abspath(path))
+  os.makedirs(parent_dir, exist_ok=True)
+  tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp_")
+  try:
+    values = np.lib.format.open_memmap(
+        os.path.join(tmp_path, "values.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(_NUM_DAYS, slots_per_day, len(latitude), len(longitude)),
+    )
+    start = pd.Timestamp(year=reference_year, month=1, day=1)
+    for day in range(0, _NUM_DAYS, days_per_chunk):
+      num_days = min(days_per_chunk, _NUM_DAYS - day)
+      timestamps = pd.date_range(
+          start + pd.Timedelta(days=day),
+          periods=num_days * slots_per_day,
+          freq=pd.Timedelta(days=1) / slots_per_day,
+      )
+      radiation = solar_radiation.get_toa_incident_solar_radiation(
+          timestamps,
+          latitude,
+          longitude,
+          tsi_data=_unit_tsi_data(),
+          timestamps_per_chunk=1,
+          use_hour_angle_table=use_hour_angle_table,
+      )
+      values[day : day + num_days] = np.asarray(radiation).reshape(
+          (num_days, slots_per_day) + radiation.shape[1:]
+      )
+    values.flush()
+    del values
+    np.save(os.path.join(tmp_path, "lat.npy"), latitude, allow_pickle=False)
+    np.save(os.path.join(tmp_path, "lon.npy"), longitude, allow_pickle=False)
+    # Written last, as its presence marks the climatology as complete.
+    with open(os.path.join(tmp_path, _METADATA_FILENAME), "w") as f:
+      json.dump(
+          {
+              "format_version": _FORMAT_VERSION,
+              "reference_year": reference_year,
+              "slots_per_day": slots_per_day,
+          },
+          f,
+          sort_keys=True,
+          indent=2,
+      )
+
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+      os.rename(tmp_path, path)
+    except OSError:
+      # Another process stored a climatology concurrently, keep theirs.
+      shutil.rmtree(tmp_path, ignore_errors=True)
+  except BaseException:
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    raise
+  return load(path)
+
+
+def load(path: str) -> TisrClimatology:
+  """Loads a climatology stored with `build`, memory mapping its values."""
+  try:
+    with open(os.path.join(path, _METADATA_FILENAME)) as f:
+      metadata = json.load(f)
+  except (FileNotFoundError, json.JSONDecodeError) as e:
+    raise FileNotFoundError(f"No TISR climatology found at {path}.") from e
+  if metadata["format_version"] != _FORMAT_VERSION:
+    raise ValueError(
+        f"The TISR climatology at {path} has format version "
+        f"{metadata['format_version']}, expected {_FORMAT_VERSION}."
+    )
+  return TisrClimatology(
+      values=np.load(os.path.join(path, "values.npy"), mmap_mode="r"),
+      lat=np.load(os.path.join(path, "lat.npy")),
+      lon=np.load(os.path.join(path, "lon.npy")),
+      reference_year=metadata["reference_year"],
+      slots_per_day=metadata["slots_per_day"],
+  )
+
+
+def _same_coordinates(values: np.ndarray, expected: np.ndarray) -> bool:
+  values = np.asarray(values, dtype=np.float32)
+  return values.shape == expected.shape and np.array_equal(
+      values, expected.astype(np.float32)
+  )
@@ -0,0 +1,117 @@
+# Copyright 2024 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for tisr_climatology."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from graphcast import solar_radiation
+from graphcast import tisr_climatology
+import numpy as np
+import pandas as pd
+
+_LAT = np.linspace(-90.0, 90.0, num=19)
+_LON = np.linspace(0.0, 360.0, num=36, endpoint=False)
+
+
+class TisrClimatologyTest(parameterized.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    cls._tmp_dir = tempfile.TemporaryDirectory()
+    cls._path = os.path.join(cls._tmp_dir.name, "tisr")
+    cls._climatology = tisr_climatology.build(
+        cls._path,
+        _LAT,
+        _LON,
+        reference_year=2020,
+        slots_per_day=4,
+        days_per_chunk=32,
+    )
+
+  @classmethod
+  def tearDownClass(cls):
+    cls._tmp_dir.cleanup()
+    super().tearDownClass()
+
+  @parameterized.named_parameters(
+      dict(testcase_name="reference_year", year=2020, atol=1e-5),
+      # Other years are interpolated between days of the climatology, and
+      # float32 J2000 days are rounded differently, mostly at the terminator.
+      dict(testcase_name="next_year", year=2021, atol=2e-3),
+      dict(testcase_name="leap_year", year=2024, atol=2e-3),
+      dict(testcase_name="earlier_year", year=2012, atol=2e-3),
+  )
+  def test_matches_direct_computation(self, year, atol):
+    timestamps = pd.date_range(
+        f"{year}-01-01", f"{year}-12-31T18", freq="6h"
+    )[::11]
+
+    expected = np.asarray(
+        solar_radiation.get_toa_incident_solar_radiation(
+            timestamps, _LAT, _LON, timestamps_per_chunk=1
+        )
+    )
+    actual = self._climatology.get_toa_incident_solar_radiation(
+        timestamps.values
+    )
+
+    self.assertEqual(expected.shape, actual.shape)
+    np.testing.assert_allclose(
+        actual, expected, rtol=0, atol=atol * np.max(expected)
+    )
+    # Away from the terminator, the lookup is much closer.
+    self.assertLess(
+        np.median(np.abs(actual - expected)), 1e-4 * np.max(expected)
+    )
+
+  def test_covers(self):
+    timestamps = np.array(["2031-02-28T06", "2032-02-29T18"], "datetime64[ns]")
+    self.assertTrue(self._climatology.covers(timestamps, _LAT, _LON))
+    self.assertFalse(
+        self._climatology.covers(
+            timestamps + np.timedelta64(1, "h"), _LAT, _LON
+        )
+    )
+    self.assertFalse(self._climatology.covers(timestamps, _LAT[::-1], _LON))
+    self.assertFalse(self._climatology.covers(timestamps, _LAT, _LON[:-1]))
+
+  def test_timestamps_off_slots_raise_value_error(self):
+    with self.assertRaisesRegex(ValueError, "slots"):
+      self._climatology.get_toa_incident_solar_radiation(
+          np.array(["2031-02-28T07"], "datetime64[ns]")
+      )
+
+  def test_load_memory_maps_values(self):
+    climatology = tisr_climatology.load(self._path)
+
+    self.assertIsInstance(climatology.values, np.memmap)
+    np.testing.assert_array_equal(
+        climatology.values, self._climatology.values
+    )
+    np.testing.assert_array_equal(climatology.lat, _LAT)
+    np.testing.assert_array_equal(climatology.lon, _LON)
+    self.assertEqual(climatology.reference_year, 2020)
+    self.assertEqual(climatology.slots_per_day, 4)
+
+  def test_load_missing_raises_file_not_found_error(self):
+    with self.assertRaises(FileNotFoundError):
+      tisr_climatology.load(os.path.join(self._tmp_dir.name, "missing"))
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -15,6 +15,9 @@
 
 from typing import NamedTuple, Any, Union, Tuple, Mapping, TypeVar
 
+import jax
+import numpy as np
+
 ArrayLike = Union[Any]  # np.ndarray, jnp.ndarray, tf.tensor
 ArrayLikeTree = Union[Any, ArrayLike]  # Nest of ArrayLike
 
@@ -95,3 +98,32 @@ class TypedGraph(NamedTuple):
 
   def edge_by_name(self, name: str) -> EdgeSet:
     return self.edges[self.edge_key_by_name(name)]
+
+
+def sort_edges_by_receiver(graph: TypedGraph) -> TypedGraph:
+  """Permutes the edges of every edge set so they are sorted by receiver.
+
+  Edges with the same receiver keep their relative order, and features are
+  permuted along with the indices. With a flat batch of graphs, edges remain
+  grouped by graph, since the receiver indices of each graph are offset by the
+  number of nodes in the previous ones.
+
+  Aggregating messages from sorted edges can use sorted segment reductions
+  (see `receivers_are_sorted` in `typed_graph_net.GraphNetwork`).
+
+  Args:
+    graph: Graph with numpy arrays as indices and edge features.
+
+  Returns:
+    The graph with the edges of every edge set sorted by receiver.
+  """
+  edges = {}
+  for edge_set_key, edge_set in graph.edges.items():
+    order = np.argsort(edge_set.indices.receivers, kind="stable")
+    edges[edge_set_key] = edge_set._replace(
+        indices=EdgesIndices(
+            senders=np.asarray(edge_set.indices.senders)[order],
+            receivers=np.asarray(edge_set.indices.receivers)[order]),
+        features=jax.tree_util.tree_map(
+            lambda x: np.asarray(x)[order], edge_set.features))  # pylint: disable=cell-var-from-loop
+  return graph._replace(edges=edges)
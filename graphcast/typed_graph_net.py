@@ -13,9 +13,11 @@
 # limitations under the License.
 """A library of typed Graph Neural Networks."""
 
-from typing import Callable, Mapping, Optional, Union
+import functools
+from typing import Any, Callable, Mapping, Optional, Union
 
 from graphcast import typed_graph
+import jax
 import jax.numpy as jnp
 import jax.tree_util as tree
 import jraph
@@ -37,6 +39,10 @@ GNUpdateGlobalFn = Callable[
     [Mapping[str, NodeFeatures], Mapping[str, EdgeFeatures], Globals],
     Globals]
 
+# Signature of `jax.lax.scan`:
+# (fn, init, xs) -> (carry, ys)
+ScanFn = Callable[[Callable[[Any, Any], Any], Any, Any], Any]
+
 
 def GraphNetwork(  # pylint: disable=invalid-name
     update_edge_fn: Mapping[str, jraph.GNUpdateEdgeFn],
@@ -48,6 +54,10 @@ def GraphNetwork(  # pylint: disable=invalid-name
     .segment_sum,
     aggregate_edges_for_globals_fn: jraph.AggregateEdgesToGlobalsFn = jraph
     .segment_sum,
+    gather_nodes_in_edge_fn: bool = False,
+    edge_chunk_size: Optional[int] = None,
+    scan_fn: ScanFn = jax.lax.scan,
+    receivers_are_sorted: bool = False,
     ):
   """Returns a method that applies a configured GraphNetwork.
 
@@ -77,10 +87,44 @@ def GraphNetwork(  # pylint: disable=invalid-name
       globals.
     aggregate_edges_for_globals_fn: function used to aggregate the edges for the
       globals.
+    gather_nodes_in_edge_fn: If True, the edge functions are passed the sender
+      and receiver node features without gathering them to the edges, followed
+      by the sender and receiver indices, so they can do the gathering
+      themselves, e.g. after projecting the node features (see
+      `mlp.GatherAfterProjectMLP`).
+    edge_chunk_size: If set, each edge set is updated in chunks of this many
+      edges, whose messages are aggregated into the receiver nodes as they are
+      computed, which bounds the peak memory used by the edge updates. In this
+      mode, `aggregate_edges_for_nodes_fn` must be a sum (it is applied to each
+      chunk, and the results are added up), the updated edge features are not
+      materialized (the returned graph has the input edge features for the
+      updated edge sets, and sent messages are not passed to the node update
+      functions), and there cannot be a global update. Partial sums are
+      accumulated in at least float32. Edges sorted by receiver result in
+      fewer partial sums.
+    scan_fn: Function used to loop over the edge chunks, with the signature of
+      `jax.lax.scan`. Must be `hk.scan` if the edge functions use Haiku modules.
+    receivers_are_sorted: Whether the edges of all edge sets are sorted by
+      receiver (see `typed_graph.sort_edges_by_receiver`). If True,
+      `aggregate_edges_for_nodes_fn` is passed `indices_are_sorted=True` when
+      aggregating messages to the receivers, which lets XLA use a sorted
+      segment reduction rather than a generic scatter-add.
 
   Returns:
     A method that applies the configured GraphNetwork.
   """
+  if edge_chunk_size is not None:
+    if update_global_fn:
+      raise ValueError("Global updates are not supported with edge chunking.")
+    if gather_nodes_in_edge_fn:
+      raise ValueError(
+          "`gather_nodes_in_edge_fn` is not supported with edge chunking.")
+
+  if receivers_are_sorted:
+    aggregate_received_edges_fn = functools.partial(
+        aggregate_edges_for_nodes_fn, indices_are_sorted=True)
+  else:
+    aggregate_received_edges_fn = aggregate_edges_for_nodes_fn
 
   def _apply_graph_net(graph: typed_graph.TypedGraph) -> typed_graph.TypedGraph:
     """Applies a configured GraphNetwork to a graph.
@@ -101,17 +145,27 @@ def GraphNetwork(  # pylint: disable=invalid-name
 
     # Edge update.
     updated_edges = dict(updated_graph.edges)
+    # Messages already aggregated to the receivers, for chunked edge updates.
+    aggregated_received_features = {}
     for edge_set_name, edge_fn in update_edge_fn.items():
       edge_set_key = graph.edge_key_by_name(edge_set_name)
-      updated_edges[edge_set_key] = _edge_update(
-          updated_graph, edge_fn, edge_set_key)
+      if edge_chunk_size is None:
+        updated_edges[edge_set_key] = _edge_update(
+            updated_graph, edge_fn, edge_set_key, gather_nodes_in_edge_fn)
+      else:
+        aggregated_received_features[edge_set_name] = (
+            _chunked_edge_update_and_aggregation(
+                updated_graph, edge_fn, edge_set_key,
+                aggregate_received_edges_fn, edge_chunk_size, scan_fn,
+                receivers_are_sorted))
     updated_graph = updated_graph._replace(edges=updated_edges)
 
     # Node update.
     updated_nodes = dict(updated_graph.nodes)
     for node_set_key, node_fn in update_node_fn.items():
       updated_nodes[node_set_key] = _node_update(
-          updated_graph, node_fn, node_set_key, aggregate_edges_for_nodes_fn)
+          updated_graph, node_fn, node_set_key, aggregate_edges_for_nodes_fn,
+          aggregated_received_features, aggregate_received_edges_fn)
     updated_graph = updated_graph._replace(nodes=updated_nodes)
 
     # Global update.
@@ -127,7 +181,7 @@ def GraphNetwork(  # pylint: disable=invalid-name
   return _apply_graph_net
 
 
-def _edge_update(graph, edge_fn, edge_set_key):  # pylint: disable=invalid-name
+def _edge_update(graph, edge_fn, edge_set_key, gather_nodes_in_edge_fn=False):  # pylint: disable=invalid-name
   """Updates an edge set of a given key."""
 
   sender_nodes = graph.nodes[edge_set_key.node_sets[0]]
@@ -136,29 +190,129 @@ def _edge_update(graph, edge_fn, edge_set_key):  # pylint: disable=invalid-name
   senders = edge_set.indices.senders  # pytype: disable=attribute-error
   receivers = edge_set.indices.receivers  # pytype: disable=attribute-error
 
-  sent_attributes = tree.tree_map(
-      lambda n: n[senders], sender_nodes.features)
-  received_attributes = tree.tree_map(
-      lambda n: n[receivers], receiver_nodes.features)
-
   n_edge = edge_set.n_edge
   sum_n_edge = senders.shape[0]
   global_features = tree.tree_map(
       lambda g: jnp.repeat(g, n_edge, axis=0, total_repeat_length=sum_n_edge),
       graph.context.features)
+
+  if gather_nodes_in_edge_fn:
+    new_features = edge_fn(
+        edge_set.features, sender_nodes.features, receiver_nodes.features,
+        senders, receivers, global_features)
+    return edge_set._replace(features=new_features)
+
+  sent_attributes = tree.tree_map(
+      lambda n: n[senders], sender_nodes.features)
+  received_attributes = tree.tree_map(
+      lambda n: n[receivers], receiver_nodes.features)
+
   new_features = edge_fn(
       edge_set.features, sent_attributes, received_attributes,
       global_features)
   return edge_set._replace(features=new_features)
 
 
-def _node_update(graph, node_fn, node_set_key, aggregation_fn):  # pylint: disable=invalid-name
+def _chunked_edge_update_and_aggregation(  # pylint: disable=invalid-name
+    graph, edge_fn, edge_set_key, aggregation_fn, chunk_size, scan_fn,
+    receivers_are_sorted=False):
+  """Updates an edge set in chunks, returning the aggregated messages."""
+
+  sender_nodes = graph.nodes[edge_set_key.node_sets[0]]
+  receiver_nodes = graph.nodes[edge_set_key.node_sets[1]]
+  edge_set = graph.edges[edge_set_key]
+  senders = edge_set.indices.senders  # pytype: disable=attribute-error
+  receivers = edge_set.indices.receivers  # pytype: disable=attribute-error
+  sum_n_edge = senders.shape[0]
+  sum_n_receiver_node = tree.tree_leaves(receiver_nodes.features)[0].shape[0]
+
+  n_edge = edge_set.n_edge
+  global_features = tree.tree_map(
+      lambda g: jnp.repeat(g, n_edge, axis=0, total_repeat_length=sum_n_edge),
+      graph.context.features)
+
+  # Pad the edges to a multiple of the chunk size, with padding edges pointing
+  # to an out of range receiver, so their messages are dropped.
+  num_chunks = max(-(-sum_n_edge // chunk_size), 1)
+  num_padding_edges = num_chunks * chunk_size - sum_n_edge
+
+  def to_chunks(x, padding_value=0):
+    x = jnp.pad(x, [(0, num_padding_edges)] + [(0, 0)] * (x.ndim - 1),
+                constant_values=padding_value)
+    return x.reshape((num_chunks, chunk_size) + x.shape[1:])
+
+  chunks = (
+      tree.tree_map(to_chunks, edge_set.features),
+      to_chunks(senders),
+      to_chunks(receivers, padding_value=sum_n_receiver_node),
+      tree.tree_map(to_chunks, global_features),
+  )
+
+  def aggregate_chunk(chunk):
+    features, chunk_senders, chunk_receivers, chunk_globals = chunk
+    sent_attributes = tree.tree_map(
+        lambda n: n[chunk_senders], sender_nodes.features)
+    received_attributes = tree.tree_map(
+        lambda n: n[chunk_receivers], receiver_nodes.features)
+    messages = edge_fn(
+        features, sent_attributes, received_attributes, chunk_globals)
+
+    # Aggregate the messages within the chunk into one segment per run of
+    # edges with the same receiver (so one segment per receiver if the edges
+    # are sorted by receiver), then scatter those to the receivers.
+    is_segment_start = jnp.concatenate(
+        [jnp.ones([1], dtype=bool), chunk_receivers[1:] != chunk_receivers[:-1]])
+    segment_ids = jnp.cumsum(is_segment_start) - 1
+    segment_receivers = jnp.full(
+        [chunk_size], sum_n_receiver_node, dtype=chunk_receivers.dtype
+        ).at[segment_ids].set(chunk_receivers)
+    segment_features = tree.tree_map(
+        lambda m: aggregation_fn(m, segment_ids, chunk_size), messages)
+    return segment_receivers, segment_features
+
+  def accumulate(accumulated, segment_receivers, segment_features):
+    return tree.tree_map(
+        lambda acc, f: acc.at[segment_receivers].add(  # pylint: disable=g-long-lambda
+            f.astype(acc.dtype), mode="drop",
+            indices_are_sorted=receivers_are_sorted),
+        accumulated, segment_features)
+
+  # The first chunk is processed outside of the loop to get the shapes and
+  # dtypes of the aggregated messages.
+  first_chunk, other_chunks = (
+      tree.tree_map(lambda x: x[0], chunks),
+      tree.tree_map(lambda x: x[1:], chunks))
+  segment_receivers, segment_features = aggregate_chunk(first_chunk)
+  accumulated = tree.tree_map(
+      lambda f: jnp.zeros(  # pylint: disable=g-long-lambda
+          (sum_n_receiver_node,) + f.shape[1:],
+          dtype=jnp.promote_types(f.dtype, jnp.float32)),
+      segment_features)
+  accumulated = accumulate(accumulated, segment_receivers, segment_features)
+
+  def body(accumulated, chunk):
+    return accumulate(accumulated, *aggregate_chunk(chunk)), None
+
+  if num_chunks > 1:
+    accumulated, _ = scan_fn(body, accumulated, other_chunks)
+  return tree.tree_map(
+      lambda acc, f: acc.astype(f.dtype), accumulated, segment_features)
+
+
+def _node_update(graph, node_fn, node_set_key, aggregation_fn,  # pylint: disable=invalid-name
+                 aggregated_received_features=None,
+                 received_aggregation_fn=None):
   """Updates an edge set of a given key."""
+  received_aggregation_fn = received_aggregation_fn or aggregation_fn
   node_set = graph.nodes[node_set_key]
   sum_n_node = tree.tree_leaves(node_set.features)[0].shape[0]
+  aggregated_received_features = aggregated_received_features or {}
 
   sent_features = {}
   for edge_set_key, edge_set in graph.edges.items():
+    if edge_set_key.name in aggregated_received_features:
+      # The updated features of chunked edge sets are not available.
+      continue
     sender_node_set_key = edge_set_key.node_sets[0]
     if sender_node_set_key == node_set_key:
       assert isinstance(edge_set.indices, typed_graph.EdgesIndices)
@@ -169,11 +323,16 @@ def _node_update(graph, node_fn, node_set_key, aggregation_fn):  # pylint: disab
   received_features = {}
   for edge_set_key, edge_set in graph.edges.items():
     receiver_node_set_key = edge_set_key.node_sets[1]
-    if receiver_node_set_key == node_set_key:
+    if edge_set_key.name in aggregated_received_features:
+      if receiver_node_set_key == node_set_key:
+        received_features[edge_set_key.name] = aggregated_received_features[
+            edge_set_key.name]
+    elif receiver_node_set_key == node_set_key:
       assert isinstance(edge_set.indices, typed_graph.EdgesIndices)
       receivers = edge_set.indices.receivers
       received_features[edge_set_key.name] = tree.tree_map(
-          lambda e: aggregation_fn(e, receivers, sum_n_node), edge_set.features)  # pylint: disable=cell-var-from-loop
+          lambda e: received_aggregation_fn(e, receivers, sum_n_node),  # pylint: disable=cell-var-from-loop
+          edge_set.features)
 
   n_node = node_set.n_node
   global_features = tree.tree_map(
@@ -231,7 +390,11 @@ def InteractionNetwork(  # pylint: disable=invalid-name
                                        InteractionUpdateNodeFnNoSentEdges]],
     aggregate_edges_for_nodes_fn: jraph.AggregateEdgesToNodesFn = jraph
     .segment_sum,
-    include_sent_messages_in_node_update: bool = False):
+    include_sent_messages_in_node_update: bool = False,
+    gather_nodes_in_edge_fn: bool = False,
+    edge_chunk_size: Optional[int] = None,
+    scan_fn: ScanFn = jax.lax.scan,
+    receivers_are_sorted: bool = False):
   """Returns a method that applies a configured InteractionNetwork.
 
   An interaction network computes interactions on the edges based on the
@@ -252,14 +415,32 @@ def InteractionNetwork(  # pylint: disable=invalid-name
       node.
     include_sent_messages_in_node_update: pass edge features for which a node is
       a sender to the node update function.
+    gather_nodes_in_edge_fn: If True, the edge functions are passed the sender
+      and receiver node features without gathering them to the edges, followed
+      by the sender and receiver indices (see `GraphNetwork`).
+    edge_chunk_size: If set, edges are updated and aggregated in chunks of this
+      size, to bound peak memory. The updated edge features are not
+      materialized in this mode (see `GraphNetwork`).
+    scan_fn: Function used to loop over the edge chunks (see `GraphNetwork`).
+    receivers_are_sorted: Whether the edges are sorted by receiver, so the
+      received messages can be aggregated with sorted segment reductions (see
+      `GraphNetwork`).
   """
+  if edge_chunk_size is not None and include_sent_messages_in_node_update:
+    raise ValueError(
+        "Sent messages are not available with edge chunking.")
   # An InteractionNetwork is a GraphNetwork without globals features,
   # so we implement the InteractionNetwork as a configured GraphNetwork.
 
   # An InteractionNetwork edge function does not have global feature inputs,
   # so we filter the passed global argument in the GraphNetwork.
-  wrapped_update_edge_fn = tree.tree_map(
-      lambda fn: lambda e, s, r, g: fn(e, s, r), update_edge_fn)
+  if gather_nodes_in_edge_fn:
+    wrapped_update_edge_fn = tree.tree_map(
+        lambda fn: lambda e, s, r, s_idx, r_idx, g: fn(e, s, r, s_idx, r_idx),
+        update_edge_fn)
+  else:
+    wrapped_update_edge_fn = tree.tree_map(
+        lambda fn: lambda e, s, r, g: fn(e, s, r), update_edge_fn)
 
   # Similarly, we wrap the update_node_fn to ensure only the expected
   # arguments are passed to the Interaction net.
@@ -272,7 +453,11 @@ def InteractionNetwork(  # pylint: disable=invalid-name
   return GraphNetwork(
       update_edge_fn=wrapped_update_edge_fn,
       update_node_fn=wrapped_update_node_fn,
-      aggregate_edges_for_nodes_fn=aggregate_edges_for_nodes_fn)
+      aggregate_edges_for_nodes_fn=aggregate_edges_for_nodes_fn,
+      gather_nodes_in_edge_fn=gather_nodes_in_edge_fn,
+      edge_chunk_size=edge_chunk_size,
+      scan_fn=scan_fn,
+      receivers_are_sorted=receivers_are_sorted)
 
 
 def GraphMapFeatures(  # pylint: disable=invalid-name
@@ -626,9 +626,109 @@ def pmap(fn: Callable[..., Any],
 
   return result_fn
 
+
+def vmap(fn: Callable[..., Any],
+         dim: str,
+         axis_name: Optional[str] = None) -> Callable[..., Any]:
+  """Wraps a subset of jax.vmap functionality to handle xarray input/output.
+
+  Unlike `pmap`, arguments don't all need to have the `dim` dimension: any
+  xarray data with `dim` is mapped over it (it is transposed to be the leading
+  axis if needed), and any xarray data without it is broadcast to all
+  elements, i.e. uses in_axes=None. Non-xarray array arguments are always
+  mapped over their leading axis. All return values have `dim` as their
+  leading dimension.
+
+  Args:
+    fn: Function to be vmap'd which takes and returns trees which may contain
+      xarray Dataset/DataArray.
+    dim: The xarray dimension name that is vmapped over.
+    axis_name: Used by jax to identify the mapped axis so that collectives can
+      be applied. Defaults to same as `dim`.
+
+  Returns:
+    A vmap'd version of `fn`, which takes Dataset/DataArray with or without the
+    dimension `dim`, and returns Dataset/DataArray with an extra leading
+    dimension `dim` relative to what the original `fn` sees.
+  """
+  def result_fn(*args):
+    args = tree_map_variables(
+        lambda v: v.transpose(dim, ...) if dim in v.dims else v, args)
+    # Each xarray.Variable flattens to a single leaf, so the leaves of the
+    # Variables are in the same order as the flattened arrays.
+    variables = jax.tree.leaves(
+        args, is_leaf=lambda x: isinstance(x, xarray.Variable))
+    in_axes = tuple(
+        (0 if dim in leaf.dims else None)
+        if isinstance(leaf, xarray.Variable) else 0
+        for leaf in variables)
+    flat_args, input_treedef = jax.tree_util.tree_flatten(args)
+    assert len(flat_args) == len(in_axes)
+    output_treedef = None
+
+    def fn_passed_to_vmap(*flat_args):
+      # Inside the vmap the mapped dimension will no longer be present:
+      with dims_change_on_unflatten(
+          lambda dims: tuple(d for d in dims if d != dim)):
+        args = jax.tree_util.tree_unflatten(input_treedef, flat_args)
+      result = fn(*args)
+      nonlocal output_treedef
+      flat_result, output_treedef = jax.tree_util.tree_flatten(result)
+      return flat_result
+
+    flat_result = jax.vmap(
+        fn_passed_to_vmap,
+        in_axes=in_axes,
+        out_axes=0,
+        axis_name=axis_name or dim)(*flat_args)
+    assert output_treedef is not None
+    # After the vmap an extra leading axis will be present, we need to add an
+    # xarray dimension for this when unflattening the result:
+    with dims_change_on_unflatten(lambda dims: (dim,) + dims):
+      return jax.tree_util.tree_unflatten(output_treedef, flat_result)
+
+  return result_fn
+
+
 _PyTree = TypeVar('_PyTree')
 
 
+def shard(
+    data: _PyTree,
+    mesh: jax.sharding.Mesh,
+    dims_to_axes: Mapping[Hashable, Union[str, Tuple[str, ...]]],
+) -> _PyTree:
+  """Places xarray data on a device mesh, sharding some of its dimensions.
+
+  This is the `jax.sharding` counterpart of preparing data for `pmap`: arrays
+  keep their xarray dimensions, and functions jitted over the result are
+  partitioned by the compiler following the input shardings, so their outputs
+  stay sharded on device too.
+
+  Args:
+    data: Any pytree which may contain xarray datatypes, see
+      `tree_map_with_dims`.
+    mesh: Mesh of devices to place the arrays on.
+    dims_to_axes: Mapping from xarray dimension names to the mesh axis name (or
+      tuple of axis names) they are sharded over. The sizes of these dimensions
+      must be divisible by the number of devices along those axes. Arrays are
+      replicated along any dimension not in this mapping, and plain arrays
+      outside of xarray data are replicated entirely.
+
+  Returns:
+    A pytree of the same structure as `data`, with its arrays on `mesh`.
+  """
+  def put(array, dims):
+    if dims is None:
+      spec = jax.sharding.PartitionSpec()
+    else:
+      spec = jax.sharding.PartitionSpec(
+          *(dims_to_axes.get(dim) for dim in dims))
+    return jax.device_put(array, jax.sharding.NamedSharding(mesh, spec))
+
+  return tree_map_with_dims(put, data)
+
+
 def tree_map_variables(
     func: Callable[[xarray.Variable], xarray.Variable],
     tree_data: _PyTree) -> _PyTree:
@@ -463,6 +463,51 @@ class XarrayJaxTest(absltest.TestCase):
         jax.device_get(dataset + 1),
         jax.device_get(result))
 
+  def test_vmap(self):
+    foo = jnp.arange(3 * 4, dtype=np.float32).reshape((3, 4))
+    bar = jnp.ones((2, 3, 5), dtype=np.float32)
+    mapped = xarray_jax.Dataset(
+        {'foo': (('lat', 'sample'), foo),
+         'bar': (('time', 'lat', 'sample'), jnp.ones((2, 3, 4)))},
+        coords={'lat': np.arange(3)})
+    broadcast = xarray_jax.Dataset({'bar': (('time', 'lat', 'lon'), bar)})
+    keys = jnp.arange(4)
+
+    def func(m, b, k):
+      self.assertNotIn('sample', m.dims)
+      self.assertEqual(k.shape, ())
+      return (m['foo'] + b['bar'] * k).sum('time')
+    func = xarray_jax.vmap(func, dim='sample')
+
+    result = func(mapped, broadcast, keys)
+    self.assertEqual(result.dims, ('sample', 'lat', 'lon'))
+    expected = (mapped['foo'] + broadcast['bar'] * xarray.DataArray(
+        np.arange(4), dims='sample')).sum('time')
+    xarray.testing.assert_allclose(
+        jax.device_get(result),
+        jax.device_get(expected.transpose('sample', 'lat', 'lon')))
+
+  def test_shard(self):
+    devices = jax.devices()
+    mesh = jax.sharding.Mesh(np.array(devices), ('devices',))
+    dataset = xarray.Dataset(
+        {'foo': (('sample', 'lat'), np.ones((len(devices), 3), np.float32)),
+         'bar': (('lat',), np.arange(3, dtype=np.float32))},
+        coords={'lat': np.arange(3)})
+    keys = np.zeros((5, 2), np.uint32)
+
+    sharded, sharded_keys = xarray_jax.shard(
+        (dataset, keys), mesh, {'sample': 'devices'})
+    self.assertEqual(
+        xarray_jax.unwrap_data(sharded['foo']).sharding.spec,
+        jax.sharding.PartitionSpec('devices', None))
+    self.assertEqual(
+        xarray_jax.unwrap_data(sharded['bar']).sharding.spec,
+        jax.sharding.PartitionSpec(None))
+    self.assertEqual(
+        sharded_keys.sharding.spec, jax.sharding.PartitionSpec())
+    xarray.testing.assert_identical(jax.device_get(sharded), dataset)
+
   def test_pmap_with_jax_coords(self):
     devices = jax.local_device_count()
     foo = jnp.zeros((devices, 3, 4), dtype=np.float32)
@@ -15,7 +15,7 @@ import haiku as hk
 import jax
 import numpy as np
 import xarray
-from download.preprocess13 import get_input, get_targets, get_forcings
+from download.preprocess13 import get_cached_input, get_targets, get_cached_forcings
 
 
 with open(r'model/params/graphcast_params_GraphCast - ERA5 1979-2017 - resolution 0.25 - pressure levels 37 - mesh 2to6 - precipitation input and output.npz', 'rb') as model:
@@ -46,11 +46,11 @@ eval_inputs, eval_targets, eval_forcings = data_utils.extract_inputs_targets_for
 
 # print(eval_forcings.time)
 
-# eval_inputs = get_input()
+# eval_inputs = get_cached_input(datetime.datetime(2024, 7, 12))
 print(eval_inputs)
 # eval_targets = get_targets()
 print(eval_targets)
-# eval_forcings = get_forcings(2024, 7, 12)
+# eval_forcings = get_cached_forcings(2024, 7, 12)
 print(eval_forcings)
 
 
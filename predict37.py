@@ -15,7 +15,7 @@ import haiku as hk
 import jax
 import numpy as np
 import xarray
-from download.preprocess37 import get_input, get_targets, get_forcings
+from download.preprocess37 import get_cached_input, get_targets, get_cached_forcings
 
 
 with open(r'model/params/graphcast_params_GraphCast - ERA5 1979-2017 - resolution 0.25 - pressure levels 37 - mesh 2to6 - precipitation input and output.npz', 'rb') as model:
@@ -46,11 +46,12 @@ with open(r'model/stats/stddev_by_level.nc', 'rb') as f:
 
 # print(eval_forcings.time)
 
-eval_inputs = get_input()
+# Derived from the downloads on the first run, then read from download/cache.
+eval_inputs = get_cached_input(datetime.datetime(2024, 7, 12))
 print(eval_inputs)
 eval_targets = get_targets(4)
 print(eval_targets)
-eval_forcings = get_forcings(2024, 7, 12, 4)
+eval_forcings = get_cached_forcings(2024, 7, 12, 4)
 print(eval_forcings)
 
 
@@ -135,12 +136,17 @@ print("Eval Targets:  ", eval_targets.dims.mapping)
 print("Eval Forcings: ", eval_forcings.dims.mapping)
 
 
-predictions = rollout.chunked_prediction(
+# Only the 13 published levels are transferred to host and written, the
+# rollout itself still uses all 37 levels.
+output_spec = rollout.OutputSpec(
+    levels=[50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000])
+
+ds_13lev = rollout.chunked_prediction(
     run_forward_jitted,
     rng=jax.random.PRNGKey(0),
     inputs=eval_inputs,
     targets_template=eval_targets * np.nan,
-    forcings=eval_forcings)
+    forcings=eval_forcings,
+    output_spec=output_spec)
 
-ds_13lev = predictions.sel(level=[50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000])
 ds_13lev.to_netcdf("predictions_6h.h5", format="NETCDF4")
\ No newline at end of file
@@ -42,9 +42,7 @@ setup(
         "matplotlib",
         "numpy",
         "pandas",
-        "rtree",
         "scipy",
-        "trimesh",
         "typing_extensions",
         "xarray",
         "xarray_tensorstore"